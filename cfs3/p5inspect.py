@@ -1,5 +1,5 @@
 from pyfive.inspect import p5ncdump
-from cfs3.s3core import get_user_config, Capturing
+from cfs3.s3core import get_user_config, Capturing, DEFAULT_POOL_SIZE
 import s3fs
 
 def p5view(alias, bucket, path, object, special=False):
@@ -13,7 +13,8 @@ def p5view(alias, bucket, path, object, special=False):
                 'secret':credentials['secretKey'],  
                 'endpoint_url':credentials['url'],
                 'default_cache_type':'readahead',
-                'default_block_size': 1 * MB 
+                'default_block_size': 1 * MB,
+                'config_kwargs': {'max_pool_connections': DEFAULT_POOL_SIZE},
     }
     if path == '' or path=='/':
         bits = [bucket,object]
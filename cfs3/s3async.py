@@ -0,0 +1,207 @@
+import asyncio
+import functools
+import threading
+import weakref
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from cfs3.s3core import DEFAULT_POOL_SIZE
+
+_lock = threading.Lock()
+_executor = None
+_loop = None
+_loop_thread = None
+# marks the threads of the shared executor
+_worker = threading.local()
+
+
+def _mark_worker():
+    _worker.active = True
+
+
+def shared_executor():
+    """
+    The long-lived executor (sized to the client connection pool) which blocking
+    S3 calls are handed to, created the first time it is needed and then reused,
+    so fan-outs don't pay for a new pool of threads each time.
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DEFAULT_POOL_SIZE, thread_name_prefix='cfs3-s3',
+                                           initializer=_mark_worker)
+        return _executor
+
+
+@contextmanager
+def fanout_executor(max_workers):
+    """
+    The executor for a fan-out of up to max_workers blocking calls: the shared one,
+    unless we are on one of its threads already. Then the others may all be busy
+    waiting on fan-outs like this one, so queueing behind them could deadlock, and
+    we use a private pool instead.
+    """
+    if not getattr(_worker, 'active', False):
+        yield shared_executor()
+        return
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cfs3-s3-nested')
+    try:
+        yield executor
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _background_loop():
+    """ The long-lived event loop, running on a thread of its own, which run() uses """
+    global _loop, _loop_thread
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name='cfs3-async-loop',
+                                            daemon=True)
+            _loop_thread.start()
+        return _loop
+
+
+async def amap(func, items, concurrency=DEFAULT_POOL_SIZE, executor=None, semaphore=None):
+    """
+    Apply the blocking function func to each of items, with at most
+    concurrency calls in flight, and return a list of (item, result)
+    pairs in the order of items. If a call raises, the exception is
+    returned as the result rather than raised, so one bad object does
+    not lose the rest.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = semaphore or asyncio.Semaphore(concurrency)
+
+    async def one(item):
+        async with semaphore:
+            try:
+                return item, await loop.run_in_executor(executor, func, item)
+            except Exception as e:
+                return item, e
+
+    return await asyncio.gather(*[one(item) for item in items])
+
+
+class AsyncS3:
+    """
+    asyncio flavour of the s3core primitives for a (Minio-like) client.
+
+    Minio is a blocking client, so each request is handed to an executor
+    sized to the client connection pool (by default the long-lived shared
+    one), while a semaphore bounds the number of requests in flight. Any
+    number of coroutines can be queued behind that without costing an OS
+    thread each.
+
+    Usage:
+        async with AsyncS3(client) as s3:
+            results = await s3.stat_many(bucket, keys)
+    """
+    def __init__(self, client, concurrency=DEFAULT_POOL_SIZE, executor=None):
+        """
+        Args:
+            client: a Minio client (or anything which looks like one)
+            concurrency (int, optional): Maximum requests in flight. Defaults to DEFAULT_POOL_SIZE.
+            executor (optional): Where to run the requests. Defaults to the shared executor.
+        """
+        self.client = client
+        self.concurrency = concurrency
+        self._executor = executor or shared_executor()
+        # semaphores belong to a particular event loop
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return self._semaphores[loop]
+
+    async def _call(self, func, *args, **kwargs):
+        async with self._semaphore():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(func, *args, **kwargs))
+
+    async def map(self, func, items):
+        """
+        Bounded concurrent map of a blocking function, see amap
+        """
+        return await amap(func, items, executor=self._executor,
+                          semaphore=self._semaphore())
+
+    async def list(self, bucket, prefix=None, recursive=False, **kwargs):
+        """ List objects (all pages) as a list """
+        return await self._call(
+            lambda: list(self.client.list_objects(bucket, prefix=prefix,
+                                                  recursive=recursive, **kwargs)))
+
+    async def stat(self, bucket, key, **kwargs):
+        return await self._call(self.client.stat_object, bucket, key, **kwargs)
+
+    async def get_tags(self, bucket, key):
+        return await self._call(self.client.get_object_tags, bucket, key)
+
+    async def set_tags(self, bucket, key, tags):
+        return await self._call(self.client.set_object_tags, bucket, key, tags)
+
+    async def copy(self, bucket, key, source, **kwargs):
+        return await self._call(self.client.copy_object, bucket, key, source, **kwargs)
+
+    async def delete(self, bucket, key):
+        return await self._call(self.client.remove_object, bucket, key)
+
+    async def put(self, bucket, key, file_path, metadata=None, **kwargs):
+        return await self._call(self.client.fput_object, bucket, key, file_path,
+                                metadata=metadata, **kwargs)
+
+    async def stat_many(self, bucket, keys):
+        """ HEAD many objects, returning (key, Object or exception) pairs """
+        return await self.map(lambda k: self.client.stat_object(bucket, k), keys)
+
+    def close(self):
+        """ Nothing to release: the executor outlives us, to be reused """
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def run(coro):
+    """
+    Run a coroutine to completion from synchronous code, on the long-lived
+    background event loop (so this works even when the caller is already
+    inside an event loop, e.g. in IPython).
+    """
+    loop = _background_loop()
+    if threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError('run() called on the cfs3 event loop, await the coroutine instead')
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def map_concurrently(func, items, concurrency=DEFAULT_POOL_SIZE):
+    """
+    Synchronous wrapper of amap on the shared executor: returns (item, result
+    or exception) pairs.
+    """
+    items = list(items)
+    if not items:
+        return []
+    with fanout_executor(min(concurrency, len(items))) as executor:
+        return run(amap(func, items, concurrency=concurrency, executor=executor))
+
+
+def stat_objects(client, bucket, keys, concurrency=DEFAULT_POOL_SIZE):
+    """
+    Synchronous wrapper of AsyncS3.stat_many
+    """
+    with AsyncS3(client, concurrency) as s3:
+        return run(s3.stat_many(bucket, list(keys)))
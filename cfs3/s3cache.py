@@ -4,13 +4,55 @@ import json
 import time
 import os
 import threading
-from dataclasses import dataclass
+import uuid
+import weakref
+from fnmatch import fnmatchcase
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, replace
 from enum import Enum, auto
-from typing import Optional, Dict, Any, Iterator, List
+from typing import Optional, Dict, Any, Iterable, Iterator, List
 from minio import Minio
 from minio.datatypes import Object
 from minio.commonconfig import CopySource
+from minio.error import S3Error, ServerError
 from datetime import datetime
+from cfs3.s3shard import sharded_list_objects
+from cfs3.s3core import DEFAULT_POOL_SIZE, desanitise_metadata, get_endpoints, get_user_config
+from cfs3.s3async import map_concurrently
+from cfs3.s3stats import CacheStats
+
+
+SCHEMA_VERSION = 4
+""" Bumped when the cache schema changes, so older caches are upgraded on open """
+
+MAX_IDLE_READERS = 32
+""" Reader connections kept open for reuse (matching the default client pool size) """
+
+EVICTION_ORDER = {
+    "lru": "last_access ASC",
+    "lfu": "access_count ASC, last_access ASC",
+}
+""" Eviction policies, and the order in which each evicts rows """
+
+EVICT_TO = 0.9
+""" Eviction goes below the size limit by this fraction, so it doesn't run every flush """
+
+MISSING_CODES = ("NoSuchKey", "NoSuchBucket")
+""" S3 error codes which mean there is nothing there, and so can be cached """
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "cfs3")
+""" Where s3view and the Uploader keep the persistent caches (one per alias) by default """
+
+_STANDARD_HEADERS = ("content-type", "cache-control", "content-disposition", "content-encoding",
+                     "content-language", "expires")
+
+SNAPSHOT_VERSION = 1
+""" Format of exported cache snapshots, which must match to mount or import one """
+
+_OBJECT_COLUMNS = "bucket, key, etag, size, last_modified, metadata, tags, cached_at, parent, row_bytes"
 
 
 # -----------------------
@@ -27,7 +69,14 @@ class CachedObject:
     cached_at: Optional[float]      # epoch seconds when cached (None if not cached)
     age_seconds: Optional[float]    # now - cached_at
     stale: bool                     # True if cached and stale (based on TTL)
-    source: str                     # 'cache' or 's3' or 'none'
+    source: str                     # 'cache', 's3', 'revalidated' (cached, confirmed by S3) or 'none'
+
+    def __getattr__(self, name):
+        # anything else is asked of the object, so a CachedObject can stand in for one
+        obj = self.__dict__.get("obj")
+        if obj is None:
+            raise AttributeError(name)
+        return getattr(obj, name)
 
 
 class CacheMode(Enum):
@@ -35,6 +84,7 @@ class CacheMode(Enum):
     BYPASS = auto()        # Always fetch from S3, don't touch cache
     CACHE_ONLY = auto()    # Use only cache; if not present return CachedObject with obj=None
     FORCE_REFRESH = auto() # Always fetch from S3 and update cache
+    STALE_WHILE_REVALIDATE = auto()  # Use cache even if stale, refreshing stale entries in the background
 
 
 # -----------------------
@@ -48,6 +98,213 @@ def _isoformat(dt: Optional[datetime]) -> Optional[str]:
     return dt.isoformat() if dt else None
 
 
+def _same_time(cached: Optional[str], dt: Optional[datetime]) -> bool:
+    """
+    Compare a cached last_modified with a live one. Listings report milliseconds
+    and HEAD responses whole seconds, so we only compare to the second. Missing
+    values don't count as a difference.
+    """
+    if not cached or dt is None:
+        return True
+    try:
+        return datetime.fromisoformat(cached).replace(microsecond=0) == dt.replace(microsecond=0)
+    except (TypeError, ValueError):
+        return False
+
+
+def _normalise_metadata(metadata) -> Optional[Dict[str, str]]:
+    """
+    Metadata arrives as an HTTPHeaderDict (from a HEAD) or a dict (from a listing
+    with user metadata), with whatever capitalisation the server used. We keep
+    a plain dict with lower case keys.
+    """
+    if not metadata:
+        return None
+    return {k.lower(): v for k, v in metadata.items()}
+
+
+def _sent_metadata(content_type: Optional[str], metadata) -> Dict[str, Any]:
+    """
+    The metadata a HEAD would show for an object we uploaded with content_type
+    and metadata (which, like the client, we prefix with x-amz-meta- unless
+    it is a standard header).
+    """
+    sent = {"content-type": content_type} if content_type else {}
+    for k, v in (metadata or {}).items():
+        k = k.lower()
+        if not k.startswith("x-amz-") and k not in _STANDARD_HEADERS:
+            k = f"x-amz-meta-{k}"
+        sent[k] = v
+    return sent
+
+
+def _user_entries(metadata: Optional[Dict[str, Any]]) -> List[tuple]:
+    """
+    The (name, value) pairs of the user metadata in an object's metadata: named
+    without the x-amz-meta- prefix (in lower case) and desanitised, with one pair
+    for each element of a list value, and values as strings.
+    """
+    user = {k.lower()[11:]: v for k, v in (metadata or {}).items() if k.lower().startswith("x-amz-meta-")}
+    try:
+        user = desanitise_metadata(user)
+    except (AttributeError, ValueError):
+        # not sanitised by us
+        pass
+    entries = []
+    for name, value in user.items():
+        for v in value if isinstance(value, list) else [value]:
+            entries.append((name, v if isinstance(v, str) else json.dumps(v)))
+    return entries
+
+
+def _lacking_user_meta(entries: List[CachedObject]) -> bool:
+    """ True if any of these cached listing entries was cached without its user metadata """
+    return any(co.metadata is None and not co.is_dir for co in entries)
+
+
+def _listed_tags(s3obj: Object) -> Optional[Dict[str, str]]:
+    """ The tags a listing with user metadata reported for an object (MinIO does), if any """
+    tags = getattr(s3obj, "tags", None)
+    return dict(tags) if tags else None
+
+
+def _index_entries(bucket: str, key: str, metadata: Optional[str]) -> List[tuple]:
+    """
+    The (bucket, key, name, value) entries for the metadata index from a row's
+    (JSON) metadata.
+    """
+    if not metadata:
+        return []
+    return [(bucket, key, name, value) for name, value in _user_entries(json.loads(metadata))]
+
+
+def metadata_matches(metadata: Optional[Dict[str, Any]], matches: Dict[str, str],
+                     text: Optional[str] = None) -> bool:
+    """
+    True if an object's metadata is found by PersistentCachedMinio.search with these
+    matches and text: its user metadata has every name=value in matches (where a value
+    may be a glob, and a list value matches if any element does), and text (if given)
+    in any name or value.
+    """
+    entries = _user_entries(metadata)
+    for name, value in matches.items():
+        if not any(n == name.lower() and fnmatchcase(v, str(value)) for n, v in entries):
+            return False
+    if text:
+        text = text.lower()
+        return any(text in n.lower() or text in v.lower() for n, v in entries)
+    return True
+
+
+def _is_missing(e: Exception) -> bool:
+    return isinstance(e, S3Error) and e.code in MISSING_CODES
+
+
+class _RememberedMissing(S3Error):
+    """ A "no such object" error repeated from the cache rather than from S3 """
+
+
+def _outcome(co: CachedObject) -> str:
+    """ How a lookup was answered (see s3stats.CACHE_OUTCOMES), from what it returned """
+    if co.source == "cache":
+        return "stale" if co.stale else "hit"
+    return {"s3": "miss", "revalidated": "revalidated"}.get(co.source, "none")
+
+
+def _listing_outcome(entries: List[CachedObject]) -> str:
+    """ How a listing answered from the cache was answered """
+    if not entries:
+        return "none"
+    return "stale" if any(co.stale for co in entries) else "hit"
+
+
+def _error_outcome(e: Exception) -> str:
+    if isinstance(e, _RememberedMissing):
+        return "negative"
+    return "miss" if _is_missing(e) else "error"
+
+
+def _parent(key: str) -> str:
+    """
+    The "directory" holding key: everything up to and including the last "/"
+    (ignoring a trailing one), or "" at the top of the bucket.
+    """
+    return key[:key.rstrip("/").rfind("/") + 1]
+
+
+def _ancestors(key: str) -> List[str]:
+    """
+    Every "directory" which holds key, from the top of the bucket ("") down.
+    """
+    parent = _parent(key)
+    return [""] + [parent[:i + 1] for i, c in enumerate(parent) if c == "/"]
+
+
+def _prefix_range(prefix: str) -> tuple:
+    """
+    Keys starting with prefix are exactly those in [lower, upper), so prefix
+    queries can be range scans on the (bucket, key) index rather than LIKE
+    (which can't use it, and treats "_" and "%" in keys as wildcards).
+    upper is None for the empty prefix.
+    """
+    if not prefix:
+        return "", None
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _prefix_query(select: str, bucket: str, prefix: str, limit: Optional[int] = None,
+                  after: Optional[str] = None) -> tuple:
+    """
+    Complete select (from objects) with a range scan for the keys in bucket
+    starting with prefix (and if given, coming after after), in key order,
+    returning (sql, parameters).
+    """
+    lower, upper = _prefix_range(prefix)
+    sql, params = f"{select} WHERE bucket=? AND key>=?", [bucket, lower]
+    if after is not None:
+        sql += " AND key>?"
+        params.append(after)
+    if upper is not None:
+        sql += " AND key<?"
+        params.append(upper)
+    sql += " ORDER BY key"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, params
+
+
+def _add_delta(deltas: Dict[tuple, List[int]], bucket: str, key: str, nobjects: int, nbytes: int):
+    """ Accumulate the change to the rollup of every directory holding key """
+    if not nobjects and not nbytes:
+        return
+    for prefix in _ancestors(key):
+        delta = deltas.setdefault((bucket, prefix), [0, 0])
+        delta[0] += nobjects
+        delta[1] += nbytes
+
+
+def _dir_entry(bucket: str, key: str, source: str = "s3",
+               cached_at: Optional[float] = None) -> CachedObject:
+    """
+    A CachedObject for a "directory" (common prefix) in a delimited listing.
+    There is nothing to cache about these, they are known from a listing
+    (or from the objects we have cached below them).
+    """
+    return CachedObject(
+        obj=Object(bucket_name=bucket, object_name=key),
+        bucket=bucket,
+        key=key,
+        metadata=None,
+        tags=None,
+        cached=source == "cache",
+        cached_at=cached_at,
+        age_seconds=_now() - cached_at if cached_at is not None else None,
+        stale=False,
+        source=source
+    )
+
+
 def _obj_from_row(row: sqlite3.Row) -> Object:
     """
     Recreate a minio.datatypes.Object (or similar object) from DB row.
@@ -71,6 +328,181 @@ def _obj_from_row(row: sqlite3.Row) -> Object:
     )
 
 
+class _MemoryTier:
+    """
+    Bounded LRU of decoded CachedObjects, keyed by (bucket, key), which sits in
+    front of SQLite so repeated lookups need neither the database lock nor any
+    decoding. Entries are bounded both in number and (estimated) bytes. It has
+    its own lock, which is never held for longer than a dictionary operation.
+    """
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[CachedObject]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: tuple, co: CachedObject, nbytes: int):
+        if self.max_entries <= 0 or nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (co, nbytes)
+            self._bytes += nbytes
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, n) = self._entries.popitem(last=False)
+                self._bytes -= n
+
+    def pop(self, key: tuple):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _row_nbytes(row) -> int:
+    """ Rough size of a decoded row in memory """
+    return 256 + len(row["key"]) + len(row["metadata"] or "") + len(row["tags"] or "")
+
+
+def _stored_nbytes(row) -> int:
+    """
+    Rough size of a row in the database, including its metadata index entries, which
+    are each stored twice (in meta_index and in idx_meta_index_value)
+    """
+    entries = _index_entries(row["bucket"], row["key"], row["metadata"])
+    return _row_nbytes(row) + sum(2 * (16 + sum(len(part) for part in e)) for e in entries)
+
+
+def _readonly_uri(path: str) -> str:
+    """
+    A URI opening path read-only and immutable: snapshots are never changed in place
+    (a new export replaces the file), so readers need no locks, even on shared filesystems.
+    """
+    return f"file:{quote(os.path.abspath(path))}?mode=ro&immutable=1"
+
+
+def _create_snapshot_schema(conn: sqlite3.Connection):
+    conn.execute("CREATE TABLE snapshot (name TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("""
+        CREATE TABLE objects (
+            bucket TEXT NOT NULL,
+            key TEXT NOT NULL,
+            etag TEXT,
+            size INTEGER,
+            last_modified TEXT,
+            metadata TEXT,
+            tags TEXT,
+            cached_at REAL,
+            parent TEXT,
+            row_bytes INTEGER,
+            PRIMARY KEY (bucket, key)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX idx_objects_parent ON objects(bucket, parent, key)")
+    conn.execute("""
+        CREATE TABLE dirs (
+            bucket TEXT NOT NULL,
+            prefix TEXT NOT NULL,
+            parent TEXT,
+            nobjects INTEGER NOT NULL,
+            nbytes INTEGER NOT NULL,
+            PRIMARY KEY (bucket, prefix)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE listings (
+            bucket TEXT NOT NULL,
+            prefix TEXT NOT NULL,
+            recursive INTEGER NOT NULL,
+            listed_at REAL,
+            dirs TEXT,
+            PRIMARY KEY (bucket, prefix, recursive)
+        )
+    """)
+
+
+def snapshot_info(path: str) -> Dict[str, Any]:
+    """
+    Return the description of a cache snapshot (its id, bucket, prefix, number of
+    rows and when it was made), checking it is one we can use.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    conn = sqlite3.connect(_readonly_uri(path), uri=True)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} is not a version {SNAPSHOT_VERSION} cache snapshot (found {version})")
+        info = dict(conn.execute("SELECT name, value FROM snapshot").fetchall())
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f"{path} is not a cache snapshot: {e}")
+    finally:
+        conn.close()
+    return {"id": info["id"], "bucket": info["bucket"], "prefix": info["prefix"],
+            "rows": int(info["rows"]), "created_at": float(info["created_at"])}
+
+
+def cache_path(alias: str, directory: str = CACHE_DIR) -> str:
+    """
+    The database file holding the cache for alias in directory
+    (":memory:" as the directory gives every alias an in-memory cache).
+    """
+    if directory == ":memory:":
+        return directory
+    return os.path.join(directory, quote(alias, safe="") + ".db")
+
+
+def alias_endpoint(alias: str, config_file: Optional[str] = None) -> Optional[str]:
+    """
+    The endpoint (as PersistentCachedMinio records it) of the server an alias is
+    configured for, if it is configured: all its candidate URLs, sorted, rather than
+    the one EndpointSelector happens to pick, so that only a configuration change
+    clears the cache.
+    """
+    try:
+        credentials = get_user_config(alias, config_file, resolve=False)
+    except (OSError, ValueError):
+        return None
+    return " ".join(sorted(get_endpoints(credentials))) or None
+
+
+def _flush_ticks(ref, closed: threading.Event, interval: float):
+    """
+    Every interval seconds, until it is closed (or has gone), flush the write buffer
+    of the cache behind the weak reference ref if it is due: otherwise rows buffered
+    just before a quiet spell would wait for the next cache operation to be written.
+    """
+    while not closed.wait(interval):
+        cache = ref()
+        if cache is None:
+            return
+        try:
+            cache._maybe_flush()
+        except Exception:
+            # (closing underneath us) the next tick, or close(), will try again
+            pass
+        del cache
+
+
 # -----------------------
 # PersistentCachedMinio
 # -----------------------
@@ -80,39 +512,238 @@ class PersistentCachedMinio:
 
     - Backed by SQLite (db_path)
     - TTL controls staleness
-    - max_db_size_mb controls eviction by file size (evict oldest cached rows)
+    - max_db_size_mb bounds the (accounted) size of the cached rows and their metadata
+      index entries. Past it, rows are
+      evicted, least recently used first (eviction="lru") or least frequently used
+      first ("lfu"), and the freed pages returned to the filesystem with an incremental
+      vacuum (for caches created with this version, older ones keep their pages).
+      Accesses are recorded in memory and written with the next batch.
+    - Lookups of objects which don't exist are remembered for negative_ttl seconds
+      (0 to disable), and repeated in DEFAULT mode without asking S3 again, unless
+      this client writes the object in the meantime.
+    - In STALE_WHILE_REVALIDATE mode stale entries (and stale complete listings) are
+      returned straight away, and refreshed on a pool of refresh_workers threads, at
+      most one refresh per entry at a time.
     - Methods return CachedObject instances for list/stat/get_tags
+    - Prefixes which have been listed completely are recorded, and while those records
+      are fresh, DEFAULT mode answers listings of them from the cache alone.
+    - With revalidate (the default), stale rows are checked rather than refetched: if a
+      listing entry, or a HEAD with If-None-Match, shows the etag and last_modified are
+      unchanged, the row is kept as it is and only its cached_at is bumped.
+    - Object rows are written behind: they are buffered and committed in batches
+      of write_batch_size (counting recorded accesses too), or when write_flush_interval
+      seconds have passed (checked by a background tick, so also while idle), and on
+      flush()/close(). Buffered rows are visible to lookups straight away.
+    - Decoded entries are also held in memory (an LRU of up to memory_entries entries
+      and memory_mb megabytes, 0 to disable), so repeated lookups avoid SQLite.
+    - Reads use a pool of connections, so WAL readers in different threads proceed
+      concurrently, and every write is made by a single writer thread on its own
+      connection. (An in-memory database can't be shared between connections,
+      so there reads and writes take turns on one connection.)
+    - mode is the CacheMode used when a call doesn't give one (so, for example, a
+      whole application can be switched to CACHE_ONLY to work offline).
+    - put_object and fput_object write through: the uploaded object is cached with
+      the metadata and tags it was sent with.
+    - export_snapshot() writes a bucket (or prefix) of the cache to a compact, read-only,
+      versioned file, which another cache can import_snapshot(), or mount as read-only
+      lower layers (snapshots, topmost first) under its own database. Lookups fall
+      through to the layers, anything written goes to the local database and hides the
+      layers below, and complete listings recorded in a layer are copied up when it is
+      first mounted.
+    - If endpoint (identifying the server, see alias_endpoint) is given, it is recorded in
+      the database, and a database recorded for a different endpoint is cleared before use,
+      so cached rows never answer for another server. AliasCaches keeps a database per alias.
     """
     def __init__(
         self,
         client: Minio,
         db_path: str = "s3cache.db",
         ttl: int = 3600,
-        max_db_size_mb: int = 0  # 0 means unlimited
+        max_db_size_mb: int = 0,  # 0 means unlimited
+        write_batch_size: int = 500,
+        write_flush_interval: float = 2.0,
+        revalidate: bool = True,
+        memory_entries: int = 10000,
+        memory_mb: float = 64,
+        eviction: str = "lru",
+        negative_ttl: int = 60,
+        refresh_workers: int = 4,
+        snapshots: Iterable[str] = (),
+        mode: CacheMode = CacheMode.DEFAULT,
+        endpoint: Optional[str] = None
     ):
         self._client = client
         self.db_path = db_path
         self.ttl = ttl
         self.max_db_size_mb = max_db_size_mb
+        self.write_batch_size = write_batch_size
+        self.write_flush_interval = write_flush_interval
+        self.revalidate = revalidate
+        if eviction not in EVICTION_ORDER:
+            raise ValueError(f"Unknown eviction policy {eviction}, expected one of {list(EVICTION_ORDER)}")
+        self.eviction = eviction
+        self.negative_ttl = negative_ttl
+        self.mode = mode
+        self.evictions = 0
+        # what the lookups found, see cache_stats()
+        self._stats = CacheStats()
+        # guards the in-process state (the write buffer and the reader pool), it is
+        # never held while waiting on the database
         self._lock = threading.RLock()
+        # write-behind buffer of object rows, keyed by (bucket, key)
+        self._pending: Dict[tuple, Dict[str, Any]] = {}
+        # accesses not yet written, (bucket, key) -> [last access, count]
+        self._accessed: Dict[tuple, List[float]] = {}
+        # revalidated rows whose new cached_at is not yet written, (bucket, key) -> cached_at
+        self._touched: Dict[tuple, float] = {}
+        self._last_flush = _now()
+        self._memory = _MemoryTier(memory_entries, int(memory_mb * 1024 * 1024))
+        self._local = threading.local()
+        self._idle_readers: List[sqlite3.Connection] = []
+        self._shared = db_path == ":memory:"
+        self._db_lock = threading.RLock() if self._shared else nullcontext()
+        # read-only snapshots mounted under the database (path, info), and the names
+        # to read objects and directories through, which take them into account
+        self._layers = []
+        self._objects = "objects"
+        self._dirs = "dirs"
 
         # Ensure directory exists
         os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
 
-        # Single connection guarded by lock
-        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        self._conn.row_factory = sqlite3.Row
+        # The writer connection, only used on the writer thread once we are set up
+        self._conn = self._connect()
         # Use WAL for better concurrency
         with self._conn:
+            # only takes effect on a new database, but lets eviction give space back
+            self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
             self._conn.execute("PRAGMA journal_mode=WAL;")
             self._conn.execute("PRAGMA synchronous=NORMAL;")
         self._init_db()
+        self.endpoint = endpoint
+        if endpoint is not None:
+            with self._conn:
+                self._check_endpoint(self._conn.cursor(), endpoint)
+        if snapshots:
+            self._layers = [(path, snapshot_info(path)) for path in snapshots]
+            self._objects = "visible_objects"
+            self._dirs = "visible_dirs"
+            self._attach(self._conn)
+            with self._conn:
+                self._mount_layers(self._conn.cursor())
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cfs3-cache-writer",
+                                          initializer=self._mark_writer)
+        self._refresher = ThreadPoolExecutor(max_workers=max(1, refresh_workers),
+                                             thread_name_prefix="cfs3-cache-refresh")
+        self._refreshing = set()
+        # a tick writes the buffer out while we are otherwise idle
+        self._closed = threading.Event()
+        if write_flush_interval > 0:
+            threading.Thread(target=_flush_ticks, args=(weakref.ref(self), self._closed, write_flush_interval),
+                             name="cfs3-cache-flush", daemon=True).start()
+
+    def _connect(self, readonly: bool = False) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        self._attach(conn)
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def _attach(self, conn: sqlite3.Connection):
+        """
+        Attach the mounted snapshots to conn, and define the views which read
+        through them: a row in a layer shows unless a layer above it (or the
+        database itself) has the same key, or it has been hidden.
+        """
+        if not self._layers:
+            return
+        arms = [f"SELECT {_OBJECT_COLUMNS} FROM main.objects"]
+        dirs = ["SELECT bucket, prefix, parent FROM main.dirs"]
+        for i, (path, _) in enumerate(self._layers):
+            conn.execute(f"ATTACH DATABASE ? AS snap{i}", (_readonly_uri(path),))
+            above = ["main.objects"] + [f"snap{j}.objects" for j in range(i)] + ["main.hidden"]
+            arms.append(f"SELECT {_OBJECT_COLUMNS} FROM snap{i}.objects s WHERE " + " AND ".join(
+                f"NOT EXISTS (SELECT 1 FROM {t} u WHERE u.bucket=s.bucket AND u.key=s.key)"
+                for t in above))
+            dirs.append(f"SELECT bucket, prefix, parent FROM snap{i}.dirs")
+        conn.execute("CREATE TEMP VIEW visible_objects AS " + " UNION ALL ".join(arms))
+        conn.execute("CREATE TEMP VIEW visible_dirs AS " + " UNION ".join(dirs))
+
+    def _mount_layers(self, cur: sqlite3.Cursor):
+        """ Copy up the complete listings of any snapshot we haven't mounted before """
+        for i, (path, info) in enumerate(self._layers):
+            if cur.execute("SELECT 1 FROM layers WHERE id=?", (info["id"],)).fetchone():
+                continue
+            self._copy_listings(cur, cur.execute(f"SELECT * FROM snap{i}.listings").fetchall())
+            cur.execute("INSERT INTO layers (id, path, mounted_at) VALUES (?, ?, ?)",
+                        (info["id"], path, _now()))
+
+    def _copy_listings(self, cur: sqlite3.Cursor, listings: List[sqlite3.Row]):
+        """ Record complete listings from elsewhere, unless ours are more recent """
+        cur.executemany("""
+            INSERT INTO listings (bucket, prefix, recursive, listed_at, dirs)
+            VALUES (:bucket, :prefix, :recursive, :listed_at, :dirs)
+            ON CONFLICT (bucket, prefix, recursive) DO UPDATE SET
+                listed_at=excluded.listed_at, dirs=excluded.dirs
+            WHERE excluded.listed_at > listings.listed_at
+        """, [dict(r) for r in listings])
+
+    def _mark_writer(self):
+        self._local.writer = True
+
+    def _write(self, fn, *args):
+        """
+        Run fn(cursor, *args) in a transaction on the writer thread and return
+        its result. Every change to the database goes through here, so there is
+        only ever one writer, and callers never hold locks while they wait.
+        """
+        if getattr(self._local, "writer", False):
+            # already on the writer thread, inside a transaction
+            return fn(self._conn.cursor(), *args)
+        return self._writer.submit(self._transaction, fn, *args).result()
+
+    def _transaction(self, fn, *args):
+        with self._db_lock, self._conn:
+            return fn(self._conn.cursor(), *args)
+
+    @contextmanager
+    def _reading(self):
+        """
+        Borrow a connection for reading, from the pool (or the writer's own
+        connection on the writer thread, or for an in-memory database).
+        """
+        if self._shared or getattr(self._local, "writer", False):
+            with self._db_lock:
+                yield self._conn
+            return
+        with self._lock:
+            conn = self._idle_readers.pop() if self._idle_readers else None
+        if conn is None:
+            conn = self._connect(readonly=True)
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                if len(self._idle_readers) < MAX_IDLE_READERS:
+                    self._idle_readers.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def _query(self, sql: str, params=()) -> List[sqlite3.Row]:
+        with self._reading() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def _query_one(self, sql: str, params=()) -> Optional[sqlite3.Row]:
+        with self._reading() as conn:
+            return conn.execute(sql, params).fetchone()
 
     # -------------------------
     # DB initialization
     # -------------------------
     def _init_db(self):
-        with self._lock, self._conn:
+        with self._conn:
             cur = self._conn.cursor()
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS buckets (
@@ -129,21 +760,133 @@ class PersistentCachedMinio:
                     metadata TEXT,
                     tags TEXT,
                     cached_at REAL,
+                    parent TEXT,
+                    last_access REAL,
+                    access_count INTEGER NOT NULL DEFAULT 0,
+                    row_bytes INTEGER,
                     PRIMARY KEY (bucket, key)
                 )
             """)
+            columns = [r["name"] for r in cur.execute("PRAGMA table_info(objects)")]
+            if "parent" not in columns:
+                # caches from before we kept the parent prefix
+                cur.execute("ALTER TABLE objects ADD COLUMN parent TEXT")
+                cur.executemany("UPDATE objects SET parent=? WHERE bucket=? AND key=?",
+                                [(_parent(r["key"]), r["bucket"], r["key"])
+                                 for r in cur.execute("SELECT bucket, key FROM objects").fetchall()])
+            if "row_bytes" not in columns:
+                # caches from before we tracked use and size
+                cur.execute("ALTER TABLE objects ADD COLUMN last_access REAL")
+                cur.execute("ALTER TABLE objects ADD COLUMN access_count INTEGER NOT NULL DEFAULT 0")
+                cur.execute("ALTER TABLE objects ADD COLUMN row_bytes INTEGER")
+                cur.execute("""
+                    UPDATE objects SET last_access = cached_at,
+                    row_bytes = 256 + length(key) + COALESCE(length(metadata), 0) + COALESCE(length(tags), 0)
+                """)
             cur.execute("CREATE INDEX IF NOT EXISTS idx_objects_bucket_key ON objects(bucket, key)")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_objects_cached_at ON objects(cached_at)")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_objects_parent ON objects(bucket, parent, key)")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_objects_lru ON objects(last_access)")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_objects_lfu ON objects(access_count, last_access)")
+            # object count and bytes below every "directory" we have cached objects in,
+            # kept up to date as rows are written and deleted
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS dirs (
+                    bucket TEXT NOT NULL,
+                    prefix TEXT NOT NULL,
+                    parent TEXT,
+                    nobjects INTEGER NOT NULL,
+                    nbytes INTEGER NOT NULL,
+                    PRIMARY KEY (bucket, prefix)
+                )
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_dirs_parent ON dirs(bucket, parent)")
+            # prefixes we have listed completely (recursive or delimited), and when;
+            # for delimited listings we also keep the "directories" found
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS listings (
+                    bucket TEXT NOT NULL,
+                    prefix TEXT NOT NULL,
+                    recursive INTEGER NOT NULL,
+                    listed_at REAL,
+                    dirs TEXT,
+                    PRIMARY KEY (bucket, prefix, recursive)
+                )
+            """)
+            # objects we looked for and didn't find
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS missing (
+                    bucket TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    code TEXT,
+                    message TEXT,
+                    missed_at REAL,
+                    PRIMARY KEY (bucket, key)
+                )
+            """)
+            # keys deleted here which mounted snapshots must not show, and the
+            # snapshots we have mounted before
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS hidden (
+                    bucket TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    PRIMARY KEY (bucket, key)
+                )
+            """)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS layers (
+                    id TEXT PRIMARY KEY,
+                    path TEXT,
+                    mounted_at REAL
+                )
+            """)
+            # what this database is a cache of
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS cache_info (
+                    name TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            """)
+            # an inverted index of the (desanitised) user metadata of the cached objects
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS meta_index (
+                    bucket TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    PRIMARY KEY (bucket, key, name, value)
+                ) WITHOUT ROWID
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_meta_index_value ON meta_index(bucket, name, value)")
+            if cur.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                self._rebuild_dirs(cur)
+                self._rebuild_meta_index(cur)
+                self._recount_row_bytes(cur)
+                cur.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            self._used_bytes = cur.execute("SELECT COALESCE(SUM(row_bytes), 0) FROM objects").fetchone()[0]
             self._conn.commit()
 
     # -------------------------
     # Internal cache helpers
     # -------------------------
+    def _check_endpoint(self, cur: sqlite3.Cursor, endpoint: str):
+        """ Clear a database which was caching a different server, and record ours """
+        row = cur.execute("SELECT value FROM cache_info WHERE name='endpoint'").fetchone()
+        if row is not None and row["value"] != endpoint:
+            self._clear(cur)
+        cur.execute("INSERT OR REPLACE INTO cache_info (name, value) VALUES ('endpoint', ?)", (endpoint,))
+
     def _get_row(self, bucket: str, key: str) -> Optional[sqlite3.Row]:
         with self._lock:
-            cur = self._conn.cursor()
-            cur.execute("SELECT * FROM objects WHERE bucket=? AND key=?", (bucket, key))
-            return cur.fetchone()
+            pending = self._pending.get((bucket, key))
+            touched = self._touched.get((bucket, key))
+        if pending is not None:
+            return pending
+        row = self._query_one(f"SELECT * FROM {self._objects} WHERE bucket=? AND key=?", (bucket, key))
+        if row is not None and touched is not None:
+            row = dict(row)
+            row["cached_at"] = touched
+        return row
 
     def _is_row_stale(self, row: sqlite3.Row) -> bool:
         if row is None:
@@ -165,134 +908,885 @@ class PersistentCachedMinio:
         metadata: Optional[Dict[str, Any]],
         tags: Optional[Dict[str, str]]
     ):
-        with self._lock, self._conn:
-            self._conn.execute("""
-                INSERT OR REPLACE INTO objects
-                (bucket, key, etag, size, last_modified, metadata, tags, cached_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                bucket,
-                key,
-                etag,
-                size,
-                _isoformat(last_modified),
-                json.dumps(metadata) if metadata else None,
-                json.dumps(tags) if tags else None,
-                _now()
-            ))
-            self._conn.commit()
-            if self.max_db_size_mb and self.max_db_size_mb > 0:
-                self._enforce_db_size_limit()
+        row = {
+            "bucket": bucket,
+            "key": key,
+            "etag": etag,
+            "size": size,
+            "last_modified": _isoformat(last_modified),
+            "metadata": json.dumps(metadata) if metadata else None,
+            "tags": json.dumps(tags) if tags else None,
+            "cached_at": _now(),
+            "parent": _parent(key)
+        }
+        self._stage_row(row)
+
+    def _stage_row(self, row: Dict[str, Any]):
+        """ Buffer a changed row for the next flush """
+        row["row_bytes"] = _stored_nbytes(row)
+        with self._lock:
+            self._pending[(row["bucket"], row["key"])] = row
+            self._touched.pop((row["bucket"], row["key"]), None)
+            self._memory.pop((row["bucket"], row["key"]))
+        self._maybe_flush()
+
+    def _note_access(self, bucket: str, key: str):
+        """ Remember a cache hit, to be written with the next batch """
+        with self._lock:
+            access = self._accessed.get((bucket, key))
+            if access is None:
+                self._accessed[(bucket, key)] = [_now(), 1]
+            else:
+                access[0] = _now()
+                access[1] += 1
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if (len(self._pending) + len(self._accessed) + len(self._touched) >= self.write_batch_size or
+                _now() - self._last_flush >= self.write_flush_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Commit all buffered object rows in one transaction, and then (once per
+        batch, rather than once per row) apply any size limit.
+        """
+        with self._lock:
+            self._last_flush = _now()
+            if not self._pending and not self._accessed and not self._touched:
+                return
+        self._write(self._flush_pending)
+
+    def _flush_pending(self, cur: sqlite3.Cursor):
+        # the buffer is read (and emptied) on the writer thread, so buffered rows
+        # and deletes reach the database in the order they were made
+        with self._lock:
+            rows = list(self._pending.values())
+            accessed, self._accessed = self._accessed, {}
+            touched, self._touched = self._touched, {}
+        deltas = {}
+        for row in rows:
+            cur.execute("SELECT size, row_bytes FROM objects WHERE bucket=? AND key=?",
+                        (row["bucket"], row["key"]))
+            old = cur.fetchone()
+            _add_delta(deltas, row["bucket"], row["key"], 0 if old else 1,
+                       (row["size"] or 0) - ((old["size"] or 0) if old else 0))
+            self._used_bytes += row["row_bytes"] - ((old["row_bytes"] or 0) if old else 0)
+        # usage survives a row being refreshed
+        cur.executemany("""
+            INSERT INTO objects
+            (bucket, key, etag, size, last_modified, metadata, tags, cached_at, parent,
+             last_access, row_bytes)
+            VALUES (:bucket, :key, :etag, :size, :last_modified, :metadata, :tags, :cached_at, :parent,
+                    :cached_at, :row_bytes)
+            ON CONFLICT (bucket, key) DO UPDATE SET
+                etag=excluded.etag, size=excluded.size, last_modified=excluded.last_modified,
+                metadata=excluded.metadata, tags=excluded.tags, cached_at=excluded.cached_at,
+                parent=excluded.parent, row_bytes=excluded.row_bytes
+        """, rows)
+        # whatever we have just seen exists
+        cur.executemany("DELETE FROM missing WHERE bucket=? AND key=?",
+                        [(row["bucket"], row["key"]) for row in rows])
+        if self._layers:
+            cur.executemany("DELETE FROM hidden WHERE bucket=? AND key=?",
+                            [(row["bucket"], row["key"]) for row in rows])
+        self._index_rows(cur, rows)
+        self._touch_rows(cur, [(t, bucket, key) for (bucket, key), t in touched.items()])
+        cur.executemany("""
+            UPDATE objects SET last_access=MAX(COALESCE(last_access, 0), ?), access_count=access_count+?
+            WHERE bucket=? AND key=?
+        """, [(t, n, bucket, key) for (bucket, key), (t, n) in accessed.items()])
+        self._apply_deltas(cur, deltas)
+        with self._lock:
+            for row in rows:
+                # unless it has been changed again since
+                if self._pending.get((row["bucket"], row["key"])) is row:
+                    del self._pending[(row["bucket"], row["key"])]
+        if self.max_db_size_mb and self.max_db_size_mb > 0:
+            self._evict(cur)
+
+    def close(self):
+        """
+        Flush any buffered writes and close the database
+        """
+        self._closed.set()
+        self._refresher.shutdown(wait=True, cancel_futures=True)
+        self.flush()
+        self._writer.shutdown(wait=True)
+        with self._lock:
+            for conn in self._idle_readers:
+                conn.close()
+            self._idle_readers = []
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _apply_deltas(self, cur: sqlite3.Cursor, deltas: Dict[tuple, List[int]]):
+        """ Apply accumulated changes to the directory rollups """
+        if not deltas:
+            return
+        cur.executemany("""
+            INSERT INTO dirs (bucket, prefix, parent, nobjects, nbytes) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (bucket, prefix) DO UPDATE SET
+                nobjects = nobjects + excluded.nobjects, nbytes = nbytes + excluded.nbytes
+        """, [(bucket, prefix, _parent(prefix) if prefix else None, n, b)
+              for (bucket, prefix), (n, b) in deltas.items()])
+        cur.execute("DELETE FROM dirs WHERE nobjects <= 0")
+
+    def _index_rows(self, cur: sqlite3.Cursor, rows: List[Dict[str, Any]]):
+        """ Replace the metadata index entries of rows """
+        cur.executemany("DELETE FROM meta_index WHERE bucket=? AND key=?",
+                        [(row["bucket"], row["key"]) for row in rows])
+        cur.executemany("INSERT OR IGNORE INTO meta_index (bucket, key, name, value) VALUES (?, ?, ?, ?)",
+                        [e for row in rows for e in _index_entries(row["bucket"], row["key"], row["metadata"])])
+
+    def _rebuild_meta_index(self, cur: sqlite3.Cursor):
+        """ Recompute the metadata index from scratch """
+        cur.execute("DELETE FROM meta_index")
+        self._index_rows(cur, cur.execute(
+            "SELECT bucket, key, metadata FROM objects WHERE metadata IS NOT NULL").fetchall())
+
+    def _recount_row_bytes(self, cur: sqlite3.Cursor):
+        """ Recompute the accounted size of every row (which now includes its index entries) """
+        cur.executemany("UPDATE objects SET row_bytes=? WHERE bucket=? AND key=?", [
+            (_stored_nbytes(r), r["bucket"], r["key"])
+            for r in cur.execute("SELECT bucket, key, metadata, tags FROM objects").fetchall()])
+
+    def _rebuild_dirs(self, cur: sqlite3.Cursor):
+        """ Recompute the directory rollups from scratch """
+        cur.execute("DELETE FROM dirs")
+        deltas = {}
+        for row in cur.execute("SELECT bucket, key, size FROM objects").fetchall():
+            _add_delta(deltas, row["bucket"], row["key"], 1, row["size"] or 0)
+        self._apply_deltas(cur, deltas)
+
+    def _delete_rows(self, cur: sqlite3.Cursor, keys: List[tuple], hide: bool = True):
+        """
+        Delete the (bucket, key) rows in keys, buffered or committed, keeping
+        the directory rollups in step, and (with hide) hiding them in any mounted
+        snapshots. The caller owns the transaction.
+        """
+        deltas = {}
+        for bucket, key in keys:
+            with self._lock:
+                self._pending.pop((bucket, key), None)
+                self._touched.pop((bucket, key), None)
+            self._memory.pop((bucket, key))
+            if hide and self._layers:
+                cur.execute("INSERT OR IGNORE INTO hidden (bucket, key) VALUES (?, ?)", (bucket, key))
+            cur.execute("SELECT size, row_bytes FROM objects WHERE bucket=? AND key=?", (bucket, key))
+            old = cur.fetchone()
+            if old is None:
+                continue
+            cur.execute("DELETE FROM objects WHERE bucket=? AND key=?", (bucket, key))
+            cur.execute("DELETE FROM meta_index WHERE bucket=? AND key=?", (bucket, key))
+            _add_delta(deltas, bucket, key, -1, -(old["size"] or 0))
+            self._used_bytes -= old["row_bytes"] or 0
+        self._apply_deltas(cur, deltas)
 
     def _delete_object_row(self, bucket: str, key: str):
-        with self._lock, self._conn:
-            self._conn.execute("DELETE FROM objects WHERE bucket=? AND key=?", (bucket, key))
-            self._conn.commit()
+        self._write(self._delete_rows, [(bucket, key)])
+
+    def _objects_written(self, bucket: str, keys: List[str]):
+        """
+        This client has written keys: anything we knew about them (or knew
+        wasn't there) is out of date, and so are the listings holding them.
+        """
+        def written(cur):
+            self._delete_rows(cur, [(bucket, key) for key in keys])
+            cur.executemany("DELETE FROM missing WHERE bucket=? AND key=?",
+                            [(bucket, key) for key in keys])
+        self._write(written)
+        self._invalidate_listings(bucket, keys)
+
+    def _record_missing(self, bucket: str, key: str, e: S3Error):
+        """ Remember that key isn't there (and forget anything else we had for it) """
+        if self.negative_ttl <= 0:
+            return
+
+        def missing(cur):
+            self._delete_rows(cur, [(bucket, key)])
+            cur.execute("""
+                INSERT OR REPLACE INTO missing (bucket, key, code, message, missed_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (bucket, key, e.code, e.message, _now()))
+        self._write(missing)
+
+    def _known_missing(self, bucket: str, key: str) -> Optional[S3Error]:
+        """ If we recently found key wasn't there, return the error to raise again """
+        if self.negative_ttl <= 0:
+            return None
+        row = self._query_one("SELECT * FROM missing WHERE bucket=? AND key=? AND missed_at>?",
+                              (bucket, key, _now() - self.negative_ttl))
+        if row is None:
+            return None
+        return _RememberedMissing(None, row["code"], row["message"], f"/{bucket}/{key}", None, None,
+                       bucket, key)
 
     def _update_tags_row(self, bucket: str, key: str, tags: Dict[str, str]):
-        with self._lock, self._conn:
-            self._conn.execute("UPDATE objects SET tags=?, cached_at=? WHERE bucket=? AND key=?",
-                               (json.dumps(tags), _now(), bucket, key))
-            self._conn.commit()
-            if self.max_db_size_mb and self.max_db_size_mb > 0:
-                self._enforce_db_size_limit()
+        row = self._get_row(bucket, key)
+        if row is None:
+            return
+        row = dict(row)
+        row["tags"] = json.dumps(tags)
+        row["cached_at"] = _now()
+        self._stage_row(row)
 
-    def _list_cached_keys_for_prefix(self, bucket: str, prefix: str) -> List[str]:
+    def _refresh_in_background(self, token: tuple, fn, *args):
+        """
+        Run fn(*args) on the refresh pool, unless a refresh for token is already
+        queued or running. A failed refresh just leaves the stale entry in place.
+        """
         with self._lock:
-            cur = self._conn.cursor()
-            # keys ordered lexicographically by key
-            cur.execute("SELECT key FROM objects WHERE bucket=? AND key LIKE ? ORDER BY key",
-                        (bucket, f"{prefix}%"))
-            return [r["key"] for r in cur.fetchall()]
+            if token in self._refreshing:
+                return
+            self._refreshing.add(token)
+
+        def refresh():
+            e1 = time.time()
+            try:
+                result = fn(*args)
+                outcome = _outcome(result) if isinstance(result, CachedObject) else "miss"
+            except Exception:
+                outcome = "error"
+            finally:
+                self._stats.record(token[1], "refresh", outcome, time.time() - e1)
+                with self._lock:
+                    self._refreshing.discard(token)
+
+        try:
+            self._refresher.submit(refresh)
+        except RuntimeError:
+            # closing
+            with self._lock:
+                self._refreshing.discard(token)
+
+    def _refresh_listing(self, bucket: str, prefix: str, recursive: bool):
+        for _ in self._list_objects(bucket, prefix, recursive, False, None, CacheMode.FORCE_REFRESH):
+            pass
+
+    def _row_matches(self, row, etag: Optional[str], last_modified: Optional[datetime]) -> bool:
+        """
+        True if live etag/last_modified confirm that a cached row is still current
+        """
+        if row is None or not self.revalidate or not row["etag"]:
+            return False
+        return row["etag"] == etag and _same_time(row["last_modified"], last_modified)
+
+    def _revalidated(self, row) -> CachedObject:
+        """
+        The object behind row hasn't changed: restart its TTL without touching
+        the stored metadata and tags (only cached_at is written, with the next
+        batch), and return it.
+        """
+        row = dict(row)
+        row["cached_at"] = _now()
+        key = (row["bucket"], row["key"])
+        with self._lock:
+            # a row which isn't written yet (or is only in a snapshot below us) has to be written in full
+            whole = key in self._pending or bool(self._layers)
+            if not whole:
+                self._touched[key] = row["cached_at"]
+        if whole:
+            self._stage_row(row)
+        else:
+            self._maybe_flush()
+        co = self._rows_to_cached_objects([row])[0]
+        co.source = "revalidated"
+        return co
+
+    def _select_prefix_rows(self, bucket: str, prefix: str) -> List[sqlite3.Row]:
+        self.flush()
+        return self._query(*_prefix_query(f"SELECT * FROM {self._objects}", bucket, prefix))
+
+    def _record_listing(self, bucket: str, prefix: str, recursive: bool, dirs: List[str]):
+        self._write(lambda cur: cur.execute("""
+            INSERT OR REPLACE INTO listings (bucket, prefix, recursive, listed_at, dirs)
+            VALUES (?, ?, ?, ?, ?)
+        """, (bucket, prefix, int(recursive), _now(), None if recursive else json.dumps(dirs))))
+
+    def _find_listing(self, bucket: str, prefix: str, recursive: bool,
+                      stale: bool = False) -> Optional[sqlite3.Row]:
+        """
+        Return a fresh (or with stale, the latest) record of a complete listing which
+        covers listing prefix, if there is one. A recursive listing covers every longer
+        prefix, a delimited listing only covers a delimited listing of the same prefix.
+        """
+        rows = self._query("""
+            SELECT * FROM listings WHERE bucket=? AND substr(?, 1, length(prefix)) = prefix
+            ORDER BY length(prefix) DESC
+        """, (bucket, prefix))
+        for row in rows:
+            if not stale and self._is_listing_stale(row):
+                continue
+            if row["recursive"] or (not recursive and row["prefix"] == prefix):
+                return row
+        return None
+
+    def _is_listing_stale(self, listing: sqlite3.Row) -> bool:
+        return self.ttl > 0 and _now() - listing["listed_at"] > self.ttl
+
+    def _invalidate_listings(self, bucket: str, keys: List[str]):
+        """
+        Forget the complete listings which include any of keys, because we have
+        changed what is there.
+        """
+        self._write(lambda cur: cur.executemany(
+            "DELETE FROM listings WHERE bucket=? AND substr(?, 1, length(prefix)) = prefix",
+            [(bucket, key) for key in keys]))
+
+    def _purge_unlisted(self, bucket: str, prefix: str, recursive: bool, seen: set):
+        """
+        After a complete listing, drop cached rows for objects which weren't in it
+        (they have been removed from S3 since we cached them).
+        """
+        gone = []
+        rows = self._select_prefix_rows(bucket, prefix) if recursive else self._children(bucket, prefix)[0]
+        for row in rows:
+            key = row["key"]
+            if key not in seen and (recursive or "/" not in key[len(prefix):]):
+                gone.append((bucket, key))
+        if gone:
+            self._write(self._delete_rows, gone)
+
+    def _listing_from_cache(self, bucket: str, prefix: str, recursive: bool,
+                            listing: sqlite3.Row) -> List[CachedObject]:
+        """
+        Answer a listing of prefix from the cache, using a covering complete listing
+        """
+        if recursive:
+            return self._rows_to_cached_objects(self._select_prefix_rows(bucket, prefix))
+        rows, dirs = self._children(bucket, prefix)
+        if not listing["recursive"]:
+            # we only know the contents of the directories from a recursive listing
+            dirs = json.loads(listing["dirs"]) if listing["dirs"] else []
+        return self._merge_children(bucket, rows, dirs, listing["listed_at"])
+
+    def _children(self, bucket: str, prefix: str) -> tuple:
+        """
+        Return the cached rows immediately below prefix, and the "directories"
+        with cached objects below prefix, both in key order. Both are index range
+        scans, so this costs O(children) rather than O(descendants).
+        """
+        parent = prefix[:prefix.rfind("/") + 1]
+        lower, upper = _prefix_range(prefix)
+        bound = "" if upper is None else " AND {0}<?"
+        params = [bucket, parent, lower] + ([] if upper is None else [upper])
+        self.flush()
+        with self._reading() as conn:
+            rows = conn.execute(f"SELECT * FROM {self._objects} WHERE bucket=? AND parent=? AND key>=?" +
+                                bound.format("key") + " ORDER BY key", params).fetchall()
+            dirs = [r["prefix"] for r in conn.execute(
+                f"SELECT prefix FROM {self._dirs} WHERE bucket=? AND parent=? AND prefix>=?" +
+                bound.format("prefix") + " ORDER BY prefix", params)]
+        return rows, dirs
+
+    def _merge_children(self, bucket: str, rows: List[sqlite3.Row], dirs: List[str],
+                        cached_at: Optional[float] = None) -> List[CachedObject]:
+        # "directory marker" objects (keys ending in "/") list as directories
+        dirs = set(dirs) | {r["key"] for r in rows if r["key"].endswith("/")}
+        entries = self._rows_to_cached_objects([r for r in rows if not r["key"].endswith("/")])
+        entries += [_dir_entry(bucket, d, "cache", cached_at) for d in dirs]
+        return sorted(entries, key=lambda co: co.key)
+
+    def list_children(self, bucket: str, prefix: str = "") -> List[CachedObject]:
+        """
+        Answer a delimited listing of prefix from the cache alone: the cached objects
+        immediately below it and the "directories" holding cached objects further
+        down, in key order. This is only as complete as the cache.
+        """
+        rows, dirs = self._children(bucket, prefix or "")
+        return self._merge_children(bucket, rows, dirs)
+
+    def du(self, bucket: str, prefix: str = "", by_child: bool = False):
+        """
+        Return (number of objects, total bytes) for the cached objects below prefix.
+        With by_child, return a dictionary of those for each "directory" immediately
+        below prefix, with the objects directly in prefix under prefix itself.
+        This is only as complete as the cache (so exact after a complete recursive
+        listing of prefix), but costs O(children) from the directory rollups.
+        (With snapshots mounted, the rollups don't allow for what the layers hide of
+        each other, so then we add up the visible objects instead.)
+        """
+        prefix = prefix or ""
+        self.flush()
+        if not by_child:
+            if (prefix.endswith("/") or prefix == "") and not self._layers:
+                row = self._query_one("SELECT nobjects, nbytes FROM dirs WHERE bucket=? AND prefix=?",
+                                      (bucket, prefix))
+                return (row["nobjects"], row["nbytes"]) if row else (0, 0)
+            # a partial name isn't a directory, so add up the objects matching it
+            row = self._query_one(*_prefix_query(
+                f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self._objects}", bucket, prefix))
+            return (row[0], row[1])
+        rows, dirs = self._children(bucket, prefix)
+        result = {}
+        files = [r for r in rows if not r["key"].endswith("/")]
+        if files:
+            result[prefix] = (len(files), sum(r["size"] or 0 for r in files))
+        if self._layers:
+            for d in dirs:
+                result[d] = self.du(bucket, d)
+            return result
+        with self._reading() as conn:
+            for d in dirs:
+                row = conn.execute("SELECT nobjects, nbytes FROM dirs WHERE bucket=? AND prefix=?",
+                                   (bucket, d)).fetchone()
+                result[d] = (row["nobjects"], row["nbytes"])
+        return result
+
+    def search(self, bucket: str, matches: Optional[Dict[str, str]] = None, prefix: str = "",
+               text: Optional[str] = None, limit: Optional[int] = None) -> List[CachedObject]:
+        """
+        Return the cached objects below prefix whose user metadata (named without the
+        x-amz-meta- prefix, and desanitised) has every name=value in matches, where a
+        value may be a glob (as for fnmatch, see metadata_matches), and if text is given, has it in any name or value (case
+        insensitively). This is answered from the cache without asking S3, so it is only
+        as complete as the cached metadata: warm() a prefix to search all of it.
+        """
+        selects, params = [], []
+        lower, upper = _prefix_range(prefix or "")
+        span = " AND key>=?" + ("" if upper is None else " AND key<?")
+        span_params = [lower] + ([] if upper is None else [upper])
+        classes = {}
+        for name, value in (matches or {}).items():
+            if "[" in str(value):
+                # GLOB and fnmatch disagree about character classes ([^x] against [!x]),
+                # so these are only narrowed down by name here, and matched as match does below
+                selects.append("SELECT key FROM meta_index WHERE bucket=? AND name=?" + span)
+                params += [bucket, name.lower()] + span_params
+                classes[name] = value
+                continue
+            selects.append("SELECT key FROM meta_index WHERE bucket=? AND name=? AND value GLOB ?" + span)
+            params += [bucket, name.lower(), str(value)] + span_params
+        if text:
+            pattern = "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            selects.append("SELECT key FROM meta_index WHERE bucket=? AND "
+                           "(name LIKE ? ESCAPE '\\' OR value LIKE ? ESCAPE '\\')" + span)
+            params += [bucket, pattern, pattern] + span_params
+        if not selects:
+            raise ValueError("Nothing to search for: give matches and/or text")
+        sql = f"SELECT * FROM objects WHERE bucket=? AND key IN ({' INTERSECT '.join(selects)}) ORDER BY key"
+        params = [bucket] + params
+        if limit is not None and not classes:
+            sql += " LIMIT ?"
+            params.append(limit)
+        self.flush()
+        rows = self._query(sql, params)
+        if classes:
+            rows = [r for r in rows if metadata_matches(json.loads(r["metadata"]), classes)]
+        if self._layers:
+            # only this database is indexed, so check rows from the snapshots directly
+            select = ("SELECT * FROM (SELECT * FROM visible_objects v WHERE metadata IS NOT NULL AND NOT EXISTS "
+                      "(SELECT 1 FROM main.objects o WHERE o.bucket=v.bucket AND o.key=v.key))")
+            rows += [r for r in self._query(*_prefix_query(select, bucket, prefix or ""))
+                     if metadata_matches(json.loads(r["metadata"]), matches or {}, text)]
+            rows = sorted(rows, key=lambda r: r["key"])
+        return self._rows_to_cached_objects(rows[:limit])
+
+    def _list_cached_keys_for_prefix(self, bucket: str, prefix: str) -> List[str]:
+        self.flush()
+        return [r["key"] for r in self._query(*_prefix_query(f"SELECT key FROM {self._objects}", bucket, prefix))]
+
+    def _aged(self, co: CachedObject) -> CachedObject:
+        """ A copy of a cached entry with its age and staleness as of now """
+        cached_at = co.cached_at
+        age = _now() - cached_at if cached_at else None
+        stale = False
+        if cached_at is None:
+            stale = True
+        elif self.ttl > 0 and age is not None:
+            stale = age > self.ttl
+        return replace(co, age_seconds=age, stale=stale)
 
     def _rows_to_cached_objects(self, rows: List[sqlite3.Row]) -> List[CachedObject]:
         out: List[CachedObject] = []
         for row in rows:
-            obj = _obj_from_row(row)
-            cached_at = row["cached_at"]
-            age = _now() - cached_at if cached_at else None
-            stale = False
-            if cached_at is None:
-                stale = True
-            elif self.ttl > 0 and age is not None:
-                stale = age > self.ttl
+            self._note_access(row["bucket"], row["key"])
+            memo = self._memory.get((row["bucket"], row["key"]))
+            if memo is not None and memo.cached_at == row["cached_at"]:
+                # already decoded
+                out.append(self._aged(memo))
+                continue
             tags = json.loads(row["tags"]) if row["tags"] else None
             metadata = json.loads(row["metadata"]) if row["metadata"] else None
-            out.append(CachedObject(
-                obj=obj,
+            co = CachedObject(
+                obj=_obj_from_row(row),
                 bucket=row["bucket"],
                 key=row["key"],
                 metadata=metadata,
                 tags=tags,
                 cached=True,
-                cached_at=cached_at,
-                age_seconds=age,
-                stale=stale,
+                cached_at=row["cached_at"],
+                age_seconds=None,
+                stale=False,
                 source="cache"
-            ))
+            )
+            self._memory.put((row["bucket"], row["key"]), co, _row_nbytes(row))
+            out.append(self._aged(co))
         return out
 
-    def _enforce_db_size_limit(self):
+    def _evict(self, cur: sqlite3.Cursor):
         """
-        If DB file size exceeds max_db_size_mb, evict oldest cached rows until under limit.
-        Eviction is done by deleting oldest `cached_at` rows.
+        If the cached rows take more than max_db_size_mb, evict rows in policy order
+        (on the writer thread, with the batch that took us over) until they take
+        EVICT_TO of it, then hand the free pages back.
         """
-        try:
-            size_bytes = os.path.getsize(self.db_path)
-        except OSError:
-            return
         limit_bytes = int(self.max_db_size_mb * 1024 * 1024)
-        if size_bytes <= limit_bytes:
+        if self._used_bytes <= limit_bytes:
             return
+        excess = self._used_bytes - int(limit_bytes * EVICT_TO)
+        order = EVICTION_ORDER[self.eviction]
+        # walk the index in policy order just far enough to free what we need
+        keys_to_delete, freed = [], 0
+        victims = self._conn.execute(f"SELECT bucket, key, row_bytes FROM objects ORDER BY {order}")
+        for r in victims:
+            if freed >= excess:
+                break
+            keys_to_delete.append((r["bucket"], r["key"]))
+            freed += r["row_bytes"] or 0
+        victims.close()
+        # (if a snapshot has an older copy of an evicted row, it can show again)
+        self._delete_rows(cur, keys_to_delete, hide=False)
+        self.evictions += len(keys_to_delete)
+        for bucket, n in Counter(b for b, _ in keys_to_delete).items():
+            self._stats.evicted(bucket, n)
+        # evicted rows leave holes in complete listings
+        cur.executemany(
+            "DELETE FROM listings WHERE bucket=? AND substr(?, 1, length(prefix)) = prefix",
+            keys_to_delete)
+        cur.execute("PRAGMA incremental_vacuum")
 
-        with self._lock, self._conn:
-            cur = self._conn.cursor()
-            # Count rows and iteratively delete in batches until size reduced
-            # We'll delete oldest rows first
-            while True:
-                try:
-                    size_bytes = os.path.getsize(self.db_path)
-                except OSError:
-                    break
-                if size_bytes <= limit_bytes:
-                    break
-                # Find N oldest rows (by cached_at)
-                cur.execute("SELECT bucket, key FROM objects ORDER BY cached_at ASC LIMIT 100")
-                rows = cur.fetchall()
-                if not rows:
-                    break
-                keys_to_delete = [(r["bucket"], r["key"]) for r in rows]
-                cur.executemany("DELETE FROM objects WHERE bucket=? AND key=?", keys_to_delete)
-                self._conn.commit()
+    def cache_size(self) -> Dict[str, int]:
+        """
+        Return the number of cached rows, their accounted size in bytes, and
+        the size of the database file(s) on disk.
+        """
+        self.flush()
+        rows = self._query_one("SELECT COUNT(*) FROM objects")[0]
+        on_disk = 0
+        for suffix in ("", "-wal"):
+            try:
+                on_disk += os.path.getsize(self.db_path + suffix)
+            except OSError:
+                pass
+        return {"rows": rows, "bytes": self._used_bytes, "file_bytes": on_disk}
+
+    def cache_stats(self, reset: bool = False) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """
+        Return what lookups through this client have found since it was created (or
+        last reset), as {bucket: {operation: statistics}}: for list_objects, stat_object
+        and get_object_tags, the count and seconds of each outcome (see
+        s3stats.CACHE_OUTCOMES), the hit ratio and an estimate of the time saved, and
+        the same for background refreshes ("refresh") and the rows evicted ("evict").
+        """
+        summary = self._stats.summary()
+        if reset:
+            self._stats.reset()
+        return summary
+
+    # -------------------------
+    # Snapshots
+    # -------------------------
+    def export_snapshot(self, path: str, bucket: str, prefix: str = "") -> Dict[str, Any]:
+        """
+        Write what we have cached for bucket below prefix (including from mounted
+        snapshots), with the complete listings covering it, to a new snapshot file
+        at path, and return its snapshot_info. The file is built alongside and
+        moved into place, so nobody sees a partial snapshot.
+        """
+        prefix = prefix or ""
+        self.flush()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        partial = f"{path}.partial"
+        if os.path.exists(partial):
+            os.remove(partial)
+        info = {"id": uuid.uuid4().hex, "bucket": bucket, "prefix": prefix,
+                "rows": 0, "created_at": _now()}
+        deltas = {}
+
+        def exported(rows):
+            for row in rows:
+                _add_delta(deltas, bucket, row["key"], 1, row["size"] or 0)
+                info["rows"] += 1
+                yield tuple(row)
+
+        listings = [dict(r) for r in self._query(
+            "SELECT * FROM listings WHERE bucket=? AND substr(prefix, 1, ?) = ?",
+            (bucket, len(prefix), prefix))]
+        covering = self._find_listing(bucket, prefix, True, stale=True)
+        if covering is not None and covering["prefix"] != prefix:
+            # a recursive listing above prefix means we have everything below it
+            listings.append({"bucket": bucket, "prefix": prefix, "recursive": 1,
+                             "listed_at": covering["listed_at"], "dirs": None})
+
+        snap = sqlite3.connect(partial)
+        try:
+            with snap:
+                _create_snapshot_schema(snap)
+                with self._reading() as conn:
+                    rows = conn.execute(*_prefix_query(
+                        f"SELECT {_OBJECT_COLUMNS} FROM {self._objects}", bucket, prefix))
+                    snap.executemany(f"INSERT INTO objects ({_OBJECT_COLUMNS}) VALUES "
+                                     f"({', '.join('?' * 10)})", exported(rows))
+                snap.executemany("INSERT INTO dirs VALUES (?, ?, ?, ?, ?)",
+                                 [(b, p, _parent(p) if p else None, n, nb)
+                                  for (b, p), (n, nb) in deltas.items()])
+                snap.executemany("""
+                    INSERT INTO listings (bucket, prefix, recursive, listed_at, dirs)
+                    VALUES (:bucket, :prefix, :recursive, :listed_at, :dirs)
+                """, listings)
+                snap.executemany("INSERT INTO snapshot (name, value) VALUES (?, ?)",
+                                 [(k, str(v)) for k, v in info.items()])
+                snap.execute(f"PRAGMA user_version={SNAPSHOT_VERSION}")
+            snap.execute("VACUUM")
+        finally:
+            snap.close()
+        os.replace(partial, path)
+        return info
+
+    def import_snapshot(self, path: str) -> int:
+        """
+        Copy the rows of a snapshot into this cache, where they are newer than
+        what we have, along with its complete listings. Returns the number of
+        rows copied.
+        """
+        snapshot_info(path)
+        copied = 0
+        snap = sqlite3.connect(_readonly_uri(path), uri=True)
+        snap.row_factory = sqlite3.Row
+        try:
+            for row in snap.execute(f"SELECT {_OBJECT_COLUMNS} FROM objects"):
+                ours = self._get_row(row["bucket"], row["key"])
+                if ours is not None and (ours["cached_at"] or 0) >= (row["cached_at"] or 0):
+                    continue
+                self._stage_row(dict(row))
+                copied += 1
+            listings = snap.execute("SELECT * FROM listings").fetchall()
+        finally:
+            snap.close()
+        self.flush()
+        self._write(self._copy_listings, listings)
+        return copied
+
+    # -------------------------
+    # Bulk warm-up
+    # -------------------------
+    def warm(
+        self,
+        bucket: str,
+        prefix: str = "",
+        with_metadata: bool = True,
+        with_tags: bool = False,
+        concurrency: int = DEFAULT_POOL_SIZE,
+        progress=None
+    ) -> Dict[str, int]:
+        """
+        Pre-populate the cache with everything below prefix: list it recursively
+        (in concurrent shards), then fetch the user metadata (and with_tags, the tags)
+        we don't already hold for an unchanged object, concurrency requests at a time.
+        Rows are written in batches of write_batch_size, and after each batch
+        progress(stage, done, total) is called, with stage "list", "metadata" or
+        "tags" (total is None while listing).
+        Returns counts of the objects listed, the metadata and tags fetched, and
+        the requests which failed.
+        """
+        def report(stage, done, total):
+            if progress is not None:
+                progress(stage, done, total)
+
+        summary = {"objects": 0, "metadata": 0, "tags": 0, "errors": 0}
+        need_metadata, need_tags = [], []
+        for co in self.list_objects(bucket, prefix=prefix, recursive=True,
+                                    cache_mode=CacheMode.FORCE_REFRESH):
+            if co.key.endswith("/"):
+                continue
+            summary["objects"] += 1
+            if with_metadata and not co.metadata:
+                need_metadata.append(co.key)
+            if with_tags and co.tags is None:
+                need_tags.append(co.key)
+            if summary["objects"] % self.write_batch_size == 0:
+                report("list", summary["objects"], None)
+        self.flush()
+        report("list", summary["objects"], summary["objects"])
+
+        self._fetch_all(bucket, "metadata", need_metadata, self._warm_metadata,
+                        concurrency, summary, report)
+        self._fetch_all(bucket, "tags", need_tags, self._warm_tags,
+                        concurrency, summary, report)
+        return summary
+
+    def _fetch_all(self, bucket: str, stage: str, keys: List[str], fetch, concurrency: int,
+                   summary: Dict[str, int], report):
+        """
+        Call fetch(bucket, key) for each of keys, concurrency at a time, a batch
+        at a time, counting successes under stage and failures under "errors".
+        """
+        for i in range(0, len(keys), self.write_batch_size):
+            batch = keys[i:i + self.write_batch_size]
+            for _, result in map_concurrently(lambda k: fetch(bucket, k), batch,
+                                              concurrency=concurrency):
+                summary["errors" if isinstance(result, Exception) else stage] += 1
+            self.flush()
+            report(stage, i + len(batch), len(keys))
+
+    def sync(
+        self,
+        bucket: str,
+        prefix: str = "",
+        with_metadata: bool = False,
+        concurrency: int = DEFAULT_POOL_SIZE,
+        progress=None
+    ) -> Dict[str, int]:
+        """
+        Bring the cache up to date with everything below prefix for the cost of one
+        (sharded) listing: merge it, in key order, with the cached rows for the same
+        range, and only write what has changed. New objects are inserted, objects
+        whose etag or size has changed are updated (and lose their metadata and tags,
+        which with_metadata are fetched again, concurrency at a time), objects no
+        longer listed are deleted, and the rest just have their TTL restarted.
+        progress(stage, done, total) is called as for warm(). Returns counts of each.
+        """
+        def report(stage, done, total):
+            if progress is not None:
+                progress(stage, done, total)
+
+        prefix = prefix or ""
+        self.flush()
+        summary = {"listed": 0, "inserted": 0, "updated": 0, "deleted": 0,
+                   "unchanged": 0, "metadata": 0, "errors": 0}
+        added, changed, gone, removed, unchanged = [], [], [], [], []
+
+        def apply(final=False):
+            # write the batch of deletes and TTL restarts we have built up
+            if gone and (final or len(gone) >= self.write_batch_size):
+                self._write(self._delete_rows, [(bucket, key) for key in gone])
+                summary["deleted"] += len(gone)
+                removed.extend(gone)
+                gone.clear()
+            if unchanged and (final or len(unchanged) >= self.write_batch_size):
+                now = _now()
+                self._write(self._touch_rows, [(now, bucket, key) for key in unchanged])
+                unchanged.clear()
+
+        cached = self._iter_prefix_rows(bucket, prefix)
+        row = next(cached, None)
+        for s3obj in sharded_list_objects(self._client, bucket, prefix=prefix, recursive=True):
+            key = s3obj.object_name
+            summary["listed"] += 1
+            while row is not None and row["key"] < key:
+                gone.append(row["key"])
+                row = next(cached, None)
+            if row is not None and row["key"] == key:
+                if row["etag"] == s3obj.etag and row["size"] == s3obj.size:
+                    summary["unchanged"] += 1
+                    if self._layers:
+                        # copy up what the snapshots told us
+                        self._stage_row(dict(row, cached_at=_now()))
+                    else:
+                        unchanged.append(key)
+                else:
+                    self._write_object_row(bucket, key, s3obj.etag, s3obj.size,
+                                           s3obj.last_modified, None, None)
+                    summary["updated"] += 1
+                    changed.append(key)
+                row = next(cached, None)
+            else:
+                self._write_object_row(bucket, key, s3obj.etag, s3obj.size,
+                                       s3obj.last_modified, None, None)
+                summary["inserted"] += 1
+                added.append(key)
+            apply()
+            if summary["listed"] % self.write_batch_size == 0:
+                report("list", summary["listed"], None)
+        while row is not None:
+            gone.append(row["key"])
+            row = next(cached, None)
+        apply(final=True)
+        self.flush()
+        report("list", summary["listed"], summary["listed"])
+
+        # what is there has changed, but we now know everything below prefix
+        if added or removed:
+            self._invalidate_listings(bucket, added + removed)
+        self._record_listing(bucket, prefix, True, [])
+        if with_metadata:
+            self._fetch_all(bucket, "metadata", added + changed, self._warm_metadata,
+                            concurrency, summary, report)
+        return summary
+
+    def _iter_prefix_rows(self, bucket: str, prefix: str, page: int = 1000) -> Iterator[sqlite3.Row]:
+        """
+        Generate the rows below prefix in key order, a page at a time, so we hold
+        neither all of them nor a connection while the caller works through them.
+        """
+        after = None
+        while True:
+            rows = self._query(*_prefix_query(f"SELECT * FROM {self._objects}", bucket, prefix,
+                                              page, after))
+            yield from rows
+            if len(rows) < page:
+                return
+            after = rows[-1]["key"]
+
+    def _touch_rows(self, cur: sqlite3.Cursor, touched: List[tuple]):
+        """ Restart the TTL of rows we know to be current, given (cached_at, bucket, key) """
+        cur.executemany("UPDATE objects SET cached_at=? WHERE bucket=? AND key=?", touched)
+
+    def _warm_metadata(self, bucket: str, key: str):
+        """ HEAD an object and cache it, keeping any tags we hold for the same etag """
+        stat = self._client.stat_object(bucket, key)
+        row = self._get_row(bucket, key)
+        tags = None
+        if row is not None and row["tags"] and row["etag"] == stat.etag:
+            tags = json.loads(row["tags"])
+        self._write_object_row(bucket, key, stat.etag, stat.size, stat.last_modified,
+                               _normalise_metadata(stat.metadata), tags)
+
+    def _warm_tags(self, bucket: str, key: str):
+        tags = self._client.get_object_tags(bucket, key)
+        self._update_tags_row(bucket, key, dict(tags) if tags else {})
 
     # -------------------------
     # Bucket ops
     # -------------------------
-    def list_buckets(self) -> List[Any]:
+    def list_buckets(self, cache_mode: Optional[CacheMode] = None) -> List[Any]:
         """
-        Return list of buckets. If we have buckets cached, return them, otherwise fetch and cache.
+        Return list of buckets, from the cache if the last listing of them is fresh
+        (the same ttl and cache_mode rules as object listings), otherwise fetch and cache.
         """
-        with self._lock:
-            cur = self._conn.cursor()
-            cur.execute("SELECT name FROM buckets")
-            rows = cur.fetchall()
-            if rows:
+        cache_mode = cache_mode or self.mode
+        swr = cache_mode == CacheMode.STALE_WHILE_REVALIDATE
+        if cache_mode not in (CacheMode.BYPASS, CacheMode.FORCE_REFRESH):
+            listed = self._query_one("SELECT value FROM cache_info WHERE name='buckets_listed_at'")
+            stale = listed is None or (self.ttl > 0 and _now() - float(listed["value"]) > self.ttl)
+            if cache_mode == CacheMode.CACHE_ONLY or not stale or (swr and listed is not None):
+                if stale and swr:
+                    self._refresh_in_background(("buckets", ""), self.list_buckets,
+                                                CacheMode.FORCE_REFRESH)
+                rows = self._query("SELECT name FROM buckets ORDER BY name")
                 return [type("Bucket", (), {"name": r["name"]}) for r in rows]
 
-        # not in cache -> fetch from s3
         buckets = list(self._client.list_buckets())
-        with self._lock, self._conn:
-            cur = self._conn.cursor()
-            cur.executemany("INSERT OR IGNORE INTO buckets (name) VALUES (?)",
-                            [(b.name,) for b in buckets])
-            self._conn.commit()
+        if cache_mode != CacheMode.BYPASS:
+            self._write(self._replace_buckets, [b.name for b in buckets], _now())
         return buckets
 
+    def _replace_buckets(self, cur: sqlite3.Cursor, names: List[str], listed_at: float):
+        cur.execute("DELETE FROM buckets")
+        cur.executemany("INSERT INTO buckets (name) VALUES (?)", [(name,) for name in names])
+        cur.execute("INSERT OR REPLACE INTO cache_info (name, value) VALUES ('buckets_listed_at', ?)",
+                    (str(listed_at),))
+
     def make_bucket(self, bucket_name: str, **kwargs):
         res = self._client.make_bucket(bucket_name, **kwargs)
-        with self._lock, self._conn:
-            self._conn.execute("INSERT OR IGNORE INTO buckets (name) VALUES (?)", (bucket_name,))
-            self._conn.commit()
+        self._write(lambda cur: cur.execute("INSERT OR IGNORE INTO buckets (name) VALUES (?)",
+                                            (bucket_name,)))
         return res
 
     # -------------------------
@@ -305,7 +1799,7 @@ class PersistentCachedMinio:
         recursive: bool = False,
         include_user_meta: bool = False,
         limit: Optional[int] = None,
-        cache_mode: CacheMode = CacheMode.DEFAULT
+        cache_mode: Optional[CacheMode] = None
     ) -> Iterator[CachedObject]:
         """
         Cache-aware list_objects supporting a `limit` parameter.
@@ -316,52 +1810,127 @@ class PersistentCachedMinio:
         Note: If cache_mode == BYPASS, we iterate S3 and do NOT use cache hits (but will cache new items).
               If cache_mode == CACHE_ONLY, we only return items from cache (no S3 calls).
         """
-        # If caller requested CACHE_ONLY and no limit specified -> return all cached entries for prefix
+        listing = self._list_objects(bucket, prefix or "", recursive, include_user_meta, limit,
+                                     cache_mode or self.mode)
+        # (only the time spent producing entries counts, not the time spent consuming them)
+        e1 = time.time()
+        outcome, seconds = "error", 0.0
+        try:
+            outcome = next(listing)
+            seconds = time.time() - e1
+            while True:
+                e1 = time.time()
+                try:
+                    co = next(listing)
+                except StopIteration:
+                    seconds += time.time() - e1
+                    return
+                seconds += time.time() - e1
+                yield co
+        except Exception:
+            outcome = "error"
+            seconds += time.time() - e1
+            raise
+        finally:
+            self._stats.record(bucket, "list_objects", outcome, seconds)
+
+    def _list_objects(self, bucket: str, prefix: str, recursive: bool, include_user_meta: bool,
+                      limit: Optional[int], cache_mode: CacheMode) -> Iterator:
+        """
+        The listing behind list_objects. The first thing yielded is how it is being
+        answered (an outcome for the stats), then the entries.
+        """
+        # If caller requested CACHE_ONLY -> return the cached entries for prefix
         if cache_mode == CacheMode.CACHE_ONLY:
-            with self._lock:
-                cur = self._conn.cursor()
-                if prefix:
-                    cur.execute("SELECT * FROM objects WHERE bucket=? AND key LIKE ? ORDER BY key", (bucket, f"{prefix}%"))
-                else:
-                    cur.execute("SELECT * FROM objects WHERE bucket=? ORDER BY key", (bucket,))
-                rows = cur.fetchall()
-            for co in self._rows_to_cached_objects(rows[:limit] if limit else rows):
+            if recursive:
+                self.flush()
+                entries = self._rows_to_cached_objects(self._query(*_prefix_query(
+                    f"SELECT * FROM {self._objects}", bucket, prefix, limit)))
+            else:
+                entries = self.list_children(bucket, prefix)
+            yield _listing_outcome(entries)
+            for co in entries[:limit] if limit else entries:
                 yield co
             return
 
+        # If we have listed this prefix completely and recently, we have everything we need
+        # (and if we don't mind it not being recent, we can refresh it afterwards), unless
+        # user metadata is wanted and some rows were cached without it: then listing again
+        # brings it (and the tags) for a whole page at a time
+        swr = cache_mode == CacheMode.STALE_WHILE_REVALIDATE
+        if cache_mode == CacheMode.DEFAULT or swr:
+            listing = self._find_listing(bucket, prefix, recursive, stale=swr)
+            if listing is not None:
+                entries = self._listing_from_cache(bucket, prefix, recursive, listing)
+                entries = entries[:limit] if limit is not None else entries
+                if not (include_user_meta and _lacking_user_meta(entries)):
+                    if self._is_listing_stale(listing):
+                        self._refresh_in_background(("list", bucket, prefix, recursive),
+                                                    self._refresh_listing, bucket, prefix, recursive)
+                        yield "stale"
+                    else:
+                        yield "hit"
+                    for co in entries:
+                        yield co
+                    return
+
         # If not CACHE_ONLY, attempt to serve from cache if it's sufficient
         cached_keys = self._list_cached_keys_for_prefix(bucket, prefix)
-        if limit is not None and len(cached_keys) >= limit and cache_mode == CacheMode.DEFAULT:
+        if limit is not None and len(cached_keys) >= limit and (cache_mode == CacheMode.DEFAULT or swr):
             # return first limit cached
-            with self._lock:
-                cur = self._conn.cursor()
-                cur.execute("SELECT * FROM objects WHERE bucket=? AND key LIKE ? ORDER BY key LIMIT ?",
-                            (bucket, f"{prefix}%", limit))
-                rows = cur.fetchall()
-            for co in self._rows_to_cached_objects(rows):
-                yield co
-            return
+            rows = self._query(*_prefix_query(f"SELECT * FROM {self._objects}", bucket, prefix, limit))
+            entries = self._rows_to_cached_objects(rows)
+            if not (include_user_meta and _lacking_user_meta(entries)):
+                yield _listing_outcome(entries)
+                for co in entries:
+                    yield co
+                return
 
         # Otherwise we will iterate S3 and produce up to `limit` results merging cache and S3.
         # We'll iterate S3 in lexicographic order (minio.list_objects does this) and for each object:
         #  - if it's in cache and cache_mode != BYPASS, yield cached entry (if not stale under DEFAULT),
-        #  - otherwise fetch stat and tags as needed, cache and yield.
+        #  - otherwise cache what the listing told us (etag, size, last_modified, and user
+        #    metadata if asked for) and yield that. We only HEAD an object if user metadata
+        #    was asked for and the listing didn't include it.
+        yield "miss"
         count = 0
         seen_keys = set()
+        dirs = []
+        complete = True
 
         # If cache contains some entries, we still want the correct ordering.
         # So iterate S3 and for each key encountered, decide whether it's cached or not.
-        for s3obj in self._client.list_objects(bucket, prefix=prefix, recursive=recursive):
+        if recursive:
+            # big recursive listings are split into shards listed concurrently
+            listing = sharded_list_objects(self._client, bucket, prefix=prefix, recursive=True,
+                                           include_user_meta=include_user_meta)
+        else:
+            listing = self._client.list_objects(bucket, prefix=prefix, recursive=False,
+                                                include_user_meta=include_user_meta)
+        for s3obj in listing:
             key = s3obj.object_name
             if key in seen_keys:
                 continue
             seen_keys.add(key)
 
+            if s3obj.is_dir:
+                # common prefixes aren't objects, so there is nothing to cache
+                dirs.append(key)
+                yield _dir_entry(bucket, key)
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+                continue
+
             row = self._get_row(bucket, key)
+            # a row is only as good as the listing if it has what the listing brought
+            sufficient = row is not None and (
+                (row["metadata"] or not include_user_meta) and
+                (row["tags"] or not include_user_meta or _listed_tags(s3obj) is None))
             # Decide behavior based on cache_mode and staleness
             if row and cache_mode != CacheMode.BYPASS:
                 stale = self._is_row_stale(row)
-                if cache_mode == CacheMode.DEFAULT and not stale:
+                if (cache_mode == CacheMode.DEFAULT or swr) and not stale and sufficient:
                     # return cached
                     for co in self._rows_to_cached_objects([row]):
                         yield co
@@ -369,57 +1938,109 @@ class PersistentCachedMinio:
                         if limit is not None and count >= limit:
                             return
                     continue
-                if cache_mode == CacheMode.FORCE_REFRESH:
-                    # treat as not cached, fall through to fetch live
-                    pass
-                if cache_mode == CacheMode.DEFAULT and stale:
-                    # fetch fresh and update cache
-                    pass
-
-            # If we reach here, we need to fetch latest from S3
+                # stale (or FORCE_REFRESH): the listing entry may show the row is still current
+                if self._row_matches(row, s3obj.etag, s3obj.last_modified) and sufficient:
+                    yield self._revalidated(row)
+                    count += 1
+                    if limit is not None and count >= limit:
+                        return
+                    continue
+
+            # If we reach here, the listing entry is the latest information we have
             try:
-                # Use stat_object for full metadata
-                stat = self._client.stat_object(bucket, key)
-                # tags may be fetched lazily only when asked, but here we'll cache tags=None to avoid extra call
-                # (user can call get_object_tags explicitly to fetch tags)
-                self._write_object_row(bucket, key, getattr(stat, "etag", None),
-                                       getattr(stat, "size", None),
-                                       getattr(stat, "last_modified", None),
-                                       getattr(stat, "metadata", None),
-                                       None)
-                # create CachedObject from freshly fetched stat
-                co = CachedObject(
-                    obj=stat,
-                    bucket=bucket,
-                    key=key,
-                    metadata=getattr(stat, "metadata", None),
-                    tags=None,
-                    cached=True,
-                    cached_at=_now(),
-                    age_seconds=0.0,
-                    stale=False,
-                    source="s3"
-                )
-                yield co
-                count += 1
-                if limit is not None and count >= limit:
-                    return
+                co = self._ingest_listing_entry(bucket, s3obj, row, include_user_meta)
             except Exception:
-                # If stat fails, skip object
+                # If stat fails, skip object (and we no longer have a complete listing)
+                complete = False
                 continue
+            yield co
+            count += 1
+            if limit is not None and count >= limit:
+                return
 
-        # End of S3 list. If there are cached rows for prefix that were not present in S3 listing
-        # (unlikely) or we want to include items that might be only in cache (e.g., previously cached but S3 removed),
-        # we could append them here. For now, do not add extra items.
-        return
+        # End of S3 list, so we have seen everything below prefix: anything else we have
+        # cached there has gone, and we can answer this listing from the cache for a while.
+        if complete:
+            self._purge_unlisted(bucket, prefix, recursive, seen_keys)
+            self._record_listing(bucket, prefix, recursive, dirs)
+
+    def _ingest_listing_entry(self, bucket: str, s3obj: Object, row: Optional[sqlite3.Row],
+                              include_user_meta: bool) -> CachedObject:
+        """
+        Cache (and return) what a listing told us about an object.
+        If the object hasn't changed we keep any metadata and tags we already had
+        (unless the listing brought them), and we only HEAD the object if user
+        metadata was asked for and we have none.
+        """
+        key = s3obj.object_name
+        obj = s3obj
+        metadata = _normalise_metadata(s3obj.metadata) if include_user_meta else None
+        tags = _listed_tags(s3obj) if include_user_meta else None
+        if row is not None and row["etag"] == s3obj.etag:
+            if not metadata and row["metadata"]:
+                metadata = json.loads(row["metadata"])
+            if tags is None and row["tags"]:
+                tags = json.loads(row["tags"])
+        if include_user_meta and not metadata:
+            obj = self._client.stat_object(bucket, key)
+            metadata = _normalise_metadata(obj.metadata)
+        self._write_object_row(bucket, key, obj.etag, obj.size, obj.last_modified,
+                               metadata, tags)
+        return CachedObject(
+            obj=obj,
+            bucket=bucket,
+            key=key,
+            metadata=metadata,
+            tags=tags,
+            cached=True,
+            cached_at=_now(),
+            age_seconds=0.0,
+            stale=False,
+            source="s3"
+        )
 
     # -------------------------
     # stat_object
     # -------------------------
-    def stat_object(self, bucket: str, key: str, cache_mode: CacheMode = CacheMode.DEFAULT) -> CachedObject:
+    def stat_object(self, bucket: str, key: str, cache_mode: Optional[CacheMode] = None,
+                    include_user_meta: bool = False) -> CachedObject:
         """
         Return a CachedObject for the stat of an object.
+        A row cached from a listing has no user metadata, which is enough unless
+        include_user_meta, in which case the object is HEADed for it.
         """
+        return self._recorded(bucket, "stat_object", self._stat_object, bucket, key,
+                              cache_mode, include_user_meta)
+
+    def _recorded(self, bucket: str, operation: str, fn, *args) -> CachedObject:
+        """ Return fn(*args), recording how it was answered and how long it took """
+        e1 = time.time()
+        try:
+            co = fn(*args)
+        except Exception as e:
+            self._stats.record(bucket, operation, _error_outcome(e), time.time() - e1)
+            raise
+        self._stats.record(bucket, operation, _outcome(co), time.time() - e1)
+        return co
+
+    def _stat_object(self, bucket: str, key: str, cache_mode: Optional[CacheMode] = None,
+                     include_user_meta: bool = False) -> CachedObject:
+        cache_mode = cache_mode or self.mode
+        swr = cache_mode == CacheMode.STALE_WHILE_REVALIDATE
+
+        # Decoded entries in memory are the quickest answer of all
+        if cache_mode in (CacheMode.DEFAULT, CacheMode.CACHE_ONLY) or swr:
+            memo = self._memory.get((bucket, key))
+            if memo is not None and (memo.metadata or not include_user_meta or
+                                     cache_mode == CacheMode.CACHE_ONLY):
+                co = self._aged(memo)
+                if cache_mode == CacheMode.CACHE_ONLY or not co.stale or swr:
+                    if co.stale and swr:
+                        self._refresh_in_background(("stat", bucket, key), self._stat_object,
+                                                    bucket, key, CacheMode.FORCE_REFRESH)
+                    self._note_access(bucket, key)
+                    return co
+
         # Handle CACHE_ONLY quickly
         if cache_mode == CacheMode.CACHE_ONLY:
             row = self._get_row(bucket, key)
@@ -432,20 +2053,42 @@ class PersistentCachedMinio:
 
         # Check cache
         row = self._get_row(bucket, key)
-        if row and cache_mode != CacheMode.BYPASS:
+        complete = row is not None and (row["metadata"] or not include_user_meta)
+        if complete and cache_mode != CacheMode.BYPASS:
             stale = self._is_row_stale(row)
-            if cache_mode == CacheMode.DEFAULT and not stale:
+            if (cache_mode == CacheMode.DEFAULT or swr) and not stale:
                 co = self._rows_to_cached_objects([row])[0]
                 return co
-            if cache_mode == CacheMode.FORCE_REFRESH:
-                pass  # fallthrough to fetch
-            if cache_mode == CacheMode.DEFAULT and stale:
-                pass  # fallthrough to fetch fresh
+            if swr:
+                self._refresh_in_background(("stat", bucket, key), self._stat_object,
+                                            bucket, key, CacheMode.FORCE_REFRESH)
+                return self._rows_to_cached_objects([row])[0]
+            # stale (or FORCE_REFRESH): fall through to fetch, conditionally if we can
+        elif row is None and (cache_mode == CacheMode.DEFAULT or swr):
+            missing = self._known_missing(bucket, key)
+            if missing is not None:
+                raise missing
 
         # Fetch from S3
+        revalidate = (complete and cache_mode != CacheMode.BYPASS and
+                      self.revalidate and row["etag"])
         try:
-            stat = self._client.stat_object(bucket, key)
-        except Exception:
+            if revalidate:
+                stat = self._client.stat_object(
+                    bucket, key, extra_headers={"If-None-Match": f'"{row["etag"]}"'})
+            else:
+                stat = self._client.stat_object(bucket, key)
+        except ServerError as e:
+            if revalidate and e.status_code == 304:
+                return self._revalidated(row)
+            if row:
+                return self._rows_to_cached_objects([row])[0]
+            raise
+        except Exception as e:
+            if _is_missing(e):
+                # it has gone (or never was), which is worth remembering
+                self._record_missing(bucket, key, e)
+                raise
             # If we have cached row, but S3 failed and cache exists, return cached (even if stale)
             if row:
                 co = self._rows_to_cached_objects([row])[0]
@@ -453,17 +2096,22 @@ class PersistentCachedMinio:
             # otherwise propagate or return empty CachedObject
             raise
 
+        # servers which ignore If-None-Match just send the object details again
+        if revalidate and self._row_matches(row, getattr(stat, "etag", None),
+                                            getattr(stat, "last_modified", None)):
+            return self._revalidated(row)
+
         # Persist row
         self._write_object_row(bucket, key, getattr(stat, "etag", None),
                                getattr(stat, "size", None),
                                getattr(stat, "last_modified", None),
-                               getattr(stat, "metadata", None),
+                               _normalise_metadata(getattr(stat, "metadata", None)),
                                None)  # tags left None until fetched
         return CachedObject(
             obj=stat,
             bucket=bucket,
             key=key,
-            metadata=getattr(stat, "metadata", None),
+            metadata=_normalise_metadata(getattr(stat, "metadata", None)),
             tags=None,
             cached=True,
             cached_at=_now(),
@@ -475,11 +2123,15 @@ class PersistentCachedMinio:
     # -------------------------
     # get_object_tags
     # -------------------------
-    def get_object_tags(self, bucket: str, key: str, cache_mode: CacheMode = CacheMode.DEFAULT) -> CachedObject:
+    def get_object_tags(self, bucket: str, key: str, cache_mode: Optional[CacheMode] = None) -> CachedObject:
         """
         Return CachedObject where tags field is populated. If the object is in cache and tags are present
         and fresh, return that. Otherwise fetch tags from S3 (unless CACHE_ONLY).
         """
+        return self._recorded(bucket, "get_object_tags", self._get_object_tags, bucket, key, cache_mode)
+
+    def _get_object_tags(self, bucket: str, key: str, cache_mode: Optional[CacheMode] = None) -> CachedObject:
+        cache_mode = cache_mode or self.mode
         row = self._get_row(bucket, key)
         if row:
             tags = json.loads(row["tags"]) if row["tags"] else None
@@ -487,7 +2139,11 @@ class PersistentCachedMinio:
             age = (_now() - cached_at) if cached_at else None
             stale = self._is_row_stale(row)
             if tags is not None and cache_mode != CacheMode.BYPASS:
-                if cache_mode == CacheMode.DEFAULT and not stale:
+                swr = cache_mode == CacheMode.STALE_WHILE_REVALIDATE
+                if swr and stale:
+                    self._refresh_in_background(("tags", bucket, key), self._get_object_tags,
+                                                bucket, key, CacheMode.FORCE_REFRESH)
+                if (cache_mode == CacheMode.DEFAULT and not stale) or swr:
                     # return cached tags
                     return CachedObject(
                         obj=_obj_from_row(row),
@@ -533,7 +2189,7 @@ class PersistentCachedMinio:
                     self._write_object_row(bucket, key, getattr(stat, "etag", None),
                                            getattr(stat, "size", None),
                                            getattr(stat, "last_modified", None),
-                                           getattr(stat, "metadata", None),
+                                           _normalise_metadata(getattr(stat, "metadata", None)),
                                            tags)
                 except Exception:
                     # If stat fails, still insert tags entry with minimal info
@@ -581,6 +2237,7 @@ class PersistentCachedMinio:
     def remove_object(self, bucket: str, key: str):
         res = self._client.remove_object(bucket, key)
         self._delete_object_row(bucket, key)
+        self._invalidate_listings(bucket, [key])
         return res
 
     def remove_objects(self, bucket: str, delete_list):
@@ -589,19 +2246,45 @@ class PersistentCachedMinio:
         for err in self._client.remove_objects(bucket, delete_list):
             results.append(err)
         # Remove from cache
-        with self._lock, self._conn:
-            cur = self._conn.cursor()
-            for d in delete_list:
-                # d may be a minio.datatypes.Object or object with object_name
-                name = getattr(d, "object_name", None) or getattr(d, "object_name", None) or d
-                cur.execute("DELETE FROM objects WHERE bucket=? AND key=?", (bucket, name))
-            self._conn.commit()
+        names = []
+        for d in delete_list:
+            # d may be a minio.datatypes.Object or object with object_name
+            names.append(getattr(d, "object_name", None) or getattr(d, "name", None) or d)
+        self._write(self._delete_rows, [(bucket, name) for name in names])
+        self._invalidate_listings(bucket, names)
         return results
 
+    def put_object(self, bucket: str, object_name: str, data, length: int,
+                   content_type: str = "application/octet-stream", metadata=None, **kwargs):
+        res = self._client.put_object(bucket, object_name, data, length,
+                                      content_type=content_type, metadata=metadata, **kwargs)
+        self._uploaded(bucket, object_name, res, length if length >= 0 else None,
+                       content_type, metadata, kwargs.get("tags"))
+        return res
+
+    def fput_object(self, bucket: str, object_name: str, file_path: str,
+                    content_type: str = "application/octet-stream", metadata=None, **kwargs):
+        res = self._client.fput_object(bucket, object_name, file_path,
+                                       content_type=content_type, metadata=metadata, **kwargs)
+        self._uploaded(bucket, object_name, res, os.path.getsize(file_path),
+                       content_type, metadata, kwargs.get("tags"))
+        return res
+
+    def _uploaded(self, bucket: str, key: str, res, size: Optional[int],
+                  content_type: Optional[str], metadata, tags):
+        """
+        We have just written key, so cache what we sent: a later stat (or listing,
+        or ls -m) of it then needs no HEAD.
+        """
+        self._objects_written(bucket, [key])
+        self._write_object_row(bucket, key, getattr(res, "etag", None), size,
+                               getattr(res, "last_modified", None),
+                               _sent_metadata(content_type, metadata), dict(tags) if tags else None)
+
     def copy_object(self, bucket: str, object_name: str, src: CopySource):
         res = self._client.copy_object(bucket, object_name, src)
         # Invalidate destination entry (we will re-cache on access)
-        self._delete_object_row(bucket, object_name)
+        self._objects_written(bucket, [object_name])
         return res
 
     def set_object_tags(self, bucket: str, key: str, tags: Dict[str, str]):
@@ -612,10 +2295,20 @@ class PersistentCachedMinio:
 
     # Optional: expose convenience method to force eviction / clear cache
     def clear_cache(self):
-        with self._lock, self._conn:
-            self._conn.execute("DELETE FROM objects")
-            self._conn.execute("DELETE FROM buckets")
-            self._conn.commit()
+        self._write(self._clear)
+
+    def _clear(self, cur: sqlite3.Cursor):
+        with self._lock:
+            self._pending.clear()
+            self._accessed.clear()
+            self._touched.clear()
+        self._memory.clear()
+        for table in ("objects", "listings", "dirs", "missing", "buckets", "hidden", "layers", "meta_index"):
+            cur.execute(f"DELETE FROM {table}")
+        cur.execute("DELETE FROM cache_info WHERE name='buckets_listed_at'")
+        self._used_bytes = 0
+        # back to what the snapshots say
+        self._mount_layers(cur)
 
     # -------------------------
     # Pass-through for other methods not explicitly wrapped
@@ -624,4 +2317,81 @@ class PersistentCachedMinio:
         """
         Forward any other attribute access to the underlying Minio client.
         """
-        return getattr(self._client, name)
\ No newline at end of file
+        return getattr(self._client, name)
+
+class AliasCaches:
+    """
+    The persistent caches for a set of aliases (tenancies): each alias has its own
+    database file in directory (see cache_path), opened the first time it is asked
+    for, so same-named buckets on different servers never meet, each cache has its
+    own writer (so writes to different tenancies proceed in parallel), and one
+    tenancy's cache can be dropped without touching the others.
+    Aliases are looked up in config_file (see alias_endpoint), and keyword options
+    are passed on to each PersistentCachedMinio.
+    """
+    def __init__(self, directory: str = CACHE_DIR, config_file: Optional[str] = None, **options):
+        self.directory = directory
+        self.config_file = config_file
+        self.options = options
+        self._caches: Dict[str, PersistentCachedMinio] = {}
+        self._lock = threading.Lock()
+
+    def path(self, alias: str) -> str:
+        return cache_path(alias, self.directory)
+
+    def get(self, alias: str, client) -> PersistentCachedMinio:
+        """
+        Return the cache for alias, opening it (around client, which must talk to
+        the alias' server) if it isn't open yet. An open cache is switched to client
+        if it was opened with another, or reopened (and so cleared) if the alias has
+        been moved to another server since.
+        """
+        endpoint = alias_endpoint(alias, self.config_file)
+        with self._lock:
+            cache = self._caches.get(alias)
+            if cache is not None and cache.endpoint != endpoint:
+                cache.close()
+                cache = None
+            if cache is None:
+                cache = PersistentCachedMinio(client, db_path=self.path(alias), endpoint=endpoint,
+                                              **self.options)
+                self._caches[alias] = cache
+            elif cache._client is not client:
+                # e.g. a client rebuilt with new credentials
+                cache._client = client
+            return cache
+
+    def aliases(self) -> List[str]:
+        """ The aliases whose caches are open """
+        with self._lock:
+            return sorted(self._caches)
+
+    def drop(self, alias: str):
+        """
+        Close the cache for alias (if it is open) and delete its database, so it
+        will be rebuilt from scratch when it is next used.
+        """
+        with self._lock:
+            cache = self._caches.pop(alias, None)
+        if cache is not None:
+            cache.close()
+        path = self.path(alias)
+        if path == ":memory:":
+            return
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        with self._lock:
+            caches, self._caches = list(self._caches.values()), {}
+        for cache in caches:
+            cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
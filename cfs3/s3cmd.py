@@ -1,41 +1,43 @@
 import cmd2
 import logging
 from pathlib import Path
-from cfs3.s3core import get_client, get_locations, lswild, desanitise_metadata
+from cfs3.s3core import get_client, get_locations, ilswild, desanitise_metadata
+from cfs3.s3glob import compile_glob
 from cfs3.skin import _i, _e, _p, _err, fmt_size, fmt_date, ColourFormatter
 from minio.deleteobjects import DeleteObject
 from minio.commonconfig import CopySource
 from minio.tagging import Tags
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from cfs3.s3async import map_concurrently
+from cfs3.s3stats import InstrumentedClient, RequestStats
+from cfs3.s3cache import PersistentCachedMinio, AliasCaches, CacheMode, CACHE_DIR, CachedObject, metadata_matches
 import itertools
 from io import StringIO
 import argparse
 from cfs3.drs_view import drs_view, drs_metaview, drs_select
 import bitmath
 import warnings
+from contextlib import nullcontext
 
 
 logging.getLogger("urllib3.connectionpool").setLevel(logging.ERROR)
 
+CACHE_MODES = {'default': CacheMode.DEFAULT,
+               'bypass': CacheMode.BYPASS,
+               'offline': CacheMode.CACHE_ONLY,
+               'refresh': CacheMode.FORCE_REFRESH,
+               'stale': CacheMode.STALE_WHILE_REVALIDATE}
+""" Names for the cache modes in the s3view cache command """
+
 
 def fetch_metadata(client, bucket, file_dict):
     """ Helper function to clean up calling metadata signature"""
-    return file_dict, client.stat_object(bucket, file_dict['n'])
+    return file_dict, client.stat_object(bucket, file_dict['n'], include_user_meta=True)
 
 
 def match_metadata(client, bucket, object_name, matches):
     """ Helper function to grab only files with metadata matches"""
-    result = client.stat_object(bucket, object_name)
-    meta = {k[11:]: v for k, v in result.metadata.items() 
-            if k.startswith('x-amz-meta')}
-    meta = desanitise_metadata(meta)
-    for k, v in matches.items():
-        if k not in meta:
-            return False, object_name
-        else:
-            if meta[k] != v:
-                return False, object_name
-    return True, object_name
+    result = client.stat_object(bucket, object_name, include_user_meta=True)
+    return metadata_matches(result.metadata, matches), object_name
 
 
 def key_value(s: str):
@@ -161,13 +163,15 @@ class s3cmd(cmd2.Cmd):
     """ List of commands that can consume content from an internal pipe "::" """
     allow_redirection = True
 
-    def __init__(self, path=None, config_file=None):
+    def __init__(self, path=None, config_file=None, cache_dir=None):
         """
         Initialise Command Line Environment 
         Args:
             path (_type_, optional): This is the initial location from the selection in your config file. Defaults to None.
             config_file (_type_, optional): This is the location of your S3 configuration(s).
             Defaults to None (in which case s3view will attempt to find and use ~/.mc/config.json)
+            cache_dir (str, optional): Where to keep the persistent caches of object details,
+            one database per location. Defaults to None (in which case ~/.cache/cfs3)
         """
 
         # Set include_ipy to True to enable the "ipy" command which runs an interactive IPython shell
@@ -196,6 +200,10 @@ class s3cmd(cmd2.Cmd):
                 self.poutput(_err(str(w[-1].message)))
         self.buckets = []
         self.config = config_file
+        self.stats = RequestStats()
+        # we talk to the object store (s3) through a persistent cache (client)
+        self.caches = AliasCaches(cache_dir or CACHE_DIR, config_file=config_file)
+        self.cache = None
 
         if path is None:
             self.prompt = 's3> '
@@ -253,10 +261,11 @@ class s3cmd(cmd2.Cmd):
             try:
                 with warnings.catch_warnings():
                     warnings.simplefilter('ignore')
-                    self.client = get_client(bits[0], config_file=self.config)
+                    s3 = InstrumentedClient(get_client(bits[0], config_file=self.config), self.stats)
             except ValueError as e:
                 self.poutput(_err(e))
                 return
+            self._use_client(s3, bits[0])
             self.alias = bits[0]
             self.prompt = _p(f'{self.alias}> ')
 
@@ -290,41 +299,71 @@ class s3cmd(cmd2.Cmd):
                 self.bucket = bits[1]
                 self.path = bits[2]
     
-    def _recurse(self, path, match=None, limit=None):
+    def _use_client(self, s3, alias):
+        """ 
+        Talk to s3 through the persistent cache for alias, keeping the cache settings we had
+        (caches for the locations we have left stay open, so going back to them is cheap)
+        """
+        mode, ttl = (self.cache.mode, self.cache.ttl) if self.cache else (CacheMode.DEFAULT, 3600)
+        self.s3 = s3
+        self.cache = self.caches.get(alias, s3)
+        self.cache.mode, self.cache.ttl = mode, ttl
+        self.client = self.cache
+
+    def postloop(self):
+        """ Write out anything the caches have buffered before we go """
+        self.caches.close()
+        self.cache = None
+
+    def _recurse(self, path, match=None, limit=None, include_user_meta=False):
         """ 
         From a given path, head down the tree and do some summing.
         We can constrain ourself to a set of matching objects.
         We can also constain how many objects we want to look at.
+        If include_user_meta, the listing brings user metadata and tags with it.
         """
         if path == "":
             prefix = None
         else:
             prefix = path
-        # this is a generator
-        objects = self.client.list_objects(self.bucket,
-                                           include_user_meta=True,
-                                           prefix=prefix)
-
-        # if we are limited, we can collapse our generator to a list
-        if limit is not None:
-            objects = list(itertools.islice(objects, limit))
-          
-        if match is not None:
-            objects = [o for o in objects if Path(o.object_name).match(match)]
+        start = len(path or '')
+
+        if limit is None and match is None:
+            # everything below us (which the cache lists in concurrent shards)
+            objects = self.client.list_objects(self.bucket, prefix=prefix, recursive=True,
+                                               include_user_meta=include_user_meta)
+        else:
+            if match is not None:
+                # let the server do as much of the matching as it can
+                glob = compile_glob(match)
+                if '/' not in glob.prefix:
+                    prefix = (prefix or '') + glob.prefix
+            # this is a generator, and so are the filters, so with a limit 
+            # we stop listing as soon as we have enough matches
+            objects = self.client.list_objects(self.bucket, prefix=prefix or None,
+                                               include_user_meta=include_user_meta)
+            if match is not None:
+                objects = (o for o in objects 
+                           if glob.match(o.object_name[start:].rstrip('/')))
+            if limit is not None:
+                objects = itertools.islice(objects, limit)
 
         sum = 0
         files = 0
-        dirs = 1
-        mydirs = []
+        dirsizes = {}
         myfiles = []
         for o in objects:
-            if o.is_dir:
-                path = f'{path}/{o.object_name}'
-                dsum, dfiles, ddirs, md, mf = self._recurse(path)
+            relative = o.object_name[start:]
+            if '/' in relative:
+                # either a directory from a delimited listing, or something inside one
+                mydir = o.object_name[:start] + relative.split('/')[0] + '/'
+                if o.is_dir:
+                    dsum, dfiles, _, _, _ = self._recurse(o.object_name)
+                else:
+                    dsum, dfiles = o.size, 1
+                dirsizes[mydir] = dirsizes.get(mydir, 0) + dsum
                 sum += dsum
                 files += dfiles
-                dirs += 1
-                mydirs.append([o.object_name, fmt_size(dsum)])
             else:
                 sum += o.size
                 files += 1
@@ -333,6 +372,8 @@ class s3cmd(cmd2.Cmd):
                                 'd': fmt_date(o.last_modified),
                                 't': o.tags,
                                 })
+        mydirs = [[d, fmt_size(dsum)] for d, dsum in dirsizes.items()]
+        dirs = 1 + len(mydirs)
         return sum, files, dirs, mydirs, myfiles
 
     def _cd_lander(self, path):
@@ -376,19 +417,17 @@ class s3cmd(cmd2.Cmd):
         
     def _getmetadata(self, myfiles):
         mymetadata = []
-        # loop runs with minimum of 32 or the number of processors multiplied by 5, based on Python’s default configuration.
-        with ThreadPoolExecutor() as executor:
-            futures = {executor.submit(
-                       fetch_metadata, self.client, self.bucket, f):
-                       f for f in myfiles}
-            for future in as_completed(futures):
-                try:
-                    f, result = future.result()
-                    meta = {k[11:]: v for k, v in result.metadata.items()
-                            if k.startswith('x-amz-meta')}
-                    mymetadata.append((f, desanitise_metadata(meta)))
-                except Exception as e:
-                    self.poutput(_err(f'Error fetching metadata {e}'))
+        # requests are bounded by the size of the client connection pool
+        results = map_concurrently(
+            lambda f: fetch_metadata(self.client, self.bucket, f), myfiles)
+        for f, result in results:
+            if isinstance(result, Exception):
+                self.poutput(_err(f'Error fetching metadata {result}'))
+                continue
+            f, result = result
+            meta = {k[11:]: v for k, v in (result.metadata or {}).items()
+                    if k.startswith('x-amz-meta')}
+            mymetadata.append((f, desanitise_metadata(meta)))
         mymetadata = sorted(mymetadata, key=lambda x: x[0]['n'])
         return mymetadata
 
@@ -399,6 +438,8 @@ class s3cmd(cmd2.Cmd):
         """
         line = statement.raw  # get raw input
         self.log.debug(f'[precmd] received: {repr(line)}')
+        # attribute the requests we are about to make to this command
+        self.stats.context = line.split()[0] if line.strip() else None
         self.log.debug(f'[precmd] buckets are {self.buckets}')
 
         if '::' in line:
@@ -508,6 +549,9 @@ class s3cmd(cmd2.Cmd):
         file system.
         """
         bucket = arg.bucket
+        if not self.maybe_anon and bucket not in self.buckets:
+            # it may be new since we last listed them
+            self.buckets = [b.name for b in self.client.list_buckets(cache_mode=CacheMode.FORCE_REFRESH)]
         if not self.maybe_anon and bucket not in self.buckets:
             self.poutput(_err(f'Bucket [{bucket}] does not exist'))
         else:    
@@ -571,7 +615,8 @@ class s3cmd(cmd2.Cmd):
             return
             
             
-        volume, nfiles, ndirs, mydirs, myfiles = self._recurse(self.path, extras, limit=limit)
+        volume, nfiles, ndirs, mydirs, myfiles = self._recurse(self.path, extras, limit=limit,
+                                                               include_user_meta=bool(arg.tags or arg.metadata or arg.long))
         if limit is None:
             self.houtput(_i('Location: ') + self.path + _i(' contains ')+ fmt_size(volume) + _i(' in ') + str(nfiles) + _i(' files/objects.'))
             directory = 'directory'
@@ -653,6 +698,9 @@ class s3cmd(cmd2.Cmd):
         particular path. 
 
         This metadata match is using the DRS metadaata which has been uploaded with the file.
+        Values may be globs, and a list value matches if any element does. Objects whose
+        metadata is already in the cache are matched on it, only the rest are fetched from
+        the server.
         """ 
         if self.bucket is None:
             self.poutput(_err('Must select bucket'))
@@ -670,16 +718,26 @@ class s3cmd(cmd2.Cmd):
         if path is not None:
             objects = [o for o in objects if Path(o.object_name).match(path)]
 
+        objects = [o for o in objects if not o.is_dir]
+        cached = {o.object_name for o in objects
+                  if isinstance(o, CachedObject) and o.metadata is not None}
+        results = {o.object_name: result for o, result in map_concurrently(
+            lambda o: match_metadata(self.client, self.bucket, o.object_name, pairs),
+            [o for o in objects if o.object_name not in cached])}
+
         matches = []
-        with ThreadPoolExecutor() as executor:
-            futures = {executor.submit(match_metadata, self.client, self.bucket, o.object_name, pairs): o for o in objects}
-            for future in as_completed(futures):
-                try:
-                    status, name = future.result()
-                    if status:
-                        matches.append(name)
-                except Exception as e:
-                    self.poutput(_err(f'Error fetching metadata for {name} {e}'))
+        for o in objects:
+            if o.object_name in cached:
+                if metadata_matches(o.metadata, pairs):
+                    matches.append(o.object_name)
+                continue
+            result = results[o.object_name]
+            if isinstance(result, Exception):
+                self.poutput(_err(f'Error fetching metadata for {o.object_name} {result}'))
+                continue
+            status, name = result
+            if status:
+                matches.append(name)
         if matches == []:
             self.poutput(_e('No matches'))
         else:
@@ -724,7 +782,7 @@ class s3cmd(cmd2.Cmd):
         """
         bucket_name = arg.bucket
         # update the list
-        self.buckets = [b.name for b in self.client.list_buckets()]
+        self.buckets = [b.name for b in self.client.list_buckets(cache_mode=CacheMode.FORCE_REFRESH)]
         
         if bucket_name in self.buckets:
             self.poutput(_err(f'Bucket {bucket_name} already exits')) 
@@ -790,7 +848,10 @@ class s3cmd(cmd2.Cmd):
             self.poutput(_err(f'Invalid mv command - mv "{command.targets}"'))
             return self.do_cd(self.path)
         
-        sfiles = lswild(self.client, self.bucket, source, objects=True)
+        # a plain file target can only take one source, so we only need to know if there are two
+        limit = None if target.endswith('/') else 2
+        # the glob walk does its own (sharded) listings, so it goes straight to the store
+        sfiles = list(ilswild(self.s3, self.bucket, source, objects=True, limit=limit))
         ncopies = len(sfiles)
         if ncopies == 0:
             self.poutput(_i('No files match {source}'))
@@ -802,7 +863,7 @@ class s3cmd(cmd2.Cmd):
                 targets = [target] 
         elif ncopies > 1:
             if not target.endswith('/'):
-                self.putput(_err(f'Need a directory target to mv {len(sfiles)} files -  target must end with a /'))
+                self.poutput(_err('Need a directory target to mv more than one file -  target must end with a /'))
                 return self.do_cd()
             targets = [f'{target}{o.object_name}' for o in sfiles]
         volume = fmt_size(sum([o.size for o in sfiles]))
@@ -812,14 +873,25 @@ class s3cmd(cmd2.Cmd):
             self.poutput(_e(f'mv {o.object_name} to {t}'))
         self.poutput(_p('This move is done as a server side copy - it is not "just" a rename!'))
         if self._confirm(_p(f'Move these files ({volume}) ?')):
-            for o,t in zip(sfiles, targets):
-                src = CopySource(self.bucket, o.object_name)
-                result = self.client.copy_object(self.bucket, t, src)
-                if o.etag != result.etag:
-                    self.poutput(_err(f'Failed copy of {o.object_name} - mv operation terminated'))
-                    return self.cd(self.path)
+            # copy everything first, and only remove sources which were copied intact
+            copies = map_concurrently(
+                lambda ot: self.client.copy_object(self.bucket, ot[1], CopySource(self.bucket, ot[0].object_name)),
+                list(zip(sfiles, targets)))
+            failed = False
+            for (o, t), result in copies:
+                if isinstance(result, Exception) or o.etag != result.etag:
+                    self.poutput(_err(f'Failed copy of {o.object_name} - not removed'))
+                    failed = True
+                    continue
                 self.poutput(f'Created {_e(result.object_name)}')
-                self.client.remove_object(self.bucket,o.object_name)
+            if failed:
+                self.poutput(_err('mv operation terminated, no sources removed'))
+                return self.do_cd(self.path)
+            removals = map_concurrently(
+                lambda o: self.client.remove_object(self.bucket, o.object_name), sfiles)
+            for o, result in removals:
+                if isinstance(result, Exception):
+                    self.poutput(_err(f'Unable to remove {o.object_name} {result}'))
 
         return self.do_cd(self.path)
 
@@ -840,23 +912,22 @@ class s3cmd(cmd2.Cmd):
         if self.bucket is None:
             self.poutput(_err('Need to set bucket before tagging anything'))
             return 
-        prefix = targets.path
+        prefix = targets.path[0]
         key = targets.key[0]
         value = targets.value[0]
         objects = self.client.list_objects(self.bucket,prefix=prefix)
-        for o in objects:
-            if o.is_dir:
-                continue
-            tags = o.tags
-            if tags is None:
-                tags=Tags()
+
+        def tag_one(o):
+            tags = Tags(for_object=True)
+            tags.update(o.tags or {})
             tags[key]=value
-            try:
-                self.client.set_object_tags(self.bucket, o.object_name, tags)
-            except Exception as e:
-                self.poutput(_err(e))
-                self.poutput(_err('Unable to tag object(s), your object store implementation may not support this'))
-                return
+            self.client.set_object_tags(self.bucket, o.object_name, tags)
+
+        results = map_concurrently(tag_one, [o for o in objects if not o.is_dir])
+        errors = [e for o, e in results if isinstance(e, Exception)]
+        if errors:
+            self.poutput(_err(errors[0]))
+            self.poutput(_err('Unable to tag object(s), your object store implementation may not support this'))
 
     tag1_args = cmd2.Cmd2ArgumentParser()
     tag1_args.add_argument('path', nargs=1,help='Path should be a valid object match (i.e. an object path, possibly with a wildcard).')
@@ -908,7 +979,8 @@ class s3cmd(cmd2.Cmd):
             self.path = '/'
 
         extras = arg.path
-        volume, nfiles, ndirs, mydirs, myfiles = self._recurse(self.path, extras)
+        volume, nfiles, ndirs, mydirs, myfiles = self._recurse(self.path, extras,
+                                                               include_user_meta=arg.use_metadata)
 
         selects = dict(arg.select) if arg.select else {}
 
@@ -1053,6 +1125,188 @@ class s3cmd(cmd2.Cmd):
         else:
             return myobjs
 
+    warm_args = cmd2.Cmd2ArgumentParser()
+    warm_args.add_argument('path', nargs='?', help='Path prefix to warm, relative to your current location (default: all of it)')
+    warm_args.add_argument('-n', '--no_metadata', action='store_true', help='Only cache what a listing returns, do not fetch user metadata')
+    warm_args.add_argument('-t', '--tags', action='store_true', help='Fetch and cache tags as well')
+    warm_args.add_argument('-i', '--incremental', action='store_true', help='Only apply what has changed since the cache was last filled (tags are not fetched)')
+    warm_args.add_argument('-c', '--concurrency', type=int, default=16, help='Number of requests in flight')
+    warm_args.add_argument('--db', default=None, help='Warm this cache database rather than the one s3view is using')
+    @cmd2.with_argparser(warm_args)
+    def do_warm(self, arg):
+        """
+        Pre-populate the persistent cache with everything below a path: list it, then 
+        fetch the user metadata (and optionally tags) for each object concurrently. 
+        Suitable for running overnight so that tomorrow's listings come from the cache.
+        """
+        if self.bucket is None:
+            self.poutput(_err('You need to select a bucket first ("cd bucket_name")'))
+            return
+        prefix = self.__handle_path(arg.path).lstrip('/')
+
+        def progress(stage, done, total):
+            if total is None:
+                self.poutput(_i(f'Listed {done} objects ...'))
+            elif stage != 'list' and total:
+                self.poutput(_i(f'Fetched {stage} for {done}/{total} objects'))
+
+        if arg.db is None:
+            target = nullcontext(self.cache)
+        else:
+            target = PersistentCachedMinio(self.s3, db_path=arg.db)
+        with target as cache:
+            if arg.incremental:
+                summary = cache.sync(self.bucket, prefix, with_metadata=not arg.no_metadata,
+                                     concurrency=arg.concurrency, progress=progress)
+            else:
+                summary = cache.warm(self.bucket, prefix, with_metadata=not arg.no_metadata,
+                                     with_tags=arg.tags, concurrency=arg.concurrency,
+                                     progress=progress)
+        if arg.incremental:
+            self.poutput(_i('Synchronised ') + str(summary['listed']) + _i(' objects below ') +
+                         f'{self.bucket}/{prefix}' + _i(f" ({summary['inserted']} new, "
+                                                        f"{summary['updated']} changed, "
+                                                        f"{summary['deleted']} removed)"))
+        else:
+            self.poutput(_i('Cached ') + str(summary['objects']) + _i(' objects below ') +
+                         f'{self.bucket}/{prefix}' + _i(f" ({summary['metadata']} metadata and "
+                                                        f"{summary['tags']} tag fetches)"))
+        if summary['errors']:
+            self.poutput(_err(f"{summary['errors']} requests failed"))
+
+    search_args = cmd2.Cmd2ArgumentParser()
+    search_args.add_argument('-p', '--path', default=None, help='Path prefix to search below, relative to your current location')
+    search_args.add_argument('-t', '--text', default=None, help='Text to find anywhere in the metadata names or values (case insensitive)')
+    search_args.add_argument('-w', '--width', nargs='?', default=90, type=int, help='width of display for standard output')
+    search_args.add_argument('keyvals', nargs='*', help='Metadata key-value pairs in the format key=value, values may be globs (e.g. experiment=hist*)')
+    @cmd2.with_argparser(search_args)
+    def do_search(self, arg):
+        """
+        Search the metadata of everything below the current location (at any depth) for
+        objects matching all the key=value pairs (and text), without contacting the server.
+        Only objects whose metadata is in the cache can be found: use "warm" to fill it.
+        """
+        if self.bucket is None:
+            self.poutput(_err('You need to select a bucket first ("cd bucket_name")'))
+            return
+        pairs = {}
+        for kv in arg.keyvals:
+            if '=' not in kv:
+                self.poutput(_err('Invalid key pair: ') + kv)
+                return
+            k, v = kv.split('=', 1)
+            pairs[k] = v
+        if not pairs and not arg.text:
+            self.poutput(_err('Give key=value pairs and/or --text to search for'))
+            return
+        prefix = self.__handle_path(arg.path).lstrip('/')
+        found = self.cache.search(self.bucket, pairs, prefix=prefix, text=arg.text)
+        if not found:
+            self.poutput(_e('No matches'))
+        else:
+            self.columnize([o.object_name for o in found], display_width=arg.width)
+
+    cache_args = cmd2.Cmd2ArgumentParser()
+    cache_args.add_argument('action', nargs='?', default='status',
+                            choices=['status', 'stats', 'mode', 'ttl', 'clear', 'offline', 'online'],
+                            help='Show the cache status (default) or hit/miss statistics, set its mode or TTL, clear it, or go offline/online')
+    cache_args.add_argument('value', nargs='?', help=f'For mode, one of {"|".join(CACHE_MODES)}; for ttl, seconds; for stats, "reset" to reset them')
+    @cmd2.with_argparser(cache_args)
+    def do_cache(self, arg):
+        """
+        s3view keeps the details of objects (and listings) it has seen in a persistent cache,
+        so repeating a command (even in a later session) need not ask the object store again.
+        Show the state of the cache, or how this session's lookups have been answered (so the
+        TTL and size limit can be tuned), change how it is used (or how long entries stay fresh), 
+        clear it, or go offline (answer everything from the cache) and back online.
+        """
+        if self.cache is None:
+            self.poutput(_err('Choose a location first ("loc x")'))
+            return
+        match arg.action:
+            case 'stats':
+                self._cache_stats(reset=arg.value == 'reset')
+                return
+            case 'mode':
+                if arg.value not in CACHE_MODES:
+                    self.poutput(_err(f'Cache mode must be one of {"|".join(CACHE_MODES)}'))
+                    return
+                self.cache.mode = CACHE_MODES[arg.value]
+            case 'ttl':
+                try:
+                    self.cache.ttl = int(arg.value)
+                except (TypeError, ValueError):
+                    self.poutput(_err('Cache TTL must be a whole number of seconds'))
+                    return
+            case 'clear':
+                # each location has a database of its own, so start that afresh
+                self.caches.drop(self.alias)
+                self._use_client(self.s3, self.alias)
+                self.poutput(_i('Cache cleared'))
+            case 'offline':
+                self.cache.mode = CacheMode.CACHE_ONLY
+            case 'online':
+                self.cache.mode = CacheMode.DEFAULT
+        size = self.cache.cache_size()
+        mode = {v: k for k, v in CACHE_MODES.items()}[self.cache.mode]
+        self.poutput(_i('Cache: ') + self.cache.db_path)
+        self.poutput(_i('Mode: ') + mode + _i('  TTL: ') + f'{self.cache.ttl}s')
+        self.poutput(_i('Holding ') + str(size['rows']) + _i(' objects (') + fmt_size(size['bytes']) +
+                     _i(', ') + fmt_size(size['file_bytes']) + _i(' on disk)'))
+
+    def _cache_stats(self, reset=False):
+        """ Show the cache outcomes per bucket and operation """
+        summary = self.cache.cache_stats(reset=reset)
+        if reset:
+            self.poutput(_i('Cache statistics reset'))
+            return
+        if not summary:
+            self.poutput(_i('No cache lookups made yet'))
+            return
+        outcomes = ['hit', 'stale', 'negative', 'revalidated', 'miss', 'none', 'error']
+        header = f"{'bucket/operation':<32}{'count':>7}" + ''.join(f'{o:>12}' for o in outcomes) + f"{'hit%':>7}{'saved':>9}"
+        self.houtput(_i(header))
+        for bucket, operations in summary.items():
+            for operation, op in operations.items():
+                name = f'{bucket}: {operation}'
+                if operation == 'evict':
+                    self.houtput(f"{name:<32}{op['count']:>7}")
+                    continue
+                ratio = f"{op['hit_ratio']*100:.0f}%" if op['hit_ratio'] is not None else '-'
+                self.houtput(f"{name:<32}{op['count']:>7}" + ''.join(f'{op[o]:>12}' for o in outcomes) +
+                             f"{ratio:>7}{op['saved_seconds']:>8.1f}s")
+
+    stats_args = cmd2.Cmd2ArgumentParser()
+    stats_args.add_argument('-c', '--commands', action='store_true', help='Break the statistics down by s3view command')
+    stats_args.add_argument('-r', '--reset', action='store_true', help='Reset the statistics')
+    @cmd2.with_argparser(stats_args)
+    def do_stats(self, arg):
+        """
+        Show how many requests of each kind (LIST/HEAD/GET/PUT/DELETE) this session has 
+        made to the object store, with payload volumes and latency percentiles, so you can 
+        see which commands are chatty.
+        """
+        if arg.reset:
+            self.stats.reset()
+            self.poutput(_i('Request statistics reset'))
+            return
+        summary = self.stats.summary(by_context=arg.commands)
+        if not summary:
+            self.poutput(_i('No requests made yet'))
+            return
+
+        def ms(seconds):
+            return f'{seconds*1000:.0f}ms' if seconds != float('inf') else 'slow'
+
+        header = f"{'operation':<28}{'verb':<8}{'count':>7}{'errors':>7}{'bytes':>10}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+        self.houtput(_i(header))
+        for key, op in summary.items():
+            name = f'{key[0]}: {key[1]}' if arg.commands else key
+            mean = op['seconds']/op['count']
+            self.houtput(f"{name:<28}{op['verb']:<8}{op['count']:>7}{op['errors']:>7}"
+                         f"{fmt_size(op['bytes']):>10}{ms(mean):>9}{ms(op['p50']):>9}"
+                         f"{ms(op['p95']):>9}{ms(op['p99']):>9}")
+
     def do_loglevel(self, arg):
         """
         Change logging level. Usage: loglevel [debug|info|warning|error|critical]
@@ -2,99 +2,374 @@ from pathlib import Path
 from io import StringIO
 import json
 from minio import Minio
+from cfs3.s3glob import iter_glob
 from urllib.parse import quote, unquote
+import certifi
+import os
 import sys
+import threading
+import time
+import urllib3
+from concurrent.futures import ThreadPoolExecutor
 import warnings
 
-def get_locations(config_file=None):
+DEFAULT_POOL_SIZE = 32
+""" 
+Number of keep-alive connections held per client. This matches the largest worker 
+count a default ThreadPoolExecutor will use, so our metadata fan-outs never discard 
+connections because the pool is full.
+"""
+
+def _config_path(config_file=None):
     """ 
-    Read config file and find usable locations
+    Resolve the location of a minio configuration file
     """
     if config_file is None:
         config_file = Path.home()/'.mc/config.json'
+    return Path(config_file).expanduser()
 
+
+def _parse_locations(config_file):
+    """ 
+    Parse a config file and return usable locations, along with 
+    any warnings about unusable ones.
+    """
     with open(config_file,'r') as jfile:
         jdata = json.load(jfile)
     jd = jdata['aliases']
     locations = {}
+    messages = []
     for k,v in jd.items():
         api = v.get('api')
         if api != 'S3v4':
-            warnings.warn(f'WARNING: Found unexpected S3 API {api} for {k} in configuration file {config_file}')
+            messages.append(f'WARNING: Found unexpected S3 API {api} for {k} in configuration file {config_file}')
         else:
             locations[k]=v
-    return locations
+    return locations, messages
 
 
-def get_user_config(target, config_file=None):
+class ConfigCache:
     """
-    Obtain credentials from user configuration file
+    Parsed minio configuration files, shared by everything in the process
+    (s3view, the Uploader and the science readers all come through here).
+
+    Each file is parsed once, and only re-read when its modification time
+    or size changes, so repeated calls to get_locations cost a stat rather 
+    than a parse.
     """
-    if config_file is None:
-        config_file = Path.home()/'.mc/config.json'
-    options = get_locations(config_file)
-    try:
-        options = get_locations(config_file)
-        return options[target]
-    except KeyError:
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def locations(self, config_file=None):
+        """
+        Return the usable locations in config_file. Warnings about unusable
+        locations are re-issued on every call, just as if we had re-read the file.
+        """
+        config_file = _config_path(config_file)
+        status = os.stat(config_file)
+        stamp = (status.st_mtime_ns, status.st_size)
+        with self._lock:
+            entry = self._entries.get(config_file)
+        if entry is None or entry[0] != stamp:
+            locations, messages = _parse_locations(config_file)
+            entry = (stamp, locations, messages)
+            with self._lock:
+                self._entries[config_file] = entry
+        _, locations, messages = entry
+        for message in messages:
+            warnings.warn(message)
+        return {k: dict(v) for k, v in locations.items()}
+
+    def user_config(self, target, config_file=None):
+        """ 
+        Return the configuration for one location
+        """
+        options = self.locations(config_file)
+        try:
+            return options[target]
+        except KeyError:
+            raise ValueError(f'Minio target [{target}] not found in {_config_path(config_file)}')
+
+    def clear(self):
+        """ 
+        Forget everything we have parsed
+        """
+        with self._lock:
+            self._entries = {}
+
+
+config_cache = ConfigCache()
+
+
+def get_locations(config_file=None):
+    """ 
+    Read config file and find usable locations
+    """
+    return config_cache.locations(config_file)
 
-        raise ValueError(f'Minio target [{target}] not found in ~/{config_file}')
 
+class EndpointSelector:
+    """
+    Choose the fastest reachable endpoint from a list of candidates.
 
-def get_client(alias, config_file=None):
+    Each candidate is probed with a cheap unauthenticated HEAD of the service
+    root (any HTTP response at all means it is reachable), and the measured
+    round trip time is remembered for ttl seconds, so we only probe once in a
+    while, not on every request. Once an endpoint is chosen we stay with it
+    while it is reachable, unless another is clearly faster, so small changes
+    in the measurements don't flip us (and our pooled clients) between them.
     """
-    Get Minio client from the configuration alias, and patch the 
-    client with that alias name
+    def __init__(self, ttl=600, timeout=2.0, margin=0.25, min_gain=0.005):
+        """
+        Args:
+            ttl (float, optional): Seconds to keep a measurement. Defaults to 600.
+            timeout (float, optional): Seconds to wait for a probe. Defaults to 2.
+            margin (float, optional): Fraction of the current endpoint's round trip
+                time another must save before we switch to it. Defaults to 0.25.
+            min_gain (float, optional): Seconds another endpoint must save before
+                we switch to it, however small the times. Defaults to 0.005.
+        """
+        self.ttl = ttl
+        self.timeout = timeout
+        self.margin = margin
+        self.min_gain = min_gain
+        self._rtts = {}
+        self._chosen = {}
+        self._lock = threading.Lock()
+        self._http = urllib3.PoolManager(
+            cert_reqs='CERT_REQUIRED',
+            ca_certs=os.environ.get('SSL_CERT_FILE') or certifi.where(),
+            retries=False)
+
+    def _measure(self, url):
+        """ Return the round trip time to url in seconds, or None if unreachable """
+        try:
+            e1 = time.time()
+            self._http.request('HEAD', url, timeout=self.timeout, redirect=False)
+            return time.time() - e1
+        except Exception:
+            return None
+
+    def _remembered(self, url):
+        """ The remembered (time, rtt) measurement of url, if it is still fresh """
+        with self._lock:
+            entry = self._rtts.get(url)
+        if entry is not None and time.time() - entry[0] < self.ttl:
+            return entry
+        return None
+
+    def rtt(self, url):
+        """
+        Return the (possibly remembered) round trip time to url, None if unreachable
+        """
+        entry = self._remembered(url)
+        if entry is not None:
+            return entry[1]
+        rtt = self._measure(url)
+        with self._lock:
+            self._rtts[url] = (time.time(), rtt)
+        return rtt
+
+    def select(self, urls):
+        """
+        Return the fastest reachable url (or the one we chose before, unless
+        another is clearly faster). If none are reachable, return the first and
+        let the caller find out why.
+        """
+        if len(urls) == 1:
+            return urls[0]
+        # only probe what we haven't measured lately, and only in parallel if there are several
+        unmeasured = [url for url in urls if self._remembered(url) is None]
+        measured = {}
+        if len(unmeasured) > 1:
+            with ThreadPoolExecutor(max_workers=len(unmeasured)) as executor:
+                measured = dict(zip(unmeasured, executor.map(self.rtt, unmeasured)))
+        rtts = [measured[url] if url in measured else self.rtt(url) for url in urls]
+        reachable = [(rtt, i) for i, rtt in enumerate(rtts) if rtt is not None]
+        if not reachable:
+            return urls[0]
+        best_rtt, best = min(reachable)
+        with self._lock:
+            chosen = self._chosen.get(tuple(urls))
+            current = rtts[urls.index(chosen)] if chosen in urls else None
+            if current is None or current - best_rtt > max(self.min_gain, self.margin * current):
+                chosen = self._chosen[tuple(urls)] = urls[best]
+        return chosen
+
+    def clear(self):
+        with self._lock:
+            self._rtts = {}
+            self._chosen = {}
+
+
+endpoint_selector = EndpointSelector()
+
+
+def get_endpoints(credentials):
+    """
+    Return the candidate endpoint urls for a location. As well as the 
+    usual "url", a location can list alternatives (e.g. the internal 
+    and external addresses of the same tenancy) as "urls".
+    """
+    urls = credentials.get('urls') or []
+    if isinstance(urls, str):
+        urls = [urls]
+    url = credentials.get('url')
+    if url and url not in urls:
+        urls = [url] + list(urls)
+    return list(urls)
+
+
+def get_user_config(target, config_file=None, resolve=True):
+    """
+    Obtain credentials from user configuration file. If the location
+    has several candidate endpoints and resolve is True, the "url" 
+    returned is the fastest reachable one (see EndpointSelector).
+    """
+    credentials = config_cache.user_config(target, config_file)
+    if resolve:
+        urls = get_endpoints(credentials)
+        if len(urls) > 1:
+            credentials['url'] = endpoint_selector.select(urls)
+    return credentials
+
+
+def _make_http_client(pool_size=DEFAULT_POOL_SIZE):
+    """
+    Build the urllib3 pool used by a Minio client. This mirrors the Minio
+    defaults except for the pool size.
+    """
+    timeout = 300
+    return urllib3.PoolManager(
+        timeout=urllib3.Timeout(connect=timeout, read=timeout),
+        maxsize=pool_size,
+        cert_reqs='CERT_REQUIRED',
+        ca_certs=os.environ.get('SSL_CERT_FILE') or certifi.where(),
+        retries=urllib3.Retry(
+            total=5,
+            backoff_factor=0.2,
+            status_forcelist=[500, 502, 503, 504]
+        )
+    )
+
+
+def _make_client(alias, credentials, pool_size=DEFAULT_POOL_SIZE):
+    """
+    Create a new Minio client from a set of credentials
     """
-    credentials = get_user_config(alias, config_file=config_file)
     secure = False
     if credentials['url'].startswith('https'):
         secure = True
+    api = {'endpoint':'url','access_key':'accessKey','secret_key':'secretKey'}
     try:
-        api = {'endpoint':'url','access_key':'accessKey','secret_key':'secretKey'}
-        try:
-            kw = {k:credentials[v] for k,v in api.items()}
-        except KeyError as e:
-            raise KeyError(f"Cannot find {e.args[0]} in credentials supplied")
-        kw['secure'] = secure
-        endpoint = kw['endpoint']
-        slashes = endpoint.find('//')
-        if slashes > -1:
-            kw['endpoint'] = endpoint[slashes+2:]
-        client = Minio(**kw) 
-    except:
-        raise 
+        kw = {k:credentials[v] for k,v in api.items()}
+    except KeyError as e:
+        raise KeyError(f"Cannot find {e.args[0]} in credentials supplied")
+    kw['secure'] = secure
+    endpoint = kw['endpoint']
+    slashes = endpoint.find('//')
+    if slashes > -1:
+        kw['endpoint'] = endpoint[slashes+2:]
+    client = Minio(http_client=_make_http_client(pool_size), **kw) 
     # nasty monkey patch, but I want to carry this around
     client.alias_name = alias
     return client
 
-def lswild(client, bucket, pattern='*', objects=False):
+
+class ClientRegistry:
+    """
+    Process-wide registry of Minio clients, one per alias.
+
+    Minio clients are thread-safe, so everything in a process which talks to 
+    the same alias (s3view, the Uploader, thread pools etc) can share one client,
+    and hence one pool of warm keep-alive connections. A client is rebuilt if the
+    credentials for its alias change.
+    """
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE):
+        """ 
+        Args:
+            pool_size (int, optional): Connections kept per client. Defaults to DEFAULT_POOL_SIZE.
+        """
+        self.pool_size = pool_size
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, alias, config_file=None, pool_size=None):
+        """
+        Return the shared client for alias, creating it if necessary.
+        """
+        credentials = get_user_config(alias, config_file=config_file)
+        pool_size = pool_size or self.pool_size
+        signature = (credentials.get('url'), credentials.get('accessKey'),
+                     credentials.get('secretKey'), pool_size)
+        with self._lock:
+            if alias in self._clients:
+                existing_signature, client = self._clients[alias]
+                if existing_signature == signature:
+                    return client
+            client = _make_client(alias, credentials, pool_size)
+            self._clients[alias] = (signature, client)
+        return client
+
+    def clear(self, alias=None):
+        """
+        Forget one (or all) clients, closing their connection pools.
+        """
+        with self._lock:
+            aliases = [alias] if alias is not None else list(self._clients)
+            for a in aliases:
+                if a in self._clients:
+                    _, client = self._clients.pop(a)
+                    client._http.clear()
+
+    def __contains__(self, alias):
+        return alias in self._clients
+
+
+client_registry = ClientRegistry()
+
+
+def get_client(alias, config_file=None, shared=True, pool_size=None):
+    """
+    Get Minio client from the configuration alias, and patch the 
+    client with that alias name. By default the client comes from
+    the process-wide client_registry, so repeated calls are cheap and
+    share connections. Use shared=False to get a private client.
+    """
+    if shared:
+        return client_registry.get(alias, config_file=config_file, pool_size=pool_size)
+    credentials = get_user_config(alias, config_file=config_file)
+    return _make_client(alias, credentials, pool_size or DEFAULT_POOL_SIZE)
+
+def ilswild(client, bucket, pattern='*', objects=False, limit=None):
+    """
+    Generator version of lswild: matches are yielded as the listing pages
+    arrive, and if limit is given we stop (and stop listing) after that 
+    many matches.
+    """
+    if limit is not None and limit <= 0:
+        return
+    matches = iter_glob(client, bucket, pattern)
+    try:
+        for i, o in enumerate(matches, 1):
+            yield o if objects else o.object_name
+            if limit is not None and i >= limit:
+                return
+    finally:
+        matches.close()
+
+
+def lswild(client, bucket, pattern='*', objects=False, limit=None):
     """ 
-    Do an ls on a bucket visible on the minio client which matches pattern
-    This isn't quite a perfect glob! So be careful. Also, we're being cunning
-    in trying to get the server to try and do some of the matching, at least
-    for simple cases.
-    If objects is False, return just names, oterwise return the objects
-    for later processing
-    """
-    
-    asterix = pattern.find('*')
-    
-    if asterix > 0:
-        prefix = pattern[0:asterix]
-        pattern = pattern[asterix:]
-    else:
-        prefix = None
-    
-    objects = client.list_objects(bucket, prefix=prefix)
-    
-    if objects:
-        olist = [o for o in objects if Path(o.object_name).match(pattern)]
-        return olist
-    else:
-        object_names = [o.object_name for o in objects]
-        flist = [p for p in object_names if Path(p).match(pattern)]
-        return flist
+    Do an ls on a bucket visible on the minio client which matches pattern.
+    The pattern is a glob anchored at the root of the bucket (``*`` and ``?``
+    do not cross a "/", ``**`` matches any depth), and as much of it as
+    possible is resolved by the server (see cfs3.s3glob.iter_glob).
+    If objects is False, return just names, otherwise return the objects
+    for later processing. If limit is given, return at most that many.
+    """
+    return list(ilswild(client, bucket, pattern, objects=objects, limit=limit))
 
 def sanitise_metadata(indict):
     """ 
@@ -0,0 +1,167 @@
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from cfs3.s3shard import sharded_list_objects
+
+_WILDCARDS = '*?['
+
+
+def _has_wildcard(segment):
+    return any(c in segment for c in _WILDCARDS)
+
+
+def _literal_prefix(segment):
+    """
+    Return the part of a pattern before the first wildcard
+    """
+    for i, c in enumerate(segment):
+        if c in _WILDCARDS:
+            return segment[:i]
+    return segment
+
+
+def _translate_segment(segment):
+    """
+    Translate one path segment of a glob into a regular expression.
+    Wildcards never match across a "/".
+    """
+    out = []
+    i, n = 0, len(segment)
+    while i < n:
+        c = segment[i]
+        i += 1
+        if c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            j = i
+            if j < n and segment[j] in '!^':
+                j += 1
+            if j < n and segment[j] == ']':
+                j += 1
+            while j < n and segment[j] != ']':
+                j += 1
+            if j >= n:
+                # no closing bracket, treat literally
+                out.append(re.escape(c))
+            else:
+                body = segment[i:j]
+                i = j + 1
+                negate = body[:1] in ('!', '^')
+                if negate:
+                    body = body[1:]
+                # as in fnmatch, a "]" straight after the (negated) opening bracket is a
+                # member, which a regex class would take as its end, so escape it (and "[")
+                body = body.replace('\\', '\\\\').replace(']', '\\]').replace('[', '\\[')
+                if negate:
+                    out.append(f'[^/{body}]')
+                else:
+                    out.append(f'[{body}]')
+        else:
+            out.append(re.escape(c))
+    return ''.join(out)
+
+
+def _translate(segments):
+    """
+    Translate a list of glob segments into an anchored regular expression
+    for a whole key. A "**" segment matches zero or more complete segments.
+    """
+    parts = []
+    last = len(segments) - 1
+    for i, segment in enumerate(segments):
+        if segment == '**':
+            if i == last:
+                parts.append('.*')
+            else:
+                parts.append('(?:[^/]+/)*')
+        else:
+            parts.append(_translate_segment(segment))
+            if i != last:
+                parts.append('/')
+    return '^' + ''.join(parts) + '$'
+
+
+@dataclass(frozen=True)
+class GlobPattern:
+    """
+    A compiled glob for object keys.
+
+    ``regex`` matches complete keys, ``prefix`` is the longest literal
+    prefix which can be handed to the server, and ``segments`` are the
+    "/" separated parts of the pattern which drive the listing plan.
+    """
+    pattern: str
+    regex: re.Pattern
+    prefix: str
+    segments: tuple
+
+    def match(self, key):
+        """ True if key matches the whole pattern """
+        return self.regex.match(key) is not None
+
+
+@lru_cache(maxsize=256)
+def compile_glob(pattern):
+    """
+    Compile a glob pattern for use with object keys.
+    Supports ``*``, ``?``, ``[...]`` within a segment, and ``**``
+    as a whole segment (matching any depth).
+    """
+    segments = tuple(s for s in pattern.lstrip('/').split('/') if s != '')
+    if not segments:
+        segments = ('*',)
+    regex = re.compile(_translate(segments), re.DOTALL)
+    return GlobPattern(pattern=pattern,
+                       regex=regex,
+                       prefix=_literal_prefix('/'.join(segments)),
+                       segments=segments)
+
+
+@lru_cache(maxsize=1024)
+def _segment_regex(segment):
+    return re.compile('^' + _translate_segment(segment) + '$', re.DOTALL)
+
+
+def iter_glob(client, bucket, pattern):
+    """
+    Generator of the objects in bucket which match pattern.
+
+    The listing plan walks the pattern a segment at a time: literal
+    segments just extend the server prefix, wildcard segments are
+    resolved with a delimited (non-recursive) listing which only expands
+    the matching intermediate "directories", and "**" falls back to a
+    (sharded) recursive listing below the current prefix. The final
+    segment is always narrowed on the server by its own literal prefix.
+    """
+    glob = compile_glob(pattern) if isinstance(pattern, str) else pattern
+    yield from _walk(client, bucket, glob, '', 0)
+
+
+def _walk(client, bucket, glob, prefix, index):
+    segments = glob.segments
+    last = len(segments) - 1
+
+    # consume literal directory segments without asking the server anything
+    while index < last and not _has_wildcard(segments[index]):
+        prefix = f'{prefix}{segments[index]}/'
+        index += 1
+
+    segment = segments[index]
+
+    if segment == '**':
+        for o in sharded_list_objects(client, bucket, prefix=prefix, recursive=True):
+            if not o.is_dir and glob.match(o.object_name):
+                yield o
+        return
+
+    server_prefix = prefix + _literal_prefix(segment)
+    regex = _segment_regex(segment)
+    for o in client.list_objects(bucket, prefix=server_prefix or None, recursive=False):
+        name = o.object_name[len(prefix):]
+        if index == last:
+            if not o.is_dir and regex.match(name):
+                yield o
+        elif o.is_dir and regex.match(name.rstrip('/')):
+            yield from _walk(client, bucket, glob, o.object_name, index + 1)
@@ -1,5 +1,5 @@
 import cf
-from cfs3.s3core import get_user_config, Capturing
+from cfs3.s3core import get_user_config, Capturing, DEFAULT_POOL_SIZE
 
 
 
@@ -11,7 +11,8 @@ def cfread(alias, bucket, path, object, short=False, complete=False):
     storage_options = {
                 'key':credentials['accessKey'],
                 'secret':credentials['secretKey'],  
-                'endpoint_url':credentials['url']
+                'endpoint_url':credentials['url'],
+                'config_kwargs': {'max_pool_connections': DEFAULT_POOL_SIZE},
     }
     if path == '' or path=='/':
         bits = [bucket,object]
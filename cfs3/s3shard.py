@@ -0,0 +1,169 @@
+import heapq
+import itertools
+import queue
+import string
+import threading
+
+DEFAULT_SHARDS = 16
+""" Default number of shards (and of listings in flight) """
+
+PAGE_SIZE = 1000
+""" Objects per page of an S3 listing """
+
+RANGE_ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase
+""" Characters used to cut the keyspace when we have to shard by range """
+
+_DONE = object()
+
+
+def range_boundaries(prefix, shards, alphabet=RANGE_ALPHABET):
+    """
+    Return shards-1 sorted keys which cut the keyspace below prefix into
+    shards ranges: (-inf, b1], (b1, b2], ... (bn, +inf).
+    """
+    shards = max(1, min(shards, len(alphabet) + 1))
+    step = len(alphabet) / shards
+    return [prefix + alphabet[int(round(i * step)) - 1] for i in range(1, shards)]
+
+
+def _list_range(client, bucket, prefix, recursive, lower, upper, include_user_meta):
+    """
+    List the keys below prefix in (lower, upper]. None means unbounded.
+    """
+    kw = dict(prefix=prefix or None, recursive=recursive)
+    if include_user_meta:
+        kw['include_user_meta'] = True
+    if lower is not None:
+        kw['start_after'] = lower
+    for o in client.list_objects(bucket, **kw):
+        if upper is not None and o.object_name > upper:
+            # delimited listings can roll a whole "directory" up into one
+            # entry which straddles the boundary, it belongs to the next shard
+            return
+        yield o
+
+
+def _run_shards(listers, concurrency):
+    """
+    Run each zero-argument lister (a callable returning an iterator of objects)
+    on the shared executor, and yield their results shard by shard. At most
+    concurrency shards are listed at once, started in order, and each has a
+    bounded queue. A producer which fills its queue gives its thread back rather
+    than waiting, and is resumed once the consumer has drained it, so a slow
+    consumer (or one that stops early) holds back the producers without tying
+    up threads other fan-outs need.
+    """
+    # (s3async needs s3core, which needs us)
+    from cfs3.s3async import fanout_executor
+    stop = threading.Event()
+    lock = threading.Lock()
+    limit = PAGE_SIZE * 4
+    queues = [queue.Queue() for _ in listers]
+    iterators = [None] * len(listers)
+    paused = [False] * len(listers)
+    started = 0
+
+    def start_next():
+        nonlocal started
+        with lock:
+            if stop.is_set() or started == len(listers):
+                return
+            i, started = started, started + 1
+        executor.submit(produce, i)
+
+    def produce(i):
+        try:
+            if iterators[i] is None:
+                iterators[i] = iter(listers[i]())
+            while not stop.is_set():
+                with lock:
+                    # (decided under the lock, so the consumer sees it before it drains the queue)
+                    if queues[i].qsize() >= limit:
+                        paused[i] = True
+                        return
+                try:
+                    o = next(iterators[i])
+                except StopIteration:
+                    queues[i].put(_DONE)
+                    break
+                queues[i].put(o)
+        except Exception as e:
+            queues[i].put(e)
+        start_next()
+
+    with fanout_executor(max(1, min(concurrency, len(listers)))) as executor:
+        try:
+            for _ in range(min(concurrency, len(listers))):
+                start_next()
+            for i, q in enumerate(queues):
+                while True:
+                    item = q.get()
+                    with lock:
+                        resume = paused[i] and q.qsize() < limit // 2
+                        if resume:
+                            paused[i] = False
+                    if resume:
+                        executor.submit(produce, i)
+                    if item is _DONE:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+        finally:
+            stop.set()
+
+
+def sharded_list_objects(client, bucket, prefix=None, recursive=True,
+                         shards=DEFAULT_SHARDS, concurrency=DEFAULT_SHARDS,
+                         strategy='auto', include_user_meta=False):
+    """
+    List objects below prefix with several listings in flight, yielding
+    them in the same (sorted) order as a single client.list_objects would.
+
+    Strategies:
+      - "prefix": list the top level with a delimiter, then list each
+        "directory" found there (recursively) as its own shard.
+      - "range": cut the keyspace into character ranges using start_after.
+      - "auto" (default): probe the first page of the top level. If it is
+        complete, small listings are answered from it directly and deep ones
+        are sharded by prefix, otherwise (a big flat level) shard by range.
+    """
+    prefix = prefix or ''
+
+    if strategy == 'range':
+        yield from _range_sharded(client, bucket, prefix, recursive, shards,
+                                  concurrency, include_user_meta)
+        return
+
+    if strategy == 'prefix':
+        probe = list(_list_range(client, bucket, prefix, False, None, None, include_user_meta))
+    else:
+        probe = list(itertools.islice(
+            _list_range(client, bucket, prefix, False, None, None, include_user_meta),
+            PAGE_SIZE + 1))
+        if len(probe) > PAGE_SIZE:
+            yield from _range_sharded(client, bucket, prefix, recursive, shards,
+                                      concurrency, include_user_meta)
+            return
+
+    dirs = [o for o in probe if o.is_dir]
+    if not recursive or not dirs:
+        yield from probe
+        return
+
+    files = [o for o in probe if not o.is_dir]
+    listers = [
+        (lambda d=d: _list_range(client, bucket, d.object_name, True, None, None, include_user_meta))
+        for d in dirs]
+    # directory shards are disjoint and in key order, so concatenating them is
+    # sorted, and we only need to merge in the files from the top level
+    yield from heapq.merge(files, _run_shards(listers, concurrency),
+                           key=lambda o: o.object_name)
+
+
+def _range_sharded(client, bucket, prefix, recursive, shards, concurrency, include_user_meta):
+    bounds = [None] + range_boundaries(prefix, shards) + [None]
+    listers = [
+        (lambda lo=lo, hi=hi: _list_range(client, bucket, prefix, recursive, lo, hi, include_user_meta))
+        for lo, hi in zip(bounds[:-1], bounds[1:])]
+    yield from _run_shards(listers, concurrency)
@@ -0,0 +1,298 @@
+import functools
+import os
+import threading
+import time
+
+OPERATIONS = {
+    'list_buckets': 'LIST',
+    'list_objects': 'LIST',
+    'bucket_exists': 'HEAD',
+    'stat_object': 'HEAD',
+    'get_object': 'GET',
+    'fget_object': 'GET',
+    'get_object_tags': 'GET',
+    'put_object': 'PUT',
+    'fput_object': 'PUT',
+    'copy_object': 'PUT',
+    'set_object_tags': 'PUT',
+    'make_bucket': 'PUT',
+    'remove_object': 'DELETE',
+    'remove_objects': 'DELETE',
+    'remove_bucket': 'DELETE',
+}
+""" Client methods we instrument, and the kind of S3 request each makes """
+
+LIST_PAGE_SIZE = 1000
+
+# latency histogram bucket upper bounds, 1ms doubling up to ~9 minutes
+_BOUNDS = [0.001 * 2 ** i for i in range(20)] + [float('inf')]
+
+
+class OperationStats:
+    """
+    Counts, bytes, and a latency histogram for one operation
+    """
+    def __init__(self, verb):
+        self.verb = verb
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.histogram = [0] * len(_BOUNDS)
+
+    def add(self, seconds, nbytes=0, error=False):
+        self.count += 1
+        self.errors += int(error)
+        self.bytes += nbytes or 0
+        self.seconds += seconds
+        for i, bound in enumerate(_BOUNDS):
+            if seconds <= bound:
+                self.histogram[i] += 1
+                break
+
+    def merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.bytes += other.bytes
+        self.seconds += other.seconds
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+
+    def percentile(self, q):
+        """ Upper bound (in seconds) of the histogram bucket holding the q-th percentile """
+        if self.count == 0:
+            return None
+        target = q / 100 * self.count
+        running = 0
+        for bound, n in zip(_BOUNDS, self.histogram):
+            running += n
+            if running >= target:
+                return bound
+        return _BOUNDS[-1]
+
+    def as_dict(self):
+        return {'verb': self.verb,
+                'count': self.count,
+                'errors': self.errors,
+                'bytes': self.bytes,
+                'seconds': self.seconds,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'p99': self.percentile(99)}
+
+
+class RequestStats:
+    """
+    Thread-safe accumulator of request statistics.
+
+    Records are kept per (context, operation), where the context is a label
+    for whatever the caller is doing (s3view sets it to the current command)
+    so we can see which commands are chatty.
+    """
+    def __init__(self):
+        self.context = None
+        self._ops = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation, seconds, nbytes=0, error=False):
+        key = (self.context, operation)
+        with self._lock:
+            if key not in self._ops:
+                self._ops[key] = OperationStats(OPERATIONS.get(operation, 'OTHER'))
+            self._ops[key].add(seconds, nbytes, error)
+
+    def summary(self, by_context=False):
+        """
+        Return a dictionary of operation statistics (see OperationStats.as_dict),
+        keyed by operation, or by (context, operation) if by_context.
+        """
+        merged = {}
+        with self._lock:
+            for (context, operation), ops in self._ops.items():
+                key = (context, operation) if by_context else operation
+                if key not in merged:
+                    merged[key] = OperationStats(ops.verb)
+                merged[key].merge(ops)
+        return {k: v.as_dict() for k, v in sorted(merged.items(), key=lambda kv: str(kv[0]))}
+
+    def reset(self):
+        with self._lock:
+            self._ops = {}
+
+
+def _nbytes(operation, args, kwargs, result):
+    """ Best estimate of the payload size of a request """
+    try:
+        if operation == 'put_object':
+            return kwargs.get('length', args[3] if len(args) > 3 else 0)
+        if operation == 'fput_object':
+            return os.path.getsize(kwargs.get('file_path', args[2] if len(args) > 2 else None))
+        if operation == 'fget_object':
+            return os.path.getsize(kwargs.get('file_path', args[2] if len(args) > 2 else None))
+        if operation == 'get_object':
+            return int(result.headers.get('content-length', 0))
+    except Exception:
+        pass
+    return 0
+
+
+class InstrumentedClient:
+    """
+    Wrap a Minio client (or a client-like object) and record the count,
+    payload bytes and latency of every request made through it.
+    Anything we don't instrument is forwarded untouched.
+
+    Listings are lazy, so for those we time the calls to the listing
+    generator and record one LIST request per page of results. Bulk deletes
+    are lazy too, but only yield errors, so for those we count the keys
+    consumed and record one DELETE per multi-delete request of up to
+    LIST_PAGE_SIZE keys.
+    """
+    def __init__(self, client, stats=None):
+        self._client = client
+        self.stats = stats if stats is not None else RequestStats()
+
+    def _listing(self, operation, iterator):
+        seconds, n = 0.0, 0
+        iterator = iter(iterator)
+        while True:
+            e1 = time.time()
+            try:
+                o = next(iterator)
+            except StopIteration:
+                seconds += time.time() - e1
+                if n % LIST_PAGE_SIZE or n == 0:
+                    self.stats.record(operation, seconds)
+                return
+            except Exception:
+                self.stats.record(operation, seconds + time.time() - e1, error=True)
+                raise
+            seconds += time.time() - e1
+            n += 1
+            if n % LIST_PAGE_SIZE == 0:
+                self.stats.record(operation, seconds)
+                seconds = 0.0
+            yield o
+
+    def _removing(self, remove_objects, bucket_name, delete_object_list, *args, **kwargs):
+        sent = 0
+
+        def counted(items):
+            nonlocal sent
+            for item in items:
+                sent += 1
+                yield item
+
+        seconds, failed = 0.0, False
+        e1 = time.time()
+        try:
+            errors = iter(remove_objects(bucket_name, counted(delete_object_list), *args, **kwargs))
+            while True:
+                try:
+                    error = next(errors)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.time() - e1
+                yield error
+                e1 = time.time()
+        except Exception:
+            failed = True
+            raise
+        finally:
+            batches = -(-sent // LIST_PAGE_SIZE) or int(failed)
+            for i in range(batches):
+                # the requests aren't timed separately, so share the time out
+                self.stats.record('remove_objects', seconds / batches,
+                                  error=failed and i == batches - 1)
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name not in OPERATIONS or not callable(attr):
+            return attr
+        if name == 'remove_objects':
+            return functools.wraps(attr)(functools.partial(self._removing, attr))
+
+        @functools.wraps(attr)
+        def instrumented(*args, **kwargs):
+            e1 = time.time()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception:
+                self.stats.record(name, time.time() - e1, error=True)
+                raise
+            if name == 'list_objects':
+                return self._listing(name, result)
+            self.stats.record(name, time.time() - e1, _nbytes(name, args, kwargs, result))
+            return result
+
+        return instrumented
+
+
+CACHE_OUTCOMES = ('hit', 'stale', 'negative', 'revalidated', 'miss', 'none', 'error')
+"""
+How a cache lookup was answered: from the cache while fresh, from the cache while stale,
+with a remembered "no such object", by S3 confirming the cached entry is unchanged,
+by fetching from S3, with nothing (offline and not cached), or with an error.
+"""
+
+_CACHE_ANSWERED = ('hit', 'stale', 'negative')
+
+
+class CacheStats:
+    """
+    Thread-safe accumulator of cache outcomes, kept per (bucket, operation):
+    a count and the total seconds for each outcome, and the number of rows
+    evicted from each bucket.
+    """
+    def __init__(self):
+        self._ops = {}
+        self._evicted = {}
+        self._lock = threading.Lock()
+
+    def record(self, bucket, operation, outcome, seconds):
+        key = (bucket, operation)
+        with self._lock:
+            if key not in self._ops:
+                self._ops[key] = {o: [0, 0.0] for o in CACHE_OUTCOMES}
+            entry = self._ops[key][outcome]
+            entry[0] += 1
+            entry[1] += seconds
+
+    def evicted(self, bucket, n):
+        with self._lock:
+            self._evicted[bucket] = self._evicted.get(bucket, 0) + n
+
+    def summary(self):
+        """
+        Return {bucket: {operation: statistics}}, where the statistics hold the count
+        and seconds for each outcome, the total count, the hit_ratio (the fraction
+        answered without asking S3), and saved_seconds, an estimate of the time the
+        cache saved: what those answers would have taken at the mean time of a miss,
+        less what they did take. Evictions appear as the operation "evict".
+        """
+        with self._lock:
+            ops = {k: {o: list(v) for o, v in outcomes.items()} for k, outcomes in self._ops.items()}
+            evicted = dict(self._evicted)
+        out = {}
+        for (bucket, operation), outcomes in sorted(ops.items(), key=lambda kv: str(kv[0])):
+            stats = {o: n for o, (n, _) in outcomes.items()}
+            stats.update({f'{o}_seconds': s for o, (_, s) in outcomes.items()})
+            total = sum(n for n, _ in outcomes.values())
+            answered = sum(outcomes[o][0] for o in _CACHE_ANSWERED)
+            misses, miss_seconds = outcomes['miss']
+            saved = 0.0
+            if misses:
+                saved = max(0.0, answered * miss_seconds / misses -
+                            sum(outcomes[o][1] for o in _CACHE_ANSWERED))
+            stats.update(count=total,
+                         hit_ratio=answered / total if total else None,
+                         saved_seconds=saved)
+            out.setdefault(bucket, {})[operation] = stats
+        for bucket, n in sorted(evicted.items()):
+            out.setdefault(bucket, {})['evict'] = {'count': n}
+        return out
+
+    def reset(self):
+        with self._lock:
+            self._ops = {}
+            self._evicted = {}
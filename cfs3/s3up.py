@@ -1,8 +1,11 @@
 from pathlib import Path
 from cfs3.s3core import get_client, sanitise_metadata, desanitise_metadata
+from cfs3.s3async import map_concurrently
+from cfs3.s3stats import InstrumentedClient
+from cfs3.s3cache import PersistentCachedMinio, CacheMode, cache_path, alias_endpoint
+import glob
 import os
 import time
-import inspect
 import logging
 
 
@@ -15,7 +18,8 @@ class Uploader:
     def __init__(self, alias, 
                     minio_config='~/.mc/config.json', 
                     default_bucket=None, 
-                    verification=None):
+                    verification=None,
+                    cache_db=None):
         """
         Initialise uploader with the endpoint alias,location of
         the mninio config (if non-standard) and  default bucket
@@ -29,13 +33,46 @@ class Uploader:
                 verification = 0 : no verification
                 verification = 1 : verify size of the uploaded object corresponds to local object
                 other forms of verification (checksums etc, not yet supported) 
+            cache_db (str, optional): the persistent cache to write uploaded objects and their metadata 
+                through to: True for the cache s3view uses for alias (~/.cache/cfs3/<alias>.db), or a path.
+                Defaults to None (no cache). With a cache, use the Uploader as a context manager (or 
+                call close()) so the cache is written out and its threads stopped.
         """
         self.logger = logging.getLogger(f'cfs3.Uploader[{alias}]')
-        self.client = get_client(alias)
+        self.client = InstrumentedClient(get_client(alias, config_file=minio_config))
+        if cache_db is True:
+            cache_db = cache_path(alias)
+        if cache_db is not None:
+            self.client = PersistentCachedMinio(self.client, db_path=cache_db,
+                                                endpoint=alias_endpoint(alias, minio_config))
         self.bucket = default_bucket
         self.verify = verification
         self.logger.debug('Initialised Uploader')
 
+    def flush(self):
+        """ Write out anything the cache has buffered, so other processes (s3view, say) see it """
+        if isinstance(self.client, PersistentCachedMinio):
+            self.client.flush()
+
+    def close(self):
+        """ Write out anything the cache has buffered, and close it """
+        if isinstance(self.client, PersistentCachedMinio):
+            self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def stats(self, by_context=False):
+        """
+        Return a dictionary of statistics about the requests this uploader has
+        made to the object store: count, errors, bytes, total seconds, and 
+        p50/p95/p99 latency (seconds) for each operation.
+        """
+        return self.client.stats.summary(by_context=by_context)
+
     def upload_file(self, file_path, bucket=None, metadata=None, object_name = None):
         """
         Upload a file to the location stored when initialised.
@@ -91,21 +128,50 @@ class Uploader:
         self.logger.info(f'Upload time for {object_name} was {e2-e1:.2f}s (with verification {e3-e2:.2f}s')
 
 
-    def upload_files(self, globstring, bucket, meta_func=None, objName_func=None, move_to_s3=False):
+    def upload_files(self, globstring, bucket, meta_func=None, objName_func=None, move_to_s3=False,
+                     concurrency=1):
         """ 
         Upload file which match globstring, and if provided, use meta_func to
         create/extract metadata, and also if provided, use objName_func to
         create object names for each file which matches the globstring.
+        If concurrency is more than one, upload that many files at a time.
         """
-        paths = Path.glob(globstring)
-        for path in paths:
+        paths = [Path(p) for p in sorted(glob.glob(str(globstring)))]
+
+        def upload(path):
             metadata = meta_func(path) if meta_func else None
             objname = objName_func(path) if objName_func else None
-            if move_to_s3:
+            if move_to_s3 and concurrency > 1:
+                # verification has already been forced on for all the threads
+                self.upload_file(path, bucket=bucket, metadata=metadata, object_name=objname)
+                os.remove(path)
+            elif move_to_s3:
                 self.move_file_to_s3(path, bucket=bucket, metadata=metadata, object_name=objname)
             else:
                 self.upload_file(path, bucket=bucket, metadata=metadata, object_name=objname)
 
+        if concurrency <= 1:
+            try:
+                for path in paths:
+                    upload(path)
+            finally:
+                # the cache writes behind in batches, the whole lot can go now
+                self.flush()
+            return
+        existing_verification = self.verify
+        if move_to_s3:
+            self.verify = max(1, self.verify or 0)
+        try:
+            results = map_concurrently(upload, paths, concurrency=concurrency)
+        finally:
+            self.verify = existing_verification
+            self.flush()
+        errors = [(p, e) for p, e in results if isinstance(e, Exception)]
+        for p, e in errors:
+            self.logger.error(f'Upload of {p} failed: {e}')
+        if errors:
+            raise errors[0][1]
+
 
     def move_file_to_s3(self, file_path, *args, **kwargs):
         """ 
@@ -113,8 +179,8 @@ class Uploader:
         case we remove the file when it has been uploaded!
         """
         existing_verification = self.verify
-        self.verify = min(1, self.verify)
-        self.upload_file(*args, **kwargs)
+        self.verify = max(1, self.verify or 0)
+        self.upload_file(file_path, *args, **kwargs)
         os.remove(file_path)
         self.verify = existing_verification
 
@@ -135,7 +201,11 @@ class Uploader:
         etag is complicated, it's not necessarily the MD5 checksum, so a the moment
         the second step is not done. A warning is raised.
         """
-        result = self.client.stat_object(bucket, object_name)
+        if isinstance(self.client, PersistentCachedMinio):
+            # we have just cached what we sent, and we want to know what arrived
+            result = self.client.stat_object(bucket, object_name, cache_mode=CacheMode.BYPASS)
+        else:
+            result = self.client.stat_object(bucket, object_name)
         object_size = result.size
         if object_size != file_size:
             raise RuntimeError(f'Object size ({object_size}) does not match file size ({file_size})')
@@ -1,7 +1,15 @@
 import pytest
+import json
+import sqlite3
+import threading
+from minio.datatypes import Object
+from minio.error import S3Error
 import time
 from unittest.mock import MagicMock
-from cfs3.s3cache import PersistentCachedMinio, CacheMode, CachedObject
+from cfs3.s3cache import PersistentCachedMinio, AliasCaches, CacheMode, CachedObject, snapshot_info, metadata_matches
+from cfs3.s3async import map_concurrently
+from cfs3 import s3core
+from .utils.fake_minio import FakeMinio
 
 @pytest.fixture
 def mock_minio():
@@ -15,8 +23,8 @@ def mock_minio():
     )
     mock.get_object_tags.return_value = MagicMock(to_dict=lambda: {"tag1": "value"})
     mock.list_objects.return_value = [
-        MagicMock(object_name="file1.txt"),
-        MagicMock(object_name="file2.txt"),
+        Object("bucket", "file1.txt", etag="1", size=10),
+        Object("bucket", "file2.txt", etag="2", size=20),
     ]
     return mock
 
@@ -67,4 +75,767 @@ def test_get_object_tags_caches(cached_client, mock_minio):
     assert result.tags == {"tag1": "value"}
     # Second call should not call S3 again
     cached_client.get_object_tags("bucket", "test.txt")
-    mock_minio.get_object_tags.assert_called_once()
\ No newline at end of file
+    mock_minio.get_object_tags.assert_called_once()
+
+def _committed_rows(cached_client):
+    return cached_client._conn.execute("SELECT COUNT(*) FROM objects").fetchone()[0]
+
+
+def test_writes_are_batched(mock_minio):
+    cached_client = PersistentCachedMinio(mock_minio, db_path=":memory:", ttl=60,
+                                          write_batch_size=3, write_flush_interval=60)
+    cached_client.stat_object("bucket", "a.txt")
+    cached_client.stat_object("bucket", "b.txt")
+    # buffered, but already visible
+    assert _committed_rows(cached_client) == 0
+    assert cached_client.stat_object("bucket", "a.txt").source == "cache"
+    # the hit recorded there counts too, and makes up a batch
+    assert _committed_rows(cached_client) == 2
+    cached_client.stat_object("bucket", "c.txt")
+    cached_client.stat_object("bucket", "d.txt")
+    assert _committed_rows(cached_client) == 2
+    cached_client.stat_object("bucket", "e.txt")
+    assert _committed_rows(cached_client) == 5
+    cached_client.stat_object("bucket", "f.txt")
+    cached_client.flush()
+    assert _committed_rows(cached_client) == 6
+
+
+def test_remove_pending_row(mock_minio):
+    cached_client = PersistentCachedMinio(mock_minio, db_path=":memory:", ttl=60,
+                                          write_flush_interval=60)
+    cached_client.stat_object("bucket", "a.txt")
+    cached_client.remove_object("bucket", "a.txt")
+    cached_client.flush()
+    assert cached_client._get_row("bucket", "a.txt") is None
+
+
+def test_listing_populates_cache_without_stat(cached_client, mock_minio):
+    objs = list(cached_client.list_objects("bucket"))
+    assert [o.key for o in objs] == ["file1.txt", "file2.txt"]
+    mock_minio.stat_object.assert_not_called()
+    # and the listing is enough to answer a later stat
+    result = cached_client.stat_object("bucket", "file2.txt")
+    assert result.source == "cache"
+    assert result.obj.size == 20
+    mock_minio.stat_object.assert_not_called()
+
+
+def test_listing_user_metadata():
+    fake = FakeMinio()
+    fake.add("a.nc", metadata={"X-Amz-Meta-Experiment": "abc"})
+    fake.add("b.nc")
+    fake.add("sub/c.nc")
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60)
+    objs = list(cached_client.list_objects("bucket", include_user_meta=True))
+    assert [o.key for o in objs] == ["a.nc", "b.nc", "sub/"]
+    assert objs[0].metadata == {"x-amz-meta-experiment": "abc"}
+    assert objs[2].cached is False
+    # only the object the listing had no metadata for was stat'ed
+    assert fake.calls["stat_object"] == 1
+
+
+def test_listing_tags_are_cached():
+    fake = FakeMinio()
+    fake.add("a.nc", metadata={"X-Amz-Meta-Experiment": "abc"}, tags={"project": "x"})
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60)
+    # a listing without user metadata has no tags, but one with them fills them in
+    list(cached_client.list_objects("bucket"))
+    objs = list(cached_client.list_objects("bucket", include_user_meta=True,
+                                           cache_mode=CacheMode.FORCE_REFRESH))
+    assert objs[0].tags == {"project": "x"}
+    fake.calls.clear()
+    assert cached_client.get_object_tags("bucket", "a.nc").tags == {"project": "x"}
+    assert not fake.calls
+
+
+def _expire(cached_client):
+    cached_client.flush()
+    cached_client._conn.execute("UPDATE objects SET cached_at = cached_at - 3600")
+    cached_client._conn.execute("UPDATE listings SET listed_at = listed_at - 3600")
+    cached_client._memory.clear()
+    cached_client._conn.commit()
+
+
+def test_bucket_list_follows_ttl_and_mode():
+    fake = FakeMinio()
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60)
+    assert [b.name for b in cached_client.list_buckets()] == ["bucket"]
+    fake.make_bucket("other")
+    assert [b.name for b in cached_client.list_buckets()] == ["bucket"]
+    assert fake.calls["list_buckets"] == 1
+    assert [b.name for b in cached_client.list_buckets(cache_mode=CacheMode.FORCE_REFRESH)] == ["bucket", "other"]
+    fake.buckets.discard("other")
+    cached_client._conn.execute("UPDATE cache_info SET value = value - 3600 WHERE name='buckets_listed_at'")
+    cached_client._conn.commit()
+    assert [b.name for b in cached_client.list_buckets(cache_mode=CacheMode.CACHE_ONLY)] == ["bucket", "other"]
+    assert [b.name for b in cached_client.list_buckets()] == ["bucket"]
+    assert fake.calls["list_buckets"] == 3
+
+
+def test_stale_stat_is_revalidated():
+    fake = FakeMinio()
+    fake.add("a.nc", metadata={"X-Amz-Meta-Experiment": "abc"})
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60)
+    cached_client.stat_object("bucket", "a.nc")
+    _expire(cached_client)
+    result = cached_client.stat_object("bucket", "a.nc")
+    assert result.source == "revalidated"
+    assert result.stale is False
+    assert result.metadata == {"x-amz-meta-experiment": "abc"}
+    assert cached_client.stat_object("bucket", "a.nc").source == "cache"
+    assert fake.calls["stat_object"] == 2
+    # a changed object is refetched
+    _expire(cached_client)
+    fake.add("a.nc", etag="changed")
+    result = cached_client.stat_object("bucket", "a.nc")
+    assert result.source == "s3"
+    assert result.obj.etag == "changed"
+
+
+def test_stale_listing_is_revalidated(mock_minio):
+    cached_client = PersistentCachedMinio(mock_minio, db_path=":memory:", ttl=60)
+    list(cached_client.list_objects("bucket"))
+    cached_client.set_object_tags("bucket", "file1.txt", {"tag1": "value"})
+    _expire(cached_client)
+    objs = list(cached_client.list_objects("bucket"))
+    assert [o.source for o in objs] == ["revalidated", "revalidated"]
+    assert objs[0].tags == {"tag1": "value"}
+    mock_minio.stat_object.assert_not_called()
+    mock_minio.get_object_tags.assert_not_called()
+
+
+def test_complete_listing_served_from_cache():
+    fake = FakeMinio(["a.nc", "sub/b.nc", "sub/deeper/c.nc"])
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60)
+    first = [o.key for o in cached_client.list_objects("bucket", recursive=True)]
+    assert fake.calls["list_objects"] > 0
+    fake.calls.clear()
+    assert [o.key for o in cached_client.list_objects("bucket", recursive=True)] == first
+    # a recursive listing also covers delimited listings below it
+    assert [o.key for o in cached_client.list_objects("bucket", prefix="sub/")] == [
+        "sub/b.nc", "sub/deeper/"]
+    assert fake.calls["list_objects"] == 0
+    # until we change something there
+    cached_client.remove_object("bucket", "sub/b.nc")
+    assert [o.key for o in cached_client.list_objects("bucket", prefix="sub/")] == ["sub/deeper/"]
+    assert fake.calls["list_objects"] == 1
+
+
+def test_complete_listing_purges_removed_keys():
+    fake = FakeMinio(["a.nc", "b.nc"])
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60)
+    list(cached_client.list_objects("bucket"))
+    del fake.objects["b.nc"]
+    list(cached_client.list_objects("bucket", cache_mode=CacheMode.FORCE_REFRESH))
+    assert cached_client._get_row("bucket", "b.nc") is None
+    assert [o.key for o in cached_client.list_objects("bucket")] == ["a.nc"]
+
+
+def test_prefix_queries_are_literal():
+    fake = FakeMinio(["a_b.nc", "axb.nc", "a%.nc"])
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60)
+    list(cached_client.list_objects("bucket"))
+    keys = [o.key for o in cached_client.list_objects("bucket", prefix="a_",
+                                                      cache_mode=CacheMode.CACHE_ONLY)]
+    assert keys == ["a_b.nc"]
+
+
+def test_children_and_du():
+    fake = FakeMinio()
+    fake.add("top.nc", size=1)
+    fake.add("x/a.nc", size=10)
+    fake.add("x/y/b.nc", size=100)
+    fake.add("x/y/c.nc", size=1000)
+    fake.add("z/d.nc", size=5)
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60)
+    list(cached_client.list_objects("bucket", recursive=True))
+    assert [o.key for o in cached_client.list_children("bucket")] == ["top.nc", "x/", "z/"]
+    assert [o.key for o in cached_client.list_children("bucket", "x/")] == ["x/a.nc", "x/y/"]
+    assert cached_client.du("bucket") == (5, 1116)
+    assert cached_client.du("bucket", "x/") == (3, 1110)
+    assert cached_client.du("bucket", by_child=True) == {
+        "": (1, 1), "x/": (3, 1110), "z/": (1, 5)}
+    # rollups follow changes
+    fake.add("x/y/c.nc", size=2000, etag="changed")
+    cached_client.stat_object("bucket", "x/y/c.nc", cache_mode=CacheMode.FORCE_REFRESH)
+    cached_client.remove_object("bucket", "x/a.nc")
+    assert cached_client.du("bucket", "x/") == (2, 2100)
+    assert cached_client.du("bucket", "x/y/") == (2, 2100)
+    assert [o.key for o in cached_client.list_children("bucket", "x/")] == ["x/y/"]
+
+
+def test_upgrade_old_cache(tmp_path):
+    db = tmp_path / "old.db"
+    conn = sqlite3.connect(db)
+    conn.execute("""CREATE TABLE objects (bucket TEXT NOT NULL, key TEXT NOT NULL, etag TEXT,
+                    size INTEGER, last_modified TEXT, metadata TEXT, tags TEXT, cached_at REAL,
+                    PRIMARY KEY (bucket, key))""")
+    conn.execute("INSERT INTO objects VALUES ('bucket', 'x/a.nc', 'e', 10, NULL, NULL, NULL, ?)",
+                 (time.time(),))
+    conn.commit()
+    conn.close()
+    cached_client = PersistentCachedMinio(MagicMock(), db_path=str(db), ttl=60)
+    assert cached_client._get_row("bucket", "x/a.nc")["parent"] == "x/"
+    assert cached_client.cache_size()["bytes"] == 256 + len("x/a.nc")
+    assert cached_client.du("bucket", "x/") == (1, 10)
+
+
+def test_memory_tier(cached_client, mock_minio):
+    cached_client.stat_object("bucket", "test.txt")
+    cached_client.stat_object("bucket", "test.txt")
+    # now held decoded in memory, so we don't need the database at all
+    cached_client._get_row = MagicMock(side_effect=AssertionError("used the database"))
+    assert cached_client.stat_object("bucket", "test.txt").source == "cache"
+    del cached_client._get_row
+    # writes invalidate it
+    cached_client.set_object_tags("bucket", "test.txt", {"new": "tag"})
+    assert cached_client.stat_object("bucket", "test.txt").tags == {"new": "tag"}
+
+
+def test_memory_tier_bounds():
+    from cfs3.s3cache import _MemoryTier
+    tier = _MemoryTier(max_entries=2, max_bytes=100)
+    tier.put("a", "A", 10)
+    tier.put("b", "B", 10)
+    tier.get("a")
+    tier.put("c", "C", 10)
+    assert tier.get("b") is None and tier.get("a") == "A"
+    tier.put("d", "D", 85)
+    assert len(tier) == 2 and tier.get("c") is None and tier.get("d") == "D"
+    tier.put("e", "E", 101)
+    assert tier.get("e") is None
+
+
+def test_concurrent_readers_and_writer(tmp_path):
+    keys = [f"k{i:03d}.nc" for i in range(200)]
+    fake = FakeMinio(keys)
+    cached_client = PersistentCachedMinio(fake, db_path=str(tmp_path / "cache.db"), ttl=60,
+                                          memory_entries=0, write_batch_size=50)
+    # writes from many threads all go through the one writer
+    results = map_concurrently(lambda k: cached_client.stat_object("bucket", k).source, keys, 16)
+    assert [r for _, r in results] == ["s3"] * len(keys)
+    cached_client.flush()
+    assert _committed_rows(cached_client) == len(keys)
+    # and reads use pooled connections of their own
+    results = map_concurrently(lambda k: cached_client.stat_object("bucket", k).source, keys, 16)
+    assert [r for _, r in results] == ["cache"] * len(keys)
+    assert fake.calls["stat_object"] == len(keys)
+    assert 0 < len(cached_client._idle_readers) <= 16
+    cached_client.close()
+
+
+def test_metadata_index_is_accounted(tmp_path):
+    fake = FakeMinio()
+    for i in range(200):
+        fake.add(f"k{i:03d}.nc", metadata={"X-Amz-Meta-Experiment": "historical",
+                                          "X-Amz-Meta-Realms": "json_%5B%22atmos%22%2C%20%22land%22%5D"})
+    cached_client = PersistentCachedMinio(fake, db_path=str(tmp_path / "cache.db"), ttl=60)
+    cached_client.warm("bucket")
+    cached_client.flush()
+    index_text = cached_client._query_one(
+        "SELECT SUM(length(bucket) + length(key) + length(name) + length(value)) FROM meta_index")[0]
+    rows_text = cached_client._query_one(
+        "SELECT SUM(256 + length(key) + length(metadata)) FROM objects")[0]
+    # the index entries are stored twice, in the table and in its value index
+    assert cached_client.cache_size()["bytes"] >= rows_text + 2 * index_text
+    cached_client.close()
+    # so they count towards the limit
+    limited = PersistentCachedMinio(fake, db_path=str(tmp_path / "limited.db"), ttl=60,
+                                    max_db_size_mb=0.1)
+    limited.warm("bucket")
+    limited.flush()
+    assert limited.evictions > 0
+    assert limited.cache_size()["bytes"] <= 0.1 * 1024 * 1024
+    assert limited.cache_size()["bytes"] == limited._query_one("SELECT SUM(row_bytes) FROM objects")[0]
+    limited.close()
+
+
+@pytest.mark.parametrize("eviction", ["lru", "lfu"])
+def test_eviction_keeps_used_rows(tmp_path, eviction):
+    keys = [f"k{i:03d}.nc" for i in range(100)]
+    fake = FakeMinio(keys)
+    cached_client = PersistentCachedMinio(fake, db_path=str(tmp_path / "cache.db"), ttl=60,
+                                          max_db_size_mb=0.01, eviction=eviction,
+                                          memory_entries=0, write_batch_size=10)
+    for key in keys:
+        cached_client.stat_object("bucket", key)
+        # keep using the first few
+        for used in keys[:5]:
+            cached_client.stat_object("bucket", used)
+    cached_client.flush()
+    size = cached_client.cache_size()
+    assert cached_client.evictions > 0
+    assert size["bytes"] <= 0.01 * 1024 * 1024
+    assert size["bytes"] == cached_client._query_one("SELECT SUM(row_bytes) FROM objects")[0]
+    # the rows we kept using survived
+    for key in keys[:5]:
+        assert cached_client._get_row("bucket", key) is not None
+    assert cached_client._query_one("PRAGMA auto_vacuum")[0] == 2
+    assert cached_client.cache_stats()["bucket"]["evict"]["count"] == cached_client.evictions
+    cached_client.close()
+
+
+def test_unknown_eviction_policy():
+    with pytest.raises(ValueError):
+        PersistentCachedMinio(MagicMock(), db_path=":memory:", eviction="random")
+
+
+def test_missing_objects_are_remembered():
+    fake = FakeMinio(["a.nc"])
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60, negative_ttl=30)
+    for _ in range(3):
+        with pytest.raises(S3Error) as e:
+            cached_client.stat_object("bucket", "b.nc")
+        assert e.value.code == "NoSuchKey"
+    assert fake.calls["stat_object"] == 1
+    # FORCE_REFRESH still asks
+    with pytest.raises(S3Error):
+        cached_client.stat_object("bucket", "b.nc", cache_mode=CacheMode.FORCE_REFRESH)
+    assert fake.calls["stat_object"] == 2
+    # and seeing the object forgets the miss
+    fake.add("b.nc")
+    list(cached_client.list_objects("bucket"))
+    assert cached_client.stat_object("bucket", "b.nc").source == "cache"
+
+
+def test_missing_expires_and_is_invalidated_by_writes(mock_minio):
+    missing = S3Error(None, "NoSuchKey", "Object does not exist", "/bucket/new.nc",
+                      None, None, "bucket", "new.nc")
+    mock_minio.stat_object.side_effect = missing
+    cached_client = PersistentCachedMinio(mock_minio, db_path=":memory:", ttl=60, negative_ttl=30)
+    with pytest.raises(S3Error):
+        cached_client.stat_object("bucket", "new.nc")
+    cached_client.copy_object("bucket", "new.nc", MagicMock())
+    mock_minio.stat_object.side_effect = None
+    assert cached_client.stat_object("bucket", "new.nc").source == "s3"
+    assert mock_minio.stat_object.call_count == 2
+    # a removed object drops out of the cache too
+    mock_minio.stat_object.side_effect = missing
+    with pytest.raises(S3Error):
+        cached_client.stat_object("bucket", "new.nc", cache_mode=CacheMode.FORCE_REFRESH)
+    assert cached_client._get_row("bucket", "new.nc") is None
+    cached_client._conn.execute("UPDATE missing SET missed_at = missed_at - 60")
+    with pytest.raises(S3Error):
+        cached_client.stat_object("bucket", "new.nc")
+    assert mock_minio.stat_object.call_count == 4
+
+
+def _wait_for_refreshes(cached_client, timeout=5):
+    deadline = time.time() + timeout
+    while cached_client._refreshing and time.time() < deadline:
+        time.sleep(0.01)
+    assert not cached_client._refreshing
+
+
+def test_stale_while_revalidate():
+    fake = FakeMinio(["a.nc"])
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60)
+    swr = CacheMode.STALE_WHILE_REVALIDATE
+    cached_client.stat_object("bucket", "a.nc")
+    _expire(cached_client)
+    fake.add("a.nc", etag="changed")
+    release = threading.Event()
+    stat_object = fake.stat_object
+
+    def slow_stat(*args, **kwargs):
+        release.wait(5)
+        return stat_object(*args, **kwargs)
+
+    fake.stat_object = slow_stat
+    # the stale entry comes straight back, and only one refresh is made
+    for _ in range(3):
+        result = cached_client.stat_object("bucket", "a.nc", cache_mode=swr)
+        assert result.stale is True
+        assert result.obj.etag == "etag-a.nc"
+    assert len(cached_client._refreshing) == 1
+    release.set()
+    _wait_for_refreshes(cached_client)
+    assert fake.calls["stat_object"] == 2
+    result = cached_client.stat_object("bucket", "a.nc", cache_mode=swr)
+    assert result.stale is False
+    assert result.obj.etag == "changed"
+
+
+def test_stale_while_revalidate_listing():
+    fake = FakeMinio(["a.nc"])
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60)
+    swr = CacheMode.STALE_WHILE_REVALIDATE
+    list(cached_client.list_objects("bucket"))
+    _expire(cached_client)
+    fake.add("b.nc")
+    assert [o.key for o in cached_client.list_objects("bucket", cache_mode=swr)] == ["a.nc"]
+    _wait_for_refreshes(cached_client)
+    assert [o.key for o in cached_client.list_objects("bucket", cache_mode=swr)] == ["a.nc", "b.nc"]
+
+
+def test_warm():
+    fake = FakeMinio()
+    for i in range(5):
+        fake.add(f"d{i % 2}/f{i}.nc", metadata={"X-Amz-Meta-N": str(i)},
+                 tags={"run": "x"} if i == 0 else None)
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60, write_batch_size=2)
+    seen = []
+    summary = cached_client.warm("bucket", with_tags=True, concurrency=3,
+                                 progress=lambda *args: seen.append(args))
+    assert summary == {"objects": 5, "metadata": 5, "tags": 5, "errors": 0}
+    assert seen[-1] == ("tags", 5, 5)
+    assert ("metadata", 2, 5) in seen
+    # everything is now answered from the cache
+    fake.calls.clear()
+    co = cached_client.stat_object("bucket", "d0/f0.nc")
+    assert co.metadata == {"x-amz-meta-n": "0"}
+    assert cached_client.get_object_tags("bucket", "d0/f0.nc").tags == {"run": "x"}
+    assert [o.key for o in cached_client.list_objects("bucket", "d1/")] == ["d1/f1.nc", "d1/f3.nc"]
+    assert not fake.calls
+    # and warming again only asks for what changed
+    fake.add("d0/f0.nc", etag="changed")
+    summary = cached_client.warm("bucket")
+    assert summary == {"objects": 5, "metadata": 1, "tags": 0, "errors": 0}
+
+
+def test_snapshot_export_and_mount(tmp_path):
+    fake = FakeMinio(["a/1.nc", "a/2.nc", "a/sub/3.nc", "b/4.nc"])
+    builder = PersistentCachedMinio(fake, db_path=str(tmp_path / "builder.db"), ttl=3600)
+    list(builder.list_objects("bucket", recursive=True))
+    info = builder.export_snapshot(str(tmp_path / "a.snap"), "bucket", "a/")
+    builder.close()
+    assert info["rows"] == 3
+    assert snapshot_info(str(tmp_path / "a.snap")) == info
+
+    fake.calls.clear()
+    node = PersistentCachedMinio(fake, db_path=str(tmp_path / "node.db"), ttl=3600,
+                                 snapshots=[str(tmp_path / "a.snap")])
+    # answered from the snapshot, listings included
+    assert node.stat_object("bucket", "a/1.nc").source == "cache"
+    assert [o.key for o in node.list_objects("bucket", "a/")] == ["a/1.nc", "a/2.nc", "a/sub/"]
+    assert node.du("bucket", "a/", by_child=True) == {"a/": (2, 20), "a/sub/": (1, 10)}
+    assert not fake.calls
+    # local changes sit on top of the snapshot
+    fake.add("a/1.nc", size=99, etag="new")
+    assert node.stat_object("bucket", "a/1.nc", cache_mode=CacheMode.FORCE_REFRESH).obj.size == 99
+    node.remove_object("bucket", "a/2.nc")
+    node.flush()
+    assert node.stat_object("bucket", "a/1.nc").obj.size == 99
+    assert node.stat_object("bucket", "a/2.nc", cache_mode=CacheMode.CACHE_ONLY).source == "none"
+    assert [o.key for o in node.list_objects("bucket", "a/", recursive=True,
+                                             cache_mode=CacheMode.CACHE_ONLY)] == ["a/1.nc", "a/sub/3.nc"]
+    node.close()
+
+    # and an import copies it all in
+    other = PersistentCachedMinio(fake, db_path=":memory:", ttl=3600)
+    assert other.import_snapshot(str(tmp_path / "a.snap")) == 3
+    assert other.cache_size()["rows"] == 3
+    fake.calls.clear()
+    assert [o.key for o in other.list_objects("bucket", "a/", recursive=True)] == ["a/1.nc", "a/2.nc", "a/sub/3.nc"]
+    assert not fake.calls
+
+
+def test_snapshot_version_is_checked(tmp_path):
+    path = str(tmp_path / "not.snap")
+    sqlite3.connect(path).execute("CREATE TABLE x (y)").connection.close()
+    with pytest.raises(ValueError):
+        snapshot_info(path)
+
+
+def test_sync():
+    fake = FakeMinio([f"d/{i:03d}.nc" for i in range(30)])
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60, write_batch_size=7)
+    list(cached_client.list_objects("bucket", "d/", recursive=True))
+    _expire(cached_client)
+    del fake.objects["d/000.nc"]
+    del fake.objects["d/017.nc"]
+    del fake.objects["d/029.nc"]
+    fake.add("d/005.nc", size=50, etag="changed", metadata={"X-Amz-Meta-A": "1"})
+    fake.add("d/0055.nc", metadata={"X-Amz-Meta-A": "2"})
+    fake.calls.clear()
+    summary = cached_client.sync("bucket", "d/", with_metadata=True)
+    assert summary == {"listed": 28, "inserted": 1, "updated": 1, "deleted": 3,
+                       "unchanged": 26, "metadata": 2, "errors": 0}
+    # one listing and a HEAD for each new or changed object
+    assert fake.calls["stat_object"] == 2
+    assert cached_client.cache_size()["rows"] == 28
+    fake.calls.clear()
+    objs = list(cached_client.list_objects("bucket", "d/", recursive=True))
+    assert [o.key for o in objs] == sorted(fake.objects)
+    assert all(not o.stale for o in objs)
+    assert cached_client.stat_object("bucket", "d/005.nc").metadata == {"x-amz-meta-a": "1"}
+    assert not fake.calls
+
+
+def test_cached_objects_stand_in_for_objects():
+    fake = FakeMinio(["a.nc", "sub/b.nc"])
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60)
+    objs = list(cached_client.list_objects("bucket"))
+    assert [(o.object_name, o.is_dir, o.size) for o in objs] == [("a.nc", False, 10), ("sub/", True, None)]
+    with pytest.raises(AttributeError):
+        cached_client.stat_object("bucket", "nope.nc", cache_mode=CacheMode.CACHE_ONLY).size
+
+
+def test_default_mode_and_user_metadata():
+    fake = FakeMinio()
+    fake.add("a.nc", metadata={"X-Amz-Meta-A": "1"})
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60,
+                                          mode=CacheMode.CACHE_ONLY)
+    assert list(cached_client.list_objects("bucket")) == []
+    cached_client.mode = CacheMode.DEFAULT
+    list(cached_client.list_objects("bucket"))
+    assert cached_client.stat_object("bucket", "a.nc").metadata is None
+    # the listing didn't give us the user metadata, so this has to ask
+    co = cached_client.stat_object("bucket", "a.nc", include_user_meta=True)
+    assert co.metadata == {"x-amz-meta-a": "1"}
+    assert fake.calls["stat_object"] == 1
+    cached_client.stat_object("bucket", "a.nc", include_user_meta=True)
+    assert fake.calls["stat_object"] == 1
+
+
+def test_uploads_write_through(tmp_path):
+    fake = FakeMinio(["a.nc"])
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60)
+    list(cached_client.list_objects("bucket"))
+    path = tmp_path / "b.nc"
+    path.write_bytes(b"12345")
+    cached_client.fput_object("bucket", "b.nc", str(path), metadata={"experiment": "x"})
+    fake.calls.clear()
+    co = cached_client.stat_object("bucket", "b.nc", include_user_meta=True)
+    assert co.size == 5
+    assert co.etag == fake.objects["b.nc"]["etag"]
+    assert co.metadata == {"content-type": "application/octet-stream", "x-amz-meta-experiment": "x"}
+    # the listing we had no longer holds, so it is listed again, but nothing is HEADed
+    assert [o.key for o in cached_client.list_objects("bucket")] == ["a.nc", "b.nc"]
+    assert fake.calls == {"list_objects": 1}
+
+
+def test_metadata_search():
+    fake = FakeMinio()
+    fake.add("hist/a.nc", metadata={"X-Amz-Meta-Standard_name": "air_temperature",
+                                    "X-Amz-Meta-Experiment": "historical"})
+    fake.add("hist/b.nc", metadata={"X-Amz-Meta-Standard_name": "precipitation_flux",
+                                    "X-Amz-Meta-Experiment": "historical",
+                                    "X-Amz-Meta-Realms": "json_%5B%22atmos%22%2C%20%22land%22%5D"})
+    fake.add("ssp/c.nc", metadata={"X-Amz-Meta-Standard_name": "air_temperature",
+                                   "X-Amz-Meta-Experiment": "ssp585"})
+    fake.add("ssp/d.nc")
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60)
+    # only what we have metadata for is indexed
+    list(cached_client.list_objects("bucket", recursive=True))
+    assert cached_client.search("bucket", {"standard_name": "air_temperature"}) == []
+    cached_client.warm("bucket")
+    fake.calls.clear()
+
+    def keys(*args, **kwargs):
+        return [o.key for o in cached_client.search("bucket", *args, **kwargs)]
+
+    assert keys({"standard_name": "air_temperature"}) == ["hist/a.nc", "ssp/c.nc"]
+    assert keys({"standard_name": "air_temperature", "experiment": "hist*"}) == ["hist/a.nc"]
+    assert keys({"standard_name": "air_temperature"}, prefix="ssp/") == ["ssp/c.nc"]
+    assert keys({"realms": "land"}) == ["hist/b.nc"]
+    assert keys(text="PRECIP") == ["hist/b.nc"]
+    # character classes are fnmatch's, as in metadata_matches (and so s3view's match)
+    assert keys({"experiment": "[!h]*"}) == ["ssp/c.nc"]
+    assert keys({"experiment": "[^h]*"}) == ["hist/a.nc", "hist/b.nc"]
+    assert keys({"experiment": "[hs]*"}, limit=2) == ["hist/a.nc", "hist/b.nc"]
+    for experiment in ("[!h]*", "[^h]*", "hist[!o]*"):
+        assert keys({"experiment": experiment}) == [
+            key for key in ("hist/a.nc", "hist/b.nc", "ssp/c.nc")
+            if metadata_matches(fake.objects[key]["metadata"], {"experiment": experiment})]
+    assert keys(text="ssp_") == []
+    assert fake.calls == {}
+    with pytest.raises(ValueError):
+        cached_client.search("bucket")
+
+    # the index follows changes and deletions
+    fake.add("ssp/c.nc", etag="new", metadata={"X-Amz-Meta-Standard_name": "precipitation_flux"})
+    cached_client.sync("bucket", with_metadata=True)
+    assert keys({"standard_name": "air_temperature"}) == ["hist/a.nc"]
+    cached_client.remove_object("bucket", "hist/b.nc")
+    assert keys({"standard_name": "precipitation_flux"}) == ["ssp/c.nc"]
+
+
+def test_search_includes_snapshot_rows(tmp_path):
+    fake = FakeMinio()
+    fake.add("a.nc", metadata={"X-Amz-Meta-Experiment": "historical"})
+    fake.add("b.nc", metadata={"X-Amz-Meta-Experiment": "historical"})
+    builder = PersistentCachedMinio(fake, db_path=str(tmp_path / "builder.db"), ttl=3600)
+    builder.warm("bucket")
+    builder.export_snapshot(str(tmp_path / "a.snap"), "bucket")
+    builder.close()
+    node = PersistentCachedMinio(fake, db_path=":memory:", ttl=3600, snapshots=[str(tmp_path / "a.snap")])
+    fake.add("c.nc", metadata={"X-Amz-Meta-Experiment": "historical-ext"})
+    node.stat_object("bucket", "c.nc", include_user_meta=True)
+    fake.add("a.nc", etag="new", metadata={"X-Amz-Meta-Experiment": "ssp585"})
+    node.stat_object("bucket", "a.nc", include_user_meta=True, cache_mode=CacheMode.FORCE_REFRESH)
+    fake.calls.clear()
+    # rows only in the snapshot are found, unless overridden locally
+    assert [o.key for o in node.search("bucket", {"experiment": "hist*"})] == ["b.nc", "c.nc"]
+    assert [o.key for o in node.search("bucket", text="SSP")] == ["a.nc"]
+    assert [o.key for o in node.search("bucket", {"experiment": "hist*"}, limit=1)] == ["b.nc"]
+    assert not fake.calls
+
+
+def test_metadata_matches_agrees_with_search():
+    metadata = {"X-Amz-Meta-Experiment": "historical",
+                "x-amz-meta-realms": "json_%5B%22atmos%22%2C%20%22land%22%5D"}
+    assert metadata_matches(metadata, {"experiment": "hist*", "realms": "land"})
+    assert metadata_matches(metadata, {"Experiment": "historical"}, text="ATMOS")
+    assert not metadata_matches(metadata, {"experiment": "hist"})
+    assert not metadata_matches(metadata, {"realms": "ocean"})
+    assert not metadata_matches(None, {"experiment": "*"})
+
+
+def test_cache_stats():
+    fake = FakeMinio(["a.nc", "b.nc"])
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60)
+    list(cached_client.list_objects("bucket"))
+    list(cached_client.list_objects("bucket"))
+    cached_client.stat_object("bucket", "a.nc")
+    _expire(cached_client)
+    # the etag is unchanged, so this is a conditional HEAD answered with a 304
+    cached_client.stat_object("bucket", "a.nc")
+    for _ in range(2):
+        with pytest.raises(S3Error):
+            cached_client.stat_object("bucket", "c.nc")
+    cached_client.stat_object("bucket", "c.nc", cache_mode=CacheMode.CACHE_ONLY)
+    stats = cached_client.cache_stats(reset=True)["bucket"]
+    assert (stats["list_objects"]["miss"], stats["list_objects"]["hit"]) == (1, 1)
+    stat = stats["stat_object"]
+    assert (stat["hit"], stat["revalidated"], stat["miss"], stat["negative"], stat["none"]) == (1, 1, 1, 1, 1)
+    assert stat["count"] == 5
+    assert stat["hit_ratio"] == pytest.approx(0.4)
+    assert cached_client.cache_stats() == {}
+
+
+def test_alias_caches(tmp_path):
+    fakes = {"one": FakeMinio(["a.nc"]), "two": FakeMinio(["b.nc"])}
+    caches = AliasCaches(str(tmp_path), ttl=60)
+    assert caches.aliases() == []
+    # same bucket name, different servers
+    for alias, fake in fakes.items():
+        list(caches.get(alias, fake).list_objects("bucket"))
+    assert caches.aliases() == ["one", "two"]
+    assert caches.get("one", fakes["one"]) is caches.get("one", fakes["one"])
+    # a rebuilt client replaces the one the cache was opened with
+    rebuilt = FakeMinio(["a.nc"])
+    assert caches.get("one", rebuilt)._client is rebuilt
+    assert caches.get("one", fakes["one"])._client is fakes["one"]
+    assert caches.path("two") == str(tmp_path / "two.db")
+    fakes["one"].calls.clear()
+    assert [o.key for o in caches.get("one", fakes["one"]).list_objects("bucket")] == ["a.nc"]
+    assert [o.key for o in caches.get("two", fakes["two"]).list_objects("bucket")] == ["b.nc"]
+    assert not fakes["one"].calls
+    # dropping one tenancy leaves the other alone
+    caches.drop("two")
+    assert not (tmp_path / "two.db").exists()
+    assert caches.aliases() == ["one"]
+    assert caches.get("two", fakes["two"]).cache_size()["rows"] == 0
+    caches.close()
+    with AliasCaches(str(tmp_path)) as caches:
+        assert caches.get("one", fakes["one"]).cache_size()["rows"] == 1
+
+
+def test_cache_for_another_endpoint_is_cleared(tmp_path):
+    path = str(tmp_path / "cache.db")
+    with PersistentCachedMinio(FakeMinio(["a.nc"]), db_path=path, endpoint="https://one") as cached_client:
+        list(cached_client.list_objects("bucket"))
+    with PersistentCachedMinio(FakeMinio(), db_path=path, endpoint="https://one") as cached_client:
+        assert cached_client.cache_size()["rows"] == 1
+    with PersistentCachedMinio(FakeMinio(), db_path=path, endpoint="https://two") as cached_client:
+        assert cached_client.cache_size()["rows"] == 0
+        assert list(cached_client.list_objects("bucket", cache_mode=CacheMode.CACHE_ONLY)) == []
+
+
+def test_alias_cache_survives_endpoint_selection(tmp_path, mocker):
+    config = tmp_path / "config.json"
+
+    def configure(*urls):
+        config.write_text(json.dumps({"aliases": {"tenancy": {
+            "url": urls[0], "urls": list(urls[1:]), "accessKey": "a", "secretKey": "b", "api": "S3v4"}}}))
+
+    configure("https://outside", "https://inside")
+    select = mocker.patch.object(s3core.endpoint_selector, "select",
+                                 side_effect=["https://inside", "https://outside"])
+    caches = AliasCaches(str(tmp_path), config_file=str(config))
+    list(caches.get("tenancy", FakeMinio(["a.nc"])).list_objects("bucket"))
+    for url in ["https://inside", "https://outside"]:
+        # whichever of the alias' URLs is picked, it is the same server
+        assert s3core.get_user_config("tenancy", str(config))["url"] == url
+        caches.close()
+        assert caches.get("tenancy", FakeMinio()).cache_size()["rows"] == 1
+    assert select.call_count == 2
+    # but moving the alias somewhere else clears it, even while it is open
+    cache = caches.get("tenancy", FakeMinio())
+    configure("https://elsewhere", "https://inside")
+    assert caches.get("tenancy", FakeMinio()) is not cache
+    assert caches.get("tenancy", FakeMinio()).cache_size()["rows"] == 0
+    caches.close()
+
+
+def test_buffered_writes_are_flushed_while_idle(tmp_path):
+    path = str(tmp_path / "cache.db")
+    fake = FakeMinio(["a.nc"])
+    cached_client = PersistentCachedMinio(fake, db_path=path, ttl=60, write_batch_size=1000,
+                                          write_flush_interval=0.05)
+    cached_client.stat_object("bucket", "a.nc")
+    # nothing else happens, but another process still gets to see it
+    deadline = time.time() + 5
+    other = sqlite3.connect(path)
+    while not other.execute("SELECT COUNT(*) FROM objects").fetchone()[0]:
+        assert time.time() < deadline
+        time.sleep(0.01)
+    other.close()
+    cached_client.close()
+
+
+def test_recorded_accesses_count_towards_a_batch():
+    keys = [f"k{i}.nc" for i in range(20)]
+    cached_client = PersistentCachedMinio(FakeMinio(keys), db_path=":memory:", ttl=60,
+                                          write_batch_size=10, write_flush_interval=3600)
+    list(cached_client.list_objects("bucket"))
+    cached_client.flush()
+    for co in cached_client.list_objects("bucket"):
+        assert len(cached_client._accessed) < 10
+
+
+def test_revalidation_only_writes_cached_at(tmp_path):
+    fake = FakeMinio(["a.nc"])
+    path = str(tmp_path / "cache.db")
+    cached_client = PersistentCachedMinio(fake, db_path=path, ttl=60, write_flush_interval=3600)
+    cached_client.stat_object("bucket", "a.nc")
+    _expire(cached_client)
+    statements = []
+    cached_client._conn.set_trace_callback(statements.append)
+    co = cached_client.stat_object("bucket", "a.nc")
+    assert co.source == "revalidated"
+    # not written yet, but already fresh
+    assert cached_client.stat_object("bucket", "a.nc").source == "cache"
+    assert fake.calls["stat_object"] == 2
+    cached_client.flush()
+    writes = [s.strip() for s in statements if s.split()[0] in ("INSERT", "UPDATE", "DELETE")]
+    # the cached_at, and the access bumps, and nothing else
+    assert [s.split("=")[0] for s in writes] == ["UPDATE objects SET cached_at",
+                                                 "UPDATE objects SET last_access"]
+    assert not cached_client._is_row_stale(cached_client._get_row("bucket", "a.nc"))
+    cached_client.close()
+
+
+def test_complete_listing_still_gives_user_metadata():
+    fake = FakeMinio()
+    fake.add("x/a.nc", metadata={"X-Amz-Meta-Experiment": "historical"})
+    fake.add("x/b.nc", metadata={"X-Amz-Meta-Experiment": "ssp585"})
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60)
+    list(cached_client.list_objects("bucket", prefix="x/", recursive=True))
+    fake.calls.clear()
+    for recursive in (False, True):
+        entries = list(cached_client.list_objects("bucket", prefix="x/", recursive=recursive,
+                                                  include_user_meta=True))
+        assert [co.metadata["x-amz-meta-experiment"] for co in entries] == ["historical", "ssp585"]
+    # the rows lacking it were filled in by listing again, once
+    assert fake.calls == {"list_objects": 1}
+    stats = cached_client.cache_stats()["bucket"]["list_objects"]
+    assert (stats["miss"], stats["hit"]) == (2, 1)
+    # and when the listing isn't covered, fresh rows without it aren't taken as they are
+    cached_client = PersistentCachedMinio(fake, db_path=":memory:", ttl=60)
+    list(cached_client.list_objects("bucket", prefix="x/a"))
+    assert cached_client._get_row("bucket", "x/a.nc")["metadata"] is None
+    entries = list(cached_client.list_objects("bucket", prefix="x/", include_user_meta=True))
+    assert [co.metadata is not None for co in entries] == [True, True]
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+import time
+from minio.error import S3Error
+from cfs3.s3async import AsyncS3, map_concurrently, stat_objects
+from .utils.fake_minio import FakeMinio
+
+
+def test_stat_objects_returns_errors_in_place():
+    fake = FakeMinio(['a.nc', 'b.nc'])
+    results = stat_objects(fake, 'bucket', ['a.nc', 'missing.nc', 'b.nc'])
+    assert [k for k, _ in results] == ['a.nc', 'missing.nc', 'b.nc']
+    assert results[0][1].etag == 'etag-a.nc'
+    assert isinstance(results[1][1], S3Error)
+
+
+def test_map_concurrently_is_bounded():
+    lock = threading.Lock()
+    state = {'now': 0, 'max': 0}
+
+    def slow(i):
+        with lock:
+            state['now'] += 1
+            state['max'] = max(state['max'], state['now'])
+        time.sleep(0.01)
+        with lock:
+            state['now'] -= 1
+        return i * 2
+
+    results = map_concurrently(slow, range(40), concurrency=4)
+    assert [r for _, r in results] == [i * 2 for i in range(40)]
+    assert state['max'] <= 4
+
+
+def test_async_primitives_inside_running_loop():
+    fake = FakeMinio(['x/a.nc', 'x/b.nc'])
+
+    async def main():
+        async with AsyncS3(fake, concurrency=2) as s3:
+            listing = await s3.list('bucket', prefix='x/', recursive=True)
+            stat = await s3.stat('bucket', 'x/a.nc')
+            # sync wrappers still work when called with a loop running
+            wrapped = stat_objects(fake, 'bucket', ['x/b.nc'])
+        return listing, stat, wrapped
+
+    listing, stat, wrapped = asyncio.run(main())
+    assert [o.object_name for o in listing] == ['x/a.nc', 'x/b.nc']
+    assert stat.size == 10
+    assert wrapped[0][1].object_name == 'x/b.nc'
+
+
+def test_fan_outs_reuse_the_shared_executor_and_loop():
+    def where(i):
+        return threading.current_thread().name
+
+    map_concurrently(where, range(8))
+    threads = threading.active_count()
+    names = {n for _ in range(5) for _, n in map_concurrently(where, range(8))}
+    assert threading.active_count() == threads
+    assert all(n.startswith('cfs3-s3_') for n in names)
+    # a fan-out inside a fan-out doesn't wait on the workers it is holding
+    results = map_concurrently(lambda i: map_concurrently(lambda j: i * j, range(3)), range(64))
+    assert [[r for _, r in inner] for _, inner in results] == [[0, i, 2 * i] for i in range(64)]
@@ -0,0 +1,85 @@
+import json
+
+from cfs3 import s3core
+
+
+def test_get_client_is_shared(fake_mc_config):
+    """ The same client (and connection pool) is handed out for an alias """
+    s3core.client_registry.clear()
+    c1 = s3core.get_client("fake-alias")
+    c2 = s3core.get_client("fake-alias")
+    assert c1 is c2
+    assert c1.alias_name == "fake-alias"
+    assert c1._http.connection_pool_kw['maxsize'] == s3core.DEFAULT_POOL_SIZE
+    assert s3core.get_client("fake-alias", shared=False) is not c1
+
+
+def test_get_client_rebuilt_on_credential_change(fake_mc_config):
+    s3core.client_registry.clear()
+    c1 = s3core.get_client("fake-alias")
+    with open(fake_mc_config) as f:
+        cfg = json.load(f)
+    cfg['aliases']['fake-alias']['secretKey'] = 'changed'
+    with open(fake_mc_config, 'w') as f:
+        json.dump(cfg, f)
+    c2 = s3core.get_client("fake-alias")
+    assert c1 is not c2
+
+
+def test_config_parsed_once(fake_mc_config, mocker):
+    s3core.config_cache.clear()
+    spy = mocker.spy(s3core, '_parse_locations')
+    for _ in range(3):
+        assert 'fake-alias' in s3core.get_locations()
+        assert s3core.get_user_config('fake-alias')['api'] == 'S3v4'
+    assert spy.call_count == 1
+
+
+def test_config_reparsed_on_change(fake_mc_config):
+    s3core.config_cache.clear()
+    assert list(s3core.get_locations()) == ['fake-alias']
+    with open(fake_mc_config) as f:
+        cfg = json.load(f)
+    cfg['aliases']['another-alias'] = dict(cfg['aliases']['fake-alias'])
+    with open(fake_mc_config, 'w') as f:
+        json.dump(cfg, f)
+    assert 'another-alias' in s3core.get_locations()
+
+
+def test_fastest_endpoint_selected(fake_mc_config, mocker):
+    with open(fake_mc_config) as f:
+        cfg = json.load(f)
+    cfg['aliases']['fake-alias']['urls'] = ['http://outside:9000', 'http://inside:9000']
+    with open(fake_mc_config, 'w') as f:
+        json.dump(cfg, f)
+    s3core.endpoint_selector.clear()
+    rtts = {'http://localhost:9000': None, 'http://outside:9000': 0.2, 'http://inside:9000': 0.01}
+    probe = mocker.patch.object(s3core.endpoint_selector, '_measure', side_effect=rtts.get)
+    for _ in range(2):
+        assert s3core.get_user_config('fake-alias')['url'] == 'http://inside:9000'
+    # measurements are remembered
+    assert probe.call_count == 3
+    assert s3core.get_user_config('fake-alias', resolve=False)['url'] == 'http://localhost:9000'
+
+
+def test_endpoint_selection_is_sticky(mocker):
+    selector = s3core.EndpointSelector(ttl=600)
+    urls = ['http://outside:9000', 'http://inside:9000']
+    rtts = {'http://outside:9000': 0.020, 'http://inside:9000': 0.010}
+    mocker.patch.object(selector, '_measure', side_effect=lambda url: rtts[url])
+    assert selector.select(urls) == 'http://inside:9000'
+    # with everything measured lately there is nothing to probe, and no pool to build
+    pool = mocker.patch.object(s3core, 'ThreadPoolExecutor')
+    assert selector.select(urls) == 'http://inside:9000'
+    assert selector._measure.call_count == 2
+    pool.assert_not_called()
+    mocker.stop(pool)
+    # a small change in the measurements doesn't move us
+    rtts.update({'http://outside:9000': 0.009, 'http://inside:9000': 0.011})
+    selector.ttl = 0
+    assert selector.select(urls) == 'http://inside:9000'
+    # but a clear difference (or losing the endpoint) does
+    rtts['http://inside:9000'] = 0.050
+    assert selector.select(urls) == 'http://outside:9000'
+    rtts.update({'http://outside:9000': None, 'http://inside:9000': 0.050})
+    assert selector.select(urls) == 'http://inside:9000'
@@ -0,0 +1,69 @@
+import pytest
+from cfs3.s3glob import compile_glob, iter_glob
+from cfs3.s3core import lswild
+from .utils.fake_minio import FakeMinio
+
+KEYS = [
+    'top.nc',
+    'a/x/b1.nc', 'a/x/b2.txt', 'a/x/c1.nc',
+    'a/y/b3.nc', 'a/y/deep/b4.nc',
+    'b/x/b5.nc',
+    'c_1/d%e.nc',
+]
+
+
+@pytest.fixture
+def fake():
+    return FakeMinio(KEYS)
+
+
+@pytest.mark.parametrize('pattern, key, expected', [
+    ('*.nc', 'top.nc', True),
+    ('*.nc', 'a/x/b1.nc', False),
+    ('a/*/b*.nc', 'a/x/b1.nc', True),
+    ('a/*/b*.nc', 'a/y/deep/b4.nc', False),
+    ('a/**/b*.nc', 'a/y/deep/b4.nc', True),
+    ('a/**/b*.nc', 'a/b0.nc', True),
+    ('a/?/[bc]1.nc', 'a/x/c1.nc', True),
+    ('a/?/[!bc]1.nc', 'a/x/c1.nc', False),
+    ('c_1/d%e.nc', 'c_1/d%e.nc', True),
+    ('[!]a]b', ']b', False),
+    ('[!]a]b', 'ab', False),
+    ('[!]a]b', 'cb', True),
+    ('[]a]b', ']b', True),
+    ('[[a]b', '[b', True),
+])
+def test_compile_glob(pattern, key, expected):
+    assert compile_glob(pattern).match(key) is expected
+
+
+def test_literal_prefix():
+    assert compile_glob('a/x/b*.nc').prefix == 'a/x/b'
+    assert compile_glob('a/*/b*.nc').prefix == 'a/'
+
+
+def test_iter_glob_expands_only_matching_dirs(fake):
+    found = [o.object_name for o in iter_glob(fake, 'bucket', 'a/*/b*.nc')]
+    assert found == ['a/x/b1.nc', 'a/y/b3.nc']
+    # one listing for "a/", then one per matching directory
+    assert fake.calls['list_objects'] == 3
+
+
+def test_iter_glob_double_star(fake):
+    found = [o.object_name for o in iter_glob(fake, 'bucket', '**/b*.nc')]
+    assert found == ['a/x/b1.nc', 'a/y/b3.nc', 'a/y/deep/b4.nc', 'b/x/b5.nc']
+
+
+def test_lswild_names_and_objects(fake):
+    assert lswild(fake, 'bucket', '*.nc') == ['top.nc']
+    objects = lswild(fake, 'bucket', 'a/x/*.nc', objects=True)
+    assert [o.size for o in objects] == [10, 10]
+
+
+def test_ilswild_stops_early(fake):
+    from cfs3.s3core import ilswild
+    # the root has a limit of one match, so "b/" is never expanded
+    found = list(ilswild(fake, 'bucket', '*/x/b*.nc', limit=1))
+    assert found == ['a/x/b1.nc']
+    assert fake.calls['list_objects'] == 2
+    assert lswild(fake, 'bucket', '**/*.nc', limit=2) == ['a/x/b1.nc', 'a/x/c1.nc']
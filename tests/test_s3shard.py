@@ -0,0 +1,99 @@
+import pytest
+import sys
+import threading
+import time
+import traceback
+from cfs3 import s3shard
+from cfs3.s3async import map_concurrently
+from cfs3.s3core import DEFAULT_POOL_SIZE
+from cfs3.s3shard import sharded_list_objects, range_boundaries
+from .utils.fake_minio import FakeMinio
+
+DEEP = [f'{d}/{s}/f{i}.nc' for d in 'abcde' for s in 'xy' for i in range(5)] + ['a.nc', 'z.nc']
+FLAT = [f'p/{c}{i:04d}.nc' for c in 'AaBbZz09' for i in range(300)]
+
+
+@pytest.mark.parametrize('strategy', ['auto', 'prefix', 'range'])
+def test_sharded_listing_matches_plain_listing(strategy):
+    fake = FakeMinio(DEEP)
+    plain = [o.object_name for o in fake.list_objects('bucket', recursive=True)]
+    sharded = [o.object_name for o in sharded_list_objects(fake, 'bucket', strategy=strategy, shards=7)]
+    assert sharded == plain
+
+
+def test_flat_level_is_range_sharded():
+    fake = FakeMinio(FLAT)
+    plain = [o.object_name for o in fake.list_objects('bucket', prefix='p/', recursive=True)]
+    fake.calls.clear()
+    sharded = [o.object_name for o in sharded_list_objects(fake, 'bucket', prefix='p/', shards=8)]
+    assert sharded == plain
+    # one probe, then one listing per shard
+    assert fake.calls['list_objects'] == 9
+
+
+def test_non_recursive_range_keeps_directories():
+    fake = FakeMinio(DEEP)
+    plain = [o.object_name for o in fake.list_objects('bucket')]
+    sharded = [o.object_name for o in sharded_list_objects(fake, 'bucket', recursive=False,
+                                                           strategy='range', shards=5)]
+    assert sharded == plain
+
+
+def test_early_stop():
+    fake = FakeMinio(FLAT)
+    listing = sharded_list_objects(fake, 'bucket', prefix='p/', strategy='range', shards=4)
+    first = [next(listing).object_name for _ in range(3)]
+    listing.close()
+    assert first == sorted(FLAT)[:3]
+
+
+def test_early_stop_leaves_no_producers(monkeypatch):
+    # small queues, and shards which fill them exactly, so a producer would
+    # be left waiting to say it had finished
+    monkeypatch.setattr(s3shard, 'PAGE_SIZE', 1)
+    fake = FakeMinio([f'{c}{i}.nc' for c in 'ab' for i in range(4)])
+    listers = [lambda c=c: fake.list_objects('bucket', prefix=c, recursive=True) for c in 'ab']
+    listing = s3shard._run_shards(listers, concurrency=2)
+    assert next(listing).object_name == 'a0.nc'
+    time.sleep(0.2)
+    listing.close()
+
+    def producing():
+        return [f for f in sys._current_frames().values()
+                if any(frame.f_code.co_filename == s3shard.__file__ for frame, _ in traceback.walk_stack(f))]
+
+    deadline = time.time() + 2
+    while producing() and time.time() < deadline:
+        time.sleep(0.05)
+    assert not producing()
+
+
+def test_shards_run_on_the_shared_executor(monkeypatch):
+    monkeypatch.setattr(s3shard, 'PAGE_SIZE', 1)
+    fake = FakeMinio([f'{c}{i}.nc' for c in 'abc' for i in range(20)])
+    names = set()
+
+    def lister(c):
+        names.add(threading.current_thread().name)
+        return fake.list_objects('bucket', prefix=c, recursive=True)
+
+    # more stalled listings than there are shared threads
+    listings = [s3shard._run_shards([lambda c=c: lister(c) for c in 'abc'], concurrency=3)
+                for _ in range(DEFAULT_POOL_SIZE + 8)]
+    for listing in listings:
+        next(listing)
+    time.sleep(0.2)
+    # their producers have given the threads back, so other fan-outs still run
+    done = []
+    fanout = threading.Thread(target=lambda: done.append(map_concurrently(lambda x: x, range(64))))
+    fanout.start()
+    fanout.join(5)
+    assert done and len(done[0]) == 64
+    assert all(name.startswith('cfs3-s3') for name in names)
+    for listing in listings:
+        assert len(list(listing)) == 59
+
+
+def test_range_boundaries_sorted():
+    b = range_boundaries('p/', 16)
+    assert b == sorted(set(b)) and len(b) == 15
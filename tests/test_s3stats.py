@@ -0,0 +1,79 @@
+import pytest
+from minio.error import S3Error
+from cfs3.s3stats import InstrumentedClient, RequestStats, CacheStats
+from .utils.fake_minio import FakeMinio
+
+
+def test_instrumented_client_counts_requests():
+    fake = FakeMinio([f'k{i:04d}' for i in range(2500)])
+    client = InstrumentedClient(fake)
+    assert len(list(client.list_objects('bucket', recursive=True))) == 2500
+    client.stat_object('bucket', 'k0001')
+    with pytest.raises(S3Error):
+        client.stat_object('bucket', 'missing')
+    summary = client.stats.summary()
+    # one LIST per page
+    assert summary['list_objects']['count'] == 3
+    assert summary['list_objects']['verb'] == 'LIST'
+    assert summary['stat_object']['count'] == 2
+    assert summary['stat_object']['errors'] == 1
+    assert summary['stat_object']['p50'] <= summary['stat_object']['p99']
+    # anything else is passed straight through
+    assert client.objects is fake.objects
+
+
+def test_stats_by_context():
+    stats = RequestStats()
+    stats.context = 'ls'
+    stats.record('stat_object', 0.01)
+    stats.context = 'cd'
+    stats.record('stat_object', 0.02)
+    assert stats.summary()['stat_object']['count'] == 2
+    by_command = stats.summary(by_context=True)
+    assert by_command[('ls', 'stat_object')]['count'] == 1
+    stats.reset()
+    assert stats.summary() == {}
+
+
+def test_cache_stats():
+    stats = CacheStats()
+    stats.record('b', 'stat_object', 'miss', 0.3)
+    stats.record('b', 'stat_object', 'miss', 0.1)
+    stats.record('b', 'stat_object', 'hit', 0.001)
+    stats.record('b', 'stat_object', 'negative', 0.001)
+    stats.evicted('b', 3)
+    summary = stats.summary()
+    op = summary['b']['stat_object']
+    assert (op['count'], op['miss'], op['hit'], op['negative']) == (4, 2, 1, 1)
+    assert op['hit_ratio'] == 0.5
+    # two answers which would have taken 0.2s each at the mean miss time
+    assert op['saved_seconds'] == pytest.approx(0.398)
+    assert summary['b']['evict'] == {'count': 3}
+    stats.reset()
+    assert stats.summary() == {}
+
+
+class _BulkDeleter:
+    """ Deletes like Minio: in requests of up to 1000 keys, yielding only the failures """
+    def __init__(self):
+        self.requests = 0
+
+    def remove_objects(self, bucket, delete_object_list):
+        keys = iter(delete_object_list)
+        while True:
+            batch = [k for _, k in zip(range(1000), keys)]
+            if not batch:
+                return
+            self.requests += 1
+            yield from (k for k in batch if k.startswith('locked'))
+
+
+def test_bulk_deletes_count_requests_sent():
+    deleter = _BulkDeleter()
+    client = InstrumentedClient(deleter)
+    assert list(client.remove_objects('bucket', (f'k{i}' for i in range(2500)))) == []
+    assert client.stats.summary()['remove_objects']['count'] == deleter.requests == 3
+    client.stats.reset()
+    keys = [f'locked{i}' for i in range(1500)]
+    assert len(list(client.remove_objects('bucket', keys))) == 1500
+    assert client.stats.summary()['remove_objects']['count'] == 2
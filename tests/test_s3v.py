@@ -1,6 +1,8 @@
 import pytest
 from unittest.mock import MagicMock
 from cfs3.s3cmd import s3cmd
+from cfs3.s3cache import CacheMode, PersistentCachedMinio
+from .utils.fake_minio import FakeMinio
 import time
 import json
 import io
@@ -12,6 +14,7 @@ dummy_config = '{"aliases":{"loc1":{"url":"https://blah.com","accessKey":"a key"
 @pytest.fixture
 def mock_cfs3(mocker):
     mocker.patch('cfs3.s3cmd.get_client')
+    mocker.patch('cfs3.s3cmd.CACHE_DIR', ':memory:')
     mocker.patch('cfs3.s3cmd.get_locations', 
                     return_value=json.loads(dummy_config)['aliases']['loc1'])
     app = s3cmd(path='loc1')
@@ -48,3 +51,96 @@ def test_do_cb_changes_bucket(capsys, mock_cfs3):
 
     print(captured.out)
     
+
+
+def test_do_cb_finds_a_new_bucket(mock_cfs3):
+    fake = FakeMinio()
+    mock_cfs3.client = PersistentCachedMinio(fake, db_path=':memory:')
+    mock_cfs3.buckets = [b.name for b in mock_cfs3.client.list_buckets()]
+    fake.make_bucket('new')
+    mock_cfs3.onecmd('cb new')
+    assert mock_cfs3.bucket == 'new'
+    assert 'does not exist' not in mock_cfs3.stdout.getvalue()
+    mock_cfs3.onecmd('cb missing')
+    assert 'Bucket [missing] does not exist' in mock_cfs3.stdout.getvalue()
+
+
+def test_do_ls_shows_tags(mock_cfs3):
+    fake = FakeMinio()
+    fake.add('top.nc', tags={'project': 'x'})
+    fake.add('untagged.nc')
+    mock_cfs3.client = PersistentCachedMinio(fake, db_path=':memory:')
+    mock_cfs3.bucket, mock_cfs3.path = 'bucket', ''
+    # what we cached before didn't have the tags
+    list(mock_cfs3.client.list_objects('bucket', recursive=True))
+    mock_cfs3.onecmd('ls -t')
+    lines = {line.split()[0]: line.split(None, 1)[1] for line in mock_cfs3.stdout.getvalue().splitlines()
+             if line.split() and line.split()[0].endswith('.nc')}
+    assert lines == {'top.nc': "{'project': 'x'}", 'untagged.nc': 'None'}
+
+
+def test_do_stats(mock_cfs3):
+    mock_cfs3.stats.context = 'ls'
+    mock_cfs3.stats.record('stat_object', 0.003)
+    mock_cfs3.onecmd('stats -c')
+    output = mock_cfs3.stdout.getvalue()
+    assert 'ls: stat_object' in output
+    assert 'HEAD' in output
+
+
+def test_do_cache(mock_cfs3):
+    mock_cfs3.onecmd('cache offline')
+    assert mock_cfs3.cache.mode == CacheMode.CACHE_ONLY
+    mock_cfs3.onecmd('cache ttl 60')
+    mock_cfs3.onecmd('cache')
+    output = mock_cfs3.stdout.getvalue()
+    assert 'Mode: offline  TTL: 60s' in output
+    assert 'Holding 0 objects' in output
+    mock_cfs3.onecmd('cache mode stale')
+    assert mock_cfs3.cache.mode == CacheMode.STALE_WHILE_REVALIDATE
+    # clearing starts the location's database afresh, with the same settings
+    cache = mock_cfs3.cache
+    mock_cfs3.onecmd('cache clear')
+    assert mock_cfs3.cache is not cache and mock_cfs3.client is mock_cfs3.cache
+    assert mock_cfs3.cache.mode == CacheMode.STALE_WHILE_REVALIDATE
+    assert mock_cfs3.caches.aliases() == ['loc1']
+
+
+def test_do_search_and_match(mock_cfs3):
+    fake = FakeMinio()
+    fake.add('a.nc', metadata={'X-Amz-Meta-Experiment': 'historical'})
+    fake.add('b.nc', metadata={'X-Amz-Meta-Experiment': 'ssp585'})
+    fake.add('c.nc', metadata={'X-Amz-Meta-Experiment': 'historical'})
+    mock_cfs3.cache = mock_cfs3.client = PersistentCachedMinio(fake, db_path=':memory:')
+    mock_cfs3.bucket, mock_cfs3.path = 'bucket', ''
+    mock_cfs3.cache.warm('bucket')
+    fake.add('c.nc', etag='new', metadata={'X-Amz-Meta-Experiment': 'ssp585'})
+    mock_cfs3.cache.sync('bucket')
+    fake.calls.clear()
+    mock_cfs3.onecmd('search experiment=hist*')
+    assert mock_cfs3.stdout.getvalue().split() == ['a.nc']
+    mock_cfs3.stdout = io.StringIO()
+    # c.nc changed, so only its metadata has to be fetched
+    mock_cfs3.onecmd('match experiment=ssp585')
+    assert mock_cfs3.stdout.getvalue().split() == ['b.nc', 'c.nc']
+    assert fake.calls['stat_object'] == 1
+    # the same comparison is made whether the metadata is cached or fetched
+    fake.add('c.nc', etag='newer', metadata={'X-Amz-Meta-Experiment': 'ssp585-ext'})
+    mock_cfs3.cache.sync('bucket')
+    mock_cfs3.stdout = io.StringIO()
+    mock_cfs3.onecmd('match experiment=ssp*')
+    assert mock_cfs3.stdout.getvalue().split() == ['b.nc', 'c.nc']
+
+
+def test_do_cache_stats(mock_cfs3):
+    mock_cfs3.cache = PersistentCachedMinio(FakeMinio(['a.nc']), db_path=':memory:')
+    mock_cfs3.onecmd('cache stats')
+    assert 'No cache lookups made yet' in mock_cfs3.stdout.getvalue()
+    mock_cfs3.cache.stat_object('bucket', 'a.nc')
+    mock_cfs3.cache.stat_object('bucket', 'a.nc')
+    mock_cfs3.onecmd('cache stats')
+    output = mock_cfs3.stdout.getvalue()
+    assert 'bucket: stat_object' in output
+    assert '50%' in output
+    mock_cfs3.onecmd('cache stats reset')
+    assert mock_cfs3.cache.cache_stats() == {}
@@ -0,0 +1,33 @@
+from cfs3.s3up import Uploader
+from cfs3.s3cache import PersistentCachedMinio
+from .utils.fake_minio import FakeMinio
+
+
+def test_uploader_writes_through(mocker, tmp_path):
+    fake = FakeMinio()
+    mocker.patch('cfs3.s3up.get_client', return_value=fake)
+    uploader = Uploader('loc1', default_bucket='bucket', cache_db=':memory:')
+    path = tmp_path / 'a.nc'
+    path.write_bytes(b'123')
+    uploader.upload_file(path, metadata={'standard_name': 'air_temperature'})
+    fake.calls.clear()
+    co = uploader.client.stat_object('bucket', 'a.nc', include_user_meta=True)
+    assert co.size == 3
+    assert co.metadata['x-amz-meta-standard-name'] == 'air_temperature'
+    assert not fake.calls
+    uploader.close()
+
+
+def test_uploader_cache_is_opt_in(mocker, tmp_path):
+    fake = FakeMinio()
+    mocker.patch('cfs3.s3up.get_client', return_value=fake)
+    assert not isinstance(Uploader('loc1', default_bucket='bucket').client, PersistentCachedMinio)
+    for name in ('a.nc', 'b.nc'):
+        (tmp_path / name).write_bytes(b'123')
+    with Uploader('loc1', default_bucket='bucket', cache_db=str(tmp_path / 'cache.db')) as uploader:
+        flush = mocker.spy(uploader.client, 'flush')
+        uploader.upload_files(tmp_path / '*.nc', 'bucket')
+        # once for the lot, not once per file
+        assert flush.call_count == 1
+        assert uploader.client._pending == {}
+    assert uploader.client._closed.is_set()
@@ -0,0 +1,97 @@
+from collections import Counter
+from datetime import datetime, timezone
+from minio.datatypes import Object, Bucket
+from minio.error import S3Error, ServerError
+from minio.helpers import ObjectWriteResult
+
+
+class FakeMinio:
+    """
+    Minimal in-memory stand in for a Minio client, which honours prefix,
+    delimiter (recursive=False) and start_after semantics for listings,
+    and counts the calls made against it.
+    """
+
+    def __init__(self, keys=(), bucket='bucket'):
+        self.bucket = bucket
+        self.buckets = {bucket}
+        self.objects = {}
+        self.calls = Counter()
+        for key in keys:
+            self.add(key)
+
+    def add(self, key, size=10, etag=None, metadata=None, tags=None):
+        self.objects[key] = dict(size=size,
+                                 etag=etag or f'etag-{key}',
+                                 last_modified=datetime(2025, 1, 1, tzinfo=timezone.utc),
+                                 metadata=metadata or {},
+                                 tags=tags)
+
+    def _object(self, bucket, key, include_user_meta=False, listing=False):
+        o = self.objects[key]
+        # like MinIO, listings with user metadata include the tags too
+        return Object(bucket_name=bucket, object_name=key,
+                      last_modified=o['last_modified'], etag=o['etag'],
+                      size=o['size'],
+                      metadata=dict(o['metadata']) if include_user_meta else {},
+                      tags=o['tags'] if include_user_meta and listing else None)
+
+    def list_objects(self, bucket, prefix=None, recursive=False,
+                     start_after=None, include_user_meta=False, **kwargs):
+        self.calls['list_objects'] += 1
+        prefix = prefix or ''
+        seen = set()
+        for key in sorted(self.objects):
+            if not key.startswith(prefix):
+                continue
+            if start_after is not None and key <= start_after:
+                continue
+            rest = key[len(prefix):]
+            if not recursive and '/' in rest:
+                d = prefix + rest.split('/')[0] + '/'
+                if d not in seen:
+                    seen.add(d)
+                    yield Object(bucket_name=bucket, object_name=d)
+                continue
+            yield self._object(bucket, key, include_user_meta, listing=True)
+
+    def stat_object(self, bucket, key, extra_headers=None, **kwargs):
+        self.calls['stat_object'] += 1
+        if key not in self.objects:
+            raise S3Error(None, 'NoSuchKey', 'Object does not exist', f'/{bucket}/{key}',
+                          None, None, bucket, key)
+        if (extra_headers or {}).get('If-None-Match') == f'"{self.objects[key]["etag"]}"':
+            raise ServerError('server failed with HTTP status code 304', 304)
+        return self._object(bucket, key, include_user_meta=True)
+
+    def get_object_tags(self, bucket, key, **kwargs):
+        self.calls['get_object_tags'] += 1
+        if key not in self.objects:
+            raise S3Error(None, 'NoSuchKey', 'Object does not exist', f'/{bucket}/{key}',
+                          None, None, bucket, key)
+        return self.objects[key]['tags']
+
+    def remove_object(self, bucket, key, **kwargs):
+        self.calls['remove_object'] += 1
+        self.objects.pop(key, None)
+
+    def fput_object(self, bucket, key, file_path, content_type='application/octet-stream',
+                    metadata=None, **kwargs):
+        self.calls['fput_object'] += 1
+        with open(file_path, 'rb') as f:
+            size = len(f.read())
+        self.add(key, size=size, etag=f'etag-{key}-{self.calls["fput_object"]}',
+                 metadata={f'X-Amz-Meta-{k}': v for k, v in (metadata or {}).items()})
+        return ObjectWriteResult(bucket, key, None, self.objects[key]['etag'], {})
+
+    def bucket_exists(self, bucket):
+        self.calls['bucket_exists'] += 1
+        return bucket in self.buckets
+
+    def list_buckets(self):
+        self.calls['list_buckets'] += 1
+        return [Bucket(name, None) for name in sorted(self.buckets)]
+
+    def make_bucket(self, bucket, **kwargs):
+        self.calls['make_bucket'] += 1
+        self.buckets.add(bucket)